@@ -48,14 +48,37 @@ from lab_devices.conifg.config_handler import update_config
 import utils.plot_fit as pltfit
 from host.bode_plot_analyzer import analyse_bode_plot
 import utils.data_handler as data_handler
+from utils.pipeline import ordered_pipeline
 import matplotlib.pyplot as plt
 import yaml
 import sys
 
 image_format = '.pdf'
 
+# Cosine fits of input and output of one point, runs in the worker processes of the pipeline
+# Returns the amplitudes and errors (VIN, VIN_err, VOUT, VOUT_err), nan if a fit does not converge
+def analyse_point(f, waveform_x, waveform_in, waveform_out, scale, plot_file=None):
+    try:
+        p_in_guess = pltfit.guess_cos_params(f=f,y=waveform_in)
+        popt_in, perr_in = pltfit.fit_no_err(pltfit.func_cos, waveform_x, waveform_in,p_in_guess)
+        p_out_guess = pltfit.guess_cos_params(f=f,y=waveform_out)
+        popt_out, perr_out = pltfit.fit_no_err(pltfit.func_cos, waveform_x, waveform_out,p_out_guess)
+    except (RuntimeError, TypeError, ValueError) as e:
+        print('Fit failed at', f, 'Hz:', e)
+        return np.nan, np.nan, np.nan, np.nan
+    if plot_file:
+        pltfit.beauty_plot(xlabel='time t / s',ylabel='Voltage / V',ylim=[-4*scale, 4*scale])
+        plt.scatter(waveform_x, waveform_in, label='Input')
+        plt.scatter(waveform_x, waveform_out, label='Output')
+        plt.plot(waveform_x, pltfit.func_cos(waveform_x, popt_in[0], popt_in[1], popt_in[2], popt_in[3]), color='black')
+        plt.plot(waveform_x, pltfit.func_cos(waveform_x, popt_out[0], popt_out[1], popt_out[2], popt_out[3]), color='black')
+        plt.legend()
+        plt.savefig(plot_file)
+        plt.close()
+    return popt_in[0], perr_in[0], popt_out[0], perr_out[0]
+
 def AC_sweep(load_data=False,DC=False):
-    dut_config = update_config('./lab_devices/conifg/LF_SFF_AC_weep.csv')
+    dut_config = update_config('./lab_devices/conifg/LF_SFF_AC_Sweep.csv')
     IBN = [80,82,85,87,90,92,95,97,100]
     IBP = [-5,-6,-7,-8,-9,-10]
     I_unit = 'uA'
@@ -104,13 +127,10 @@ def AC_sweep(load_data=False,DC=False):
         print('\nSet DC_offset to fallback, because DC sweep results could not be loaded\n')
 
     if not load_data:      
-        try:
-            dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
-            dut.init()
-            dut.boot_seq()
-            dut.load_defaults(VRESET = DC_offset)
-        except:
-            print('Firmware not flashed. This can be because a firmware was already flashed or your setup is broken')
+        dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
+        dut.init(fast=True)
+        dut.boot_seq()
+        dut.load_defaults(VRESET = DC_offset)
 
         dut['CONTROL']['RESET'] = 0x0
         dut['CONTROL'].write()
@@ -139,80 +159,66 @@ def AC_sweep(load_data=False,DC=False):
         IBP_VOUT = [[] for i in range(0, len(IBP))]
         IBP_VOUT_err = [[] for i in range(0, len(IBP))]
         
-        for f in frequencies:
-            dut_config.check_config(dut)
-            if f in frequency_oszi:
-                set_oszi_freq = f
-            else:
-                for i in range(1,6):
-                    if (f-i*len(str(f)[1:]) in frequency_oszi):
-                        set_oszi_freq = i*len(str(f)[1:])
-                        break
-            print('-----------------\n',f,' Hz')
-            func_gen['Pulser'].set_pulse_period(1/f)
-            oszi['Oscilloscope'].set_horizontal_scale(1/set_oszi_freq)
-
-            for I in IBN:
-                print('IBN =', I,'uA')
-                pos = IBN.index(I)
-                dut['IBN'].set_current(I,unit=I_unit)
-                if f <= 100:
-                    time.sleep(5)
+        # single point plots of the fits, only rendered (by the pipeline) if requested
+        plots = 'plots' in sys.argv[1:]
+        workers = int(sys.argv[sys.argv[1:].index('--workers')+2]) if '--workers' in sys.argv[1:] else None
+        # acquisition in this process, the cosine fits (and plots) of a point run in the pipeline
+        # while the next point settles, results are collected in measurement order
+        with ordered_pipeline(workers=workers) as pipeline:
+            for f in frequencies:
+                dut_config.check_config(dut)
+                if f in frequency_oszi:
+                    set_oszi_freq = f
                 else:
-                    time.sleep(0.5)
-                IBN_meas[pos].append(dut['IBN'].get_current(unit=I_unit))
-                waveform_in = oszi['Oscilloscope'].get_waveform(channel=1, continue_meas=False)
-                waveform_in_x = oszi.gen_waveform_x(waveform_in)
-                p_in_guess = pltfit.guess_cos_params(f=f,y=waveform_in[1])
-                popt_in, perr_in = pltfit.fit_no_err(pltfit.func_cos, waveform_in_x, waveform_in[1],p_in_guess)        
-                waveform_out = oszi['Oscilloscope'].get_waveform(channel=2, continue_meas=True)
-                waveform_out_x = oszi.gen_waveform_x(waveform_out)
-                p_out_guess = pltfit.guess_cos_params(f=f,y=waveform_out[1])
-                popt_out, perr_out = pltfit.fit_no_err(pltfit.func_cos, waveform_out_x, waveform_out[1],p_out_guess)
-                pltfit.beauty_plot(xlabel='time t / s',ylabel='Voltage / V',ylim=[-4*waveform_in[3][0], 4*waveform_in[3][0]])
-                plt.scatter(waveform_in_x, waveform_in[1], label='Input')
-                plt.scatter(waveform_out_x, waveform_out[1], label='Output')
-                plt.plot(waveform_in_x, pltfit.func_cos(waveform_in_x, popt_in[0], popt_in[1], popt_in[2], popt_in[3]), color='black')
-                plt.plot(waveform_in_x, pltfit.func_cos(waveform_in_x, popt_out[0], popt_out[1], popt_out[2], popt_out[3]), color='black')
-                plt.legend()
-                #plt.savefig(image_path+'IBN_'+str(f)+'_'+str(I)+image_format)
-                plt.close()
-                IBN_VOUT[pos].append(popt_out[0])
-                IBN_VOUT_err[pos].append(perr_out[0])
-                IBN_VIN[pos].append(popt_in[0])
-                IBN_VIN_err[pos].append(perr_in[0])
-
-            dut['IBN'].set_current(IBN[-1],unit=I_unit)
-            for I in IBP:
-                print('IBP =', I,'uA')
-                pos = IBP.index(I)
-                dut['IBP'].set_current(I,unit=I_unit)
-                if f <= 100:
-                    time.sleep(5)
-                else:
-                    time.sleep(0.5)
-                IBP_meas[pos].append(dut['IBP'].get_current(unit=I_unit))
-                waveform_in = oszi['Oscilloscope'].get_waveform(channel=1, continue_meas=False)
-                waveform_in_x = oszi.gen_waveform_x(waveform_in)
-                p_in_guess = pltfit.guess_cos_params(f=f,y=waveform_in[1])
-                popt_in, perr_in = pltfit.fit_no_err(pltfit.func_cos, waveform_in_x, waveform_in[1],p_in_guess)        
-                waveform_out = oszi['Oscilloscope'].get_waveform(channel=2, continue_meas=True)
-                waveform_out_x = oszi.gen_waveform_x(waveform_out)
-                p_out_guess = pltfit.guess_cos_params(f=f,y=waveform_out[1])
-                popt_out, perr_out = pltfit.fit_no_err(pltfit.func_cos, waveform_out_x, waveform_out[1],p_out_guess)
-                pltfit.beauty_plot(xlabel='time t / s',ylabel='Voltage / V',ylim=[-4*waveform_in[3][0], 4*waveform_in[3][0]])
-                plt.scatter(waveform_in_x, waveform_in[1], label='Input')
-                plt.scatter(waveform_out_x, waveform_out[1], label='Output')
-                plt.plot(waveform_in_x, pltfit.func_cos(waveform_in_x, popt_in[0], popt_in[1], popt_in[2], popt_in[3]), color='black')
-                plt.plot(waveform_in_x, pltfit.func_cos(waveform_in_x, popt_out[0], popt_out[1], popt_out[2], popt_out[3]), color='black')
-                plt.legend()
-                #plt.savefig(image_path+'IBP_'+str(f)+'_'+str(I)+image_format)
-                plt.close()
-                IBP_VOUT[pos].append(popt_out[0])
-                IBP_VOUT_err[pos].append(perr_out[0])
-                IBP_VIN[pos].append(popt_in[0])
-                IBP_VIN_err[pos].append(perr_in[0])
-
+                    for i in range(1,6):
+                        if (f-i*len(str(f)[1:]) in frequency_oszi):
+                            set_oszi_freq = i*len(str(f)[1:])
+                            break
+                print('-----------------\n',f,' Hz')
+                func_gen.set_pulse_period(1/f)
+                oszi.set_horizontal_scale(1/set_oszi_freq)
+                if 'full_record' not in sys.argv[1:]:
+                    # the fit only needs a few periods, not the whole record
+                    oszi.set_periods_window(f)
+
+                for I in IBN:
+                    print('IBN =', I,'uA')
+                    pos = IBN.index(I)
+                    dut['IBN'].set_current(I,unit=I_unit)
+                    if f <= 100:
+                        time.sleep(5)
+                    else:
+                        time.sleep(0.5)
+                    IBN_meas[pos].append(dut['IBN'].get_current(unit=I_unit))
+                    # input (CH1) and output (CH2) of the same acquisition
+                    waveform_x, (waveform_in, waveform_out) = oszi.get_waveforms(channels=[1, 2])
+                    # fitted in the pipeline, meanwhile the next point settles and is transferred
+                    plot_file = image_path+'IBN_'+str(f)+'_'+str(I)+image_format if plots else None
+                    pipeline.submit(('IBN', pos), analyse_point, f, waveform_x, waveform_in, waveform_out, oszi.get_preamble(1)['scale'], plot_file)
+
+                dut['IBN'].set_current(IBN[-1],unit=I_unit)
+                for I in IBP:
+                    print('IBP =', I,'uA')
+                    pos = IBP.index(I)
+                    dut['IBP'].set_current(I,unit=I_unit)
+                    if f <= 100:
+                        time.sleep(5)
+                    else:
+                        time.sleep(0.5)
+                    IBP_meas[pos].append(dut['IBP'].get_current(unit=I_unit))
+                    # input (CH1) and output (CH2) of the same acquisition
+                    waveform_x, (waveform_in, waveform_out) = oszi.get_waveforms(channels=[1, 2])
+                    # fitted in the pipeline, meanwhile the next point settles and is transferred
+                    plot_file = image_path+'IBP_'+str(f)+'_'+str(I)+image_format if plots else None
+                    pipeline.submit(('IBP', pos), analyse_point, f, waveform_x, waveform_in, waveform_out, oszi.get_preamble(1)['scale'], plot_file)
+
+            results = {'IBN': [IBN_VIN, IBN_VIN_err, IBN_VOUT, IBN_VOUT_err], 'IBP': [IBP_VIN, IBP_VIN_err, IBP_VOUT, IBP_VOUT_err]}
+            for (bias, pos), result in pipeline.results():
+                for values, value in zip(results[bias], result):
+                    values[pos].append(value)
+
+        for shadow in list(oszi.shadows.values())+list(func_gen.shadows.values()):
+            shadow.log_stats()
 
         # Save data
         for j in range(0, len(IBN)):
@@ -404,4 +410,5 @@ def AC_sweep(load_data=False,DC=False):
     #####
     data_handler.success_message(data_path, image_path)
       
-AC_sweep()
\ No newline at end of file
+if __name__ == '__main__':
+    AC_sweep()
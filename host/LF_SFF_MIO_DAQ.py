@@ -35,6 +35,7 @@ commands = {'help':'Prints out all commands',
             'defaults':'Loads the LF_SFF defaults',
             'set':'Sets a channel X to the Value Y',
             'get':'Gets a value of a channel',
+            'status':'Prints voltage and current of all supplies and biases',
             'run':'Runs a preprogrammed test X',
             'exit':'Exits the program'
             }
@@ -82,16 +83,18 @@ while True:
     if 'flash' == inputs[0]:
         try:
             dut = LF_SFF_MIO(cnfg)
-            dut.init()
+            dut.init(fast=True)
             dut.boot_seq()
             dut.load_defaults(print_out=False)
-            dut.set_acquire_state('RUN')
-        except:
-            print('INITIALIZATION ERROR! PLEASE VERIFY THAT THE DUT IS CONNECTED PROPERLY')
+        except (IOError, ValueError) as e:
+            print('INITIALIZATION ERROR! PLEASE VERIFY THAT THE DUT IS CONNECTED PROPERLY:', e)
     
     if 'exit' == inputs[0]:
         break
 
+    if 'status' == inputs[0]:
+        print(dut.read_status())
+
     if 'get' == inputs[0]:
         if len(inputs)>=2:
             channel = inputs[1]
@@ -19,10 +19,12 @@
 
 import time
 import numpy as np
+from scipy.stats import norm
 
 from lab_devices.LF_SFF_MIO import LF_SFF_MIO
 from lab_devices.oscilloscope import oscilloscope
 from lab_devices.function_generator import function_generator
+from lab_devices.slow_control_monitor import slow_control_monitor
 import utils.plot_fit as pltfit
 import utils.data_handler as data_handler
 from lab_devices.conifg.config_handler import update_config
@@ -38,7 +40,7 @@ import sys
 image_format = '.pdf'
 
 def DC_sweep(DC=False, use_pix_in=False, load_data=False, use_oszi = False):
-    dut_config = update_config('./lab_devices/conifg/LF_SFF_DC_weep.csv')
+    dut_config = update_config('./lab_devices/conifg/LF_SFF_DC_Sweep.csv')
 
     #Define IBN, IBP, VRESET scan range
     IBN = [80,82,85,87,90,92,95,97,100]
@@ -68,18 +70,37 @@ def DC_sweep(DC=False, use_pix_in=False, load_data=False, use_oszi = False):
         load_data = True
 
     if not load_data:
-        try:
-            dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
-            dut.init()
-            dut.boot_seq()
-            dut.load_defaults(VRESET = VRESET_start)
-        except:
-            print('Firmware not flashed. This can be because a firmware was already flashed or your setup is broken')
+        dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
+        dut.init(fast=True)
+        dut.boot_seq()
+        dut.load_defaults(VRESET = VRESET_start)
+        if 'monitor' in sys.argv[1:]:
+            # records the supplies and biases during the sweep, e.g. to spot drifts of VDD
+            monitor = slow_control_monitor(dut, interval=1., file=data_path+'slow_control.csv')
+            monitor.start()
         if use_oszi:
             oszi = oscilloscope(yaml.load(open("./lab_devices/tektronix_tds_3034b.yaml", 'r'), Loader=yaml.Loader))
             oszi.init()
             
             oszi.load_dc_sweep_config()
+            # V_OUT from the measurement slots of the scope, with 'trace' from the full CH2 waveform
+            use_trace = 'trace' in sys.argv[1:]
+            oszi.setup_measurements({'VOUT': ('MEAN', 2), 'VOUT_PK2PK': ('PK2pk', 2)})
+            # The TDS3000 has no standard deviation measurement. For gaussian noise the peak to peak value of
+            # a record of N points is on average d(N) standard deviations (expected range, Blom's approximation),
+            # d = 7.67 for 10000 points, so the error stays the std of the trace as with 'trace'.
+            n_points = oszi.get_record_length()
+            pk2pk_per_std = 2*norm.ppf((n_points-0.375)/(n_points+0.25))
+
+        # V_OUT and its error in mV
+        def read_vout():
+            if not use_oszi:
+                return dut['AUX_ADC'].get_voltage(unit='mV'), 10
+            if use_trace:
+                waveform = oszi.get_waveform(channel=2, continue_meas=True)[1]
+                return (np.average(waveform)-baseline)*1000, np.std(waveform)*1000
+            vout = oszi.get_measurements()
+            return (vout['VOUT']-baseline)*1000, vout['VOUT_PK2PK']/pk2pk_per_std*1000
 
         #################################
         # Begin Measurement 
@@ -102,15 +123,15 @@ def DC_sweep(DC=False, use_pix_in=False, load_data=False, use_oszi = False):
             dut['CONTROL'].write()
             time.sleep(2)
             if use_oszi:
-                vertical_pos = float(oszi['Oscilloscope'].get_vertical_position(channel=2).split(' ')[1])
-                vertical_scale = float(oszi['Oscilloscope'].get_vertical_scale(channel=2).split(' ')[1])
+                vertical_pos = oszi['Oscilloscope'].get_value('vertical_position', channel=2)
+                vertical_scale = oszi['Oscilloscope'].get_value('vertical_scale', channel=2)
                 baseline = vertical_pos*vertical_scale
             time.sleep(1)
         
         else:
             if use_oszi:
-                vertical_pos = float(oszi['Oscilloscope'].get_vertical_position(channel=2).split(' ')[1])
-                vertical_scale = float(oszi['Oscilloscope'].get_vertical_scale(channel=2).split(' ')[1])
+                vertical_pos = oszi['Oscilloscope'].get_value('vertical_position', channel=2)
+                vertical_scale = oszi['Oscilloscope'].get_value('vertical_scale', channel=2)
                 baseline = vertical_pos*vertical_scale
             dut['CONTROL']['RESET'] = 0x1
             dut['CONTROL'].write()
@@ -126,13 +147,9 @@ def DC_sweep(DC=False, use_pix_in=False, load_data=False, use_oszi = False):
                 dut['IBN'].set_current(I,unit=I_unit)
                 time.sleep(0.5)
                 IBN_meas[pos].append(dut['IBN'].get_current(unit=I_unit))
-                if use_oszi:
-                    waveform = oszi['Oscilloscope'].get_waveform(channel=2, continue_meas=True)[1]
-                    IBN_VOUT[pos].append(((np.average(waveform))-baseline)*1000)
-                    IBN_VOUT_err[pos].append(np.std(waveform)*1000)
-                else:
-                    IBN_VOUT[pos].append((dut['AUX_ADC'].get_voltage(unit='mV')))
-                    IBN_VOUT_err[pos].append(10)
+                vout, vout_err = read_vout()
+                IBN_VOUT[pos].append(vout)
+                IBN_VOUT_err[pos].append(vout_err)
                 IBN_In[pos].append(dut['VRESET'].get_voltage(unit='V')) 
                 IBN_In_err[pos].append(0.002) 
                 print('IBN =', I,'uA', '| V_IN =', np.round(IBN_In[pos][-1],3),'V', '| V_OUT =', np.round(IBN_VOUT[pos][-1]/1000,3),'V')
@@ -142,17 +159,16 @@ def DC_sweep(DC=False, use_pix_in=False, load_data=False, use_oszi = False):
                 dut['IBP'].set_current(I,unit=I_unit)
                 time.sleep(0.5)
                 IBP_meas[pos].append(dut['IBP'].get_current(unit=I_unit))
-                if use_oszi:
-                    waveform = oszi['Oscilloscope'].get_waveform(channel=2, continue_meas=True)[1]
-                    IBP_VOUT[pos].append(((np.average(waveform))-baseline)*1000)
-                    IBP_VOUT_err[pos].append(np.std(waveform)*1000)
-                else:
-                    IBP_VOUT[pos].append((dut['AUX_ADC'].get_voltage(unit='mV')))
-                    IBP_VOUT_err[pos].append(10)
+                vout, vout_err = read_vout()
+                IBP_VOUT[pos].append(vout)
+                IBP_VOUT_err[pos].append(vout_err)
                 IBP_In[pos].append(dut['VRESET'].get_voltage(unit='V'))
                 IBP_In_err[pos].append(0.002) 
                 print('IBP =', I,'uA', '| V_IN =', np.round(IBP_In[pos][-1],3),'V', '| V_OUT =', np.round(IBP_VOUT[pos][-1]/1000,3),'V')
 
+        if 'monitor' in sys.argv[1:]:
+            monitor.stop()
+
         IBN_meas_err = [0.1 for i in range(0, len(IBN_meas))]
         IBP_meas_err = [0.1 for i in range(0, len(IBP_meas))]
 
@@ -86,20 +86,9 @@ def IR_LED(frequency, pulse_width, CH2_DC):
     IBN_end_of_dynamic_area = np.genfromtxt('./output/DC_sweeps/'+chip_version+'/data/IBN_end_of_dynamic_area.csv', delimiter=',')
     DC_offset = np.average([IBP_end_of_dynamic_area[1][1],IBN_end_of_dynamic_area[1][1]])
     
-    try:
-        dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
-        dut.init()
-
-        dut.boot_seq()
-        dut.set_acquire_state('RUN')
-        dut['DIODE_HV'].set_voltage(1, unit='V')
-
-    except:
-        print('Firmware not flashed. This can be because a firmware was already flashed or your setup is broken')
-        exit
-    """dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
-    dut.init()
-    dut.boot_seq()"""
+    dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
+    dut.init(fast=True)
+    dut.boot_seq()
 
     if DC_offset <=1.2:
         dut.load_defaults(VRESET = DC_offset)
@@ -110,8 +99,8 @@ def IR_LED(frequency, pulse_width, CH2_DC):
     while True:
         dut_config.check_config(dut)
         gen_pulse(dut, func_gen)
-        #ch1 = oszi['Oscilloscope'].get_waveform(channel=1, continue_meas=False)
-        #ch2 = oszi['Oscilloscope'].get_waveform(channel=2, continue_meas=True)
+        #ch1 = oszi.get_waveform(channel=1, continue_meas=False)
+        #ch2 = oszi.get_waveform(channel=2, continue_meas=True)
         #pltfit.beauty_plot_two_y_scales(x=oszi.gen_waveform_x(waveform=ch2),data2=ch1[1], data1=ch2[1],xlabel='time / s', ylabel2='Voltage / V', ylabel1='Voltage / V', label2='Function Generator', label1='LF SFF', alpha1=1, alpha2=0.7, show=False, image_path=image_path+'test_sample_'+str(i)+image_format, title='Test Pulse')
 
 
@@ -0,0 +1,35 @@
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+# Starts the stand-ins for the oscilloscope and the function generator (see lab_devices/instrument_sim.py).
+# Run it in a second terminal and load lab_devices/tektronix_tds_3034b_sim.yaml and
+# lab_devices/agilent33250a_pyserial_sim.yaml instead of the yaml files of the real instruments.
+#
+# Options: [--port P] TCP port of the scope (4000), [--link L] device of the generator (/tmp/ttySIM_33250A)
+#
+import sys
+import time
+import logging
+from lab_devices.instrument_sim import bench_signal, start_scope_sim, start_generator_sim
+
+logging.basicConfig(level=logging.INFO)
+
+port = 4000
+link = '/tmp/ttySIM_33250A'
+if '--port' in sys.argv[1:]:
+    port = int(sys.argv[sys.argv[1:].index('--port')+2])
+if '--link' in sys.argv[1:]:
+    link = sys.argv[sys.argv[1:].index('--link')+2]
+
+# scope and generator share the signals, CH1 shows the generator output and CH2 the pixel response
+bench = bench_signal()
+scope = start_scope_sim(port, bench=bench)
+generator = start_generator_sim(link, bench=bench)
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    generator.close()
+    scope.shutdown()
@@ -14,13 +14,10 @@ import matplotlib.gridspec as gridspec
 import yaml
 import sys
 
-try:
-    dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
-    dut.init()
-    dut.boot_seq()
-    dut.load_defaults(VRESET = 0)
-except:
-    print('Firmware not flashed. This can be because a firmware was already flashed or your setup is broken')
+dut = LF_SFF_MIO(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
+dut.init(fast=True)
+dut.boot_seq()
+dut.load_defaults(VRESET = 0)
 
 
 image_format = '.pdf'
@@ -106,8 +103,11 @@ def AC_sweep(DC_off,load_data=False,DC=False):
                         set_oszi_freq = i*len(str(f)[1:])
                         break
             print('-----------------\n',f,' Hz')
-            func_gen['Pulser'].set_pulse_period(1/f)
-            oszi['Oscilloscope'].set_horizontal_scale(1/set_oszi_freq)
+            func_gen.set_pulse_period(1/f)
+            oszi.set_horizontal_scale(1/set_oszi_freq)
+            if 'full_record' not in sys.argv[1:]:
+                # the fit only needs a few periods, not the whole record
+                oszi.set_periods_window(f)
 
 
             if f <=10:
@@ -117,19 +117,17 @@ def AC_sweep(DC_off,load_data=False,DC=False):
             else:
                 time.sleep(0.5)
             meas.append(dut['IBN'].get_current(unit=I_unit))
-            waveform_in = oszi['Oscilloscope'].get_waveform(channel=1, continue_meas=False)
-            waveform_in_x = oszi.gen_waveform_x(waveform_in)
-            p_in_guess = pltfit.guess_cos_params(f=f,y=waveform_in[1])
-            popt_in, perr_in = pltfit.fit_no_err(pltfit.func_cos, waveform_in_x, waveform_in[1],p_in_guess)        
-            waveform_out = oszi['Oscilloscope'].get_waveform(channel=2, continue_meas=True)
-            waveform_out_x = oszi.gen_waveform_x(waveform_out)
-            p_out_guess = pltfit.guess_cos_params(f=f,y=waveform_out[1])
-            popt_out, perr_out = pltfit.fit_no_err(pltfit.func_cos, waveform_out_x, waveform_out[1],p_out_guess)
-            pltfit.beauty_plot(xlabel='time t / s',ylabel='Voltage / V',ylim=[-4*waveform_in[3][0], 4*waveform_in[3][0]])
-            plt.scatter(waveform_in_x, waveform_in[1], label='Input')
-            plt.scatter(waveform_out_x, waveform_out[1], label='Output')
-            plt.plot(waveform_in_x, pltfit.func_cos(waveform_in_x, popt_in[0], popt_in[1], popt_in[2], popt_in[3]), color='black')
-            plt.plot(waveform_in_x, pltfit.func_cos(waveform_in_x, popt_out[0], popt_out[1], popt_out[2], popt_out[3]), color='black')
+            # input (CH1) and output (CH2) of the same acquisition
+            waveform_x, (waveform_in, waveform_out) = oszi.get_waveforms(channels=[1, 2])
+            p_in_guess = pltfit.guess_cos_params(f=f,y=waveform_in)
+            popt_in, perr_in = pltfit.fit_no_err(pltfit.func_cos, waveform_x, waveform_in,p_in_guess)        
+            p_out_guess = pltfit.guess_cos_params(f=f,y=waveform_out)
+            popt_out, perr_out = pltfit.fit_no_err(pltfit.func_cos, waveform_x, waveform_out,p_out_guess)
+            pltfit.beauty_plot(xlabel='time t / s',ylabel='Voltage / V',ylim=[-4*oszi.get_preamble(1)['scale'], 4*oszi.get_preamble(1)['scale']])
+            plt.scatter(waveform_x, waveform_in, label='Input')
+            plt.scatter(waveform_x, waveform_out, label='Output')
+            plt.plot(waveform_x, pltfit.func_cos(waveform_x, popt_in[0], popt_in[1], popt_in[2], popt_in[3]), color='black')
+            plt.plot(waveform_x, pltfit.func_cos(waveform_x, popt_out[0], popt_out[1], popt_out[2], popt_out[3]), color='black')
             plt.legend()
             plt.savefig(image_path+'DC_'+str(DC_offset)+'.png')
             plt.close()
@@ -0,0 +1,232 @@
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+# Readout benchmark of the MIO data path (fadcN_rx -> sram FIFO -> USB -> host decoding)
+#
+# Measures for take_adc_data, read_raw_adc, read_adcs and a free running FIFO drain:
+#   samples per second (end-to-end), FIFO words per USB read, decode time per word and lost words
+# across block sizes and capture lengths. The results are written to ./output/benchmarks/ as json,
+# together with the host revision and the firmware/driver versions, to compare runs.
+#
+# Options: [--sim] use the simulated board (lab_devices/LF_SFF_MIO_sim.py), [--quick] fewer configurations,
+#          [--repeat N] runs per configuration (3), [--channel fadcN_rx] ADC channel (fadc0_rx), [--name] file name
+#
+import sys
+import os
+import time
+import json
+import socket
+import hashlib
+import platform
+import subprocess
+import yaml
+import numpy as np
+import basil
+from lab_devices.LF_SFF_MIO import LF_SFF_MIO, ADC_SAMPLE_CLOCK
+
+
+class fifo_probe():
+    # Wraps sram.get_data and _decode_adc_words of a dut to count USB reads, FIFO words and decode time
+    def __init__(self, dut, fifo='sram'):
+        self.dut = dut
+        self.fifo = fifo
+
+    def __enter__(self):
+        self.reads = []  # (words, seconds) per get_data call
+        self.decode_words = 0
+        self.decode_time = 0.
+        fifo_get_data = self.dut[self.fifo].get_data
+        decode = self.dut._decode_adc_words
+
+        def get_data():
+            start = time.perf_counter()
+            data = fifo_get_data()
+            self.reads.append((len(data), time.perf_counter()-start))
+            return data
+
+        def decode_adc_words(words, val, sync):
+            start = time.perf_counter()
+            out = decode(words, val, sync)
+            self.decode_time += time.perf_counter()-start
+            self.decode_words += len(words)
+            return out
+
+        self.dut[self.fifo].get_data = get_data
+        self.dut._decode_adc_words = decode_adc_words
+        return self
+
+    def __exit__(self, *args):
+        del self.dut[self.fifo].get_data
+        del self.dut._decode_adc_words
+
+    def stats(self):
+        words = np.array([r[0] for r in self.reads])
+        seconds = np.array([r[1] for r in self.reads])
+        return {'usb_reads': len(words),
+                'fifo_words': int(words.sum()),
+                'words_per_read_mean': float(words.mean()) if len(words) else 0.,
+                'words_per_read_max': int(words.max()) if len(words) else 0,
+                'empty_reads': int(np.sum(words == 0)),
+                'read_time_s': float(seconds.sum()),
+                'usb_MB_per_s': float(4*words.sum()/seconds.sum()/1e6) if seconds.sum() else 0.,
+                'decode_ns_per_word': float(1e9*self.decode_time/self.decode_words) if self.decode_words else None}
+
+
+def bench_take_adc_data(dut, adc_ch, how_much, block_size):
+    dut[adc_ch].reset()
+    dut[adc_ch].set_single_data(False)
+    dut[adc_ch].set_en_trigger(False)
+    with fifo_probe(dut) as probe:
+        start = time.perf_counter()
+        val, sync = dut.take_adc_data(adc_ch, how_much, block_size=block_size, fifo='sram', reuse=True)
+        seconds = time.perf_counter()-start
+    result = {'method': 'take_adc_data', 'channels': [adc_ch], 'samples_requested': how_much, 'block_size': block_size,
+              'samples': len(val), 'seconds': seconds, 'samples_per_s': len(val)/seconds,
+              'lost_words': dut[adc_ch].get_count_lost(), 'missing_samples': how_much-len(val)}
+    result.update(probe.stats())
+    return result
+
+
+def bench_read_raw_adc(dut, adc_ch, nSamples):
+    with fifo_probe(dut) as probe:
+        start = time.perf_counter()
+        data = dut.read_raw_adc(nSamples, adc_ch, reuse=True, settle=None)
+        seconds = time.perf_counter()-start
+    result = {'method': 'read_raw_adc', 'channels': [adc_ch], 'samples_requested': nSamples, 'block_size': None,
+              'samples': len(data), 'seconds': seconds, 'samples_per_s': len(data)/seconds,
+              'lost_words': dut[adc_ch].get_count_lost(), 'missing_samples': nSamples-len(data)}
+    result.update(probe.stats())
+    return result
+
+
+def bench_read_adcs(dut, adcs, nSamples):
+    with fifo_probe(dut) as probe:
+        start = time.perf_counter()
+        data = dut.read_adcs(nSamples, adcs, reuse=True)
+        seconds = time.perf_counter()-start
+    samples = sum([len(data[adc_ch]) for adc_ch in adcs])
+    result = {'method': 'read_adcs', 'channels': adcs, 'samples_requested': nSamples*len(adcs), 'block_size': None,
+              'samples': samples, 'seconds': seconds, 'samples_per_s': samples/seconds,
+              'lost_words': sum([dut[adc_ch].get_count_lost() for adc_ch in adcs]), 'missing_samples': nSamples*len(adcs)-samples}
+    result.update(probe.stats())
+    return result
+
+
+def bench_fifo_drain(dut, adc_ch, duration=1.):
+    # Free running single data capture, the FIFO is read as fast as possible for duration seconds
+    dut['sram'].reset()
+    dut[adc_ch].reset()
+    dut[adc_ch].set_single_data(True)
+    dut[adc_ch].set_en_trigger(False)
+    # twice the samples of duration, at most the 24 bit COUNT register holds (1.68 s at 10 MS/s)
+    dut[adc_ch].set_data_count(min(int(2*duration*ADC_SAMPLE_CLOCK), 2**24-1))
+    with fifo_probe(dut) as probe:
+        dut[adc_ch].start()
+        start = time.perf_counter()
+        while time.perf_counter()-start < duration:
+            dut['sram'].get_data()
+        seconds = time.perf_counter()-start
+    result = {'method': 'fifo_drain', 'channels': [adc_ch], 'samples_requested': None, 'block_size': None,
+              'seconds': seconds, 'lost_words': dut[adc_ch].get_count_lost()}
+    result.update(probe.stats())
+    result['samples'] = result['fifo_words']
+    result['samples_per_s'] = result['fifo_words']/seconds
+    dut[adc_ch].reset()
+    dut['sram'].reset()
+    return result
+
+
+def bench_decode(dut, block_size, repeat=20):
+    # Host only: decoding of FIFO words into samples and sync flags
+    words = np.random.default_rng(0).integers(0, 2**32, block_size, dtype=np.uint32)
+    val = np.empty(2*block_size, dtype=np.uint32)
+    sync = np.empty(2*block_size, dtype=np.uint32)
+    start = time.perf_counter()
+    for i in range(repeat):
+        dut._decode_adc_words(words, val, sync)
+    seconds = (time.perf_counter()-start)/repeat
+    return {'method': 'decode', 'channels': [], 'block_size': block_size, 'seconds': seconds,
+            'decode_ns_per_word': 1e9*seconds/block_size, 'samples_per_s': 2*block_size/seconds}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def firmware_info(dut, conf):
+    info = {}
+    bit_file = conf['transfer_layer'][0].get('init', {}).get('bit_file')
+    if bit_file and os.path.isfile(bit_file):
+        with open(bit_file, 'rb') as f:
+            info['bit_file_sha1'] = hashlib.sha1(f.read()).hexdigest()
+    for drv in conf['hw_drivers']:
+        try:
+            info[drv['name']+'_VERSION'] = int(dut[drv['name']].VERSION)
+        except Exception:
+            pass
+    return info
+
+
+def option(name, default):
+    if name in sys.argv[1:]:
+        return sys.argv[sys.argv[1:].index(name)+2]
+    return default
+
+
+if __name__ == '__main__':
+    sim = '--sim' in sys.argv[1:]
+    quick = '--quick' in sys.argv[1:]
+    repeat = int(option('--repeat', 3))
+    adc_ch = option('--channel', 'fadc0_rx')
+
+    conf = yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader)
+    if sim:
+        from lab_devices.LF_SFF_MIO_sim import LF_SFF_MIO_sim
+        dut = LF_SFF_MIO_sim(conf)
+    else:
+        dut = LF_SFF_MIO(conf)
+    dut.init()
+    dut.load_defaults()
+
+    block_sizes = [16384, 65536] if quick else [4096, 16384, 65536, 262144]
+    lengths = [100000, 1000000] if quick else [100000, 1000000, 4000000]
+
+    results = []
+    for block_size in block_sizes:
+        results.append(bench_decode(dut, block_size))
+    for i in range(repeat):
+        for how_much in lengths:
+            for block_size in block_sizes:
+                results.append(bench_take_adc_data(dut, adc_ch, how_much, block_size))
+            results.append(bench_read_raw_adc(dut, adc_ch, min(how_much, 500000)))
+            results.append(bench_read_adcs(dut, ['fadc0_rx', 'fadc1_rx', 'fadc2_rx', 'fadc3_rx'], min(how_much, 100000)))
+        results.append(bench_fifo_drain(dut, adc_ch, 0.5 if quick else 1.))
+
+    meta = {'time': time.strftime("%d.%m.%Y %H:%M:%S"),
+            'hostname': socket.gethostname(),
+            'backend': 'sim' if sim else 'hardware',
+            'host_revision': git_revision(),
+            'firmware': firmware_info(dut, conf),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'basil': getattr(basil, '__version__', None),
+            'repeat': repeat}
+
+    output_path = './output/benchmarks/'
+    os.makedirs(output_path, exist_ok=True)
+    file_name = option('--name', 'readout_%s_%s'%(meta['backend'], time.strftime("%Y%m%d_%H%M%S")))
+    with open(output_path+file_name+'.json', 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+
+    print('%-14s %-9s %-10s %12s %12s %10s %10s'%('method', 'samples', 'block', 'MS/s', 'words/read', 'ns/word', 'lost'))
+    for r in results:
+        print('%-14s %-9s %-10s %12.3f %12s %10s %10s'%(r['method'], r.get('samples_requested'), r.get('block_size'), r['samples_per_s']/1e6,
+              '%.0f'%(r['words_per_read_mean']) if 'words_per_read_mean' in r else '-',
+              '%.2f'%(r['decode_ns_per_word']) if r.get('decode_ns_per_word') else '-', r.get('lost_words', '-')))
+    print('Results have been stored in:', output_path+file_name+'.json')
+    dut.close()
@@ -28,7 +28,7 @@
 
 
 import time
-from basil.dut import Dut
+from lab_devices.oscilloscope import oscilloscope
 import numpy as np
 from lab_devices.LF_SFF_MIO import LF_SFF_MIO
 import matplotlib.pyplot as plt
@@ -47,17 +47,12 @@ cnfg = yaml.load(stream, Loader=yaml.Loader)
 
 VRESET = 1.2
 
-try:
-    dut = LF_SFF_MIO(cnfg)
-    dut.init()
+dut = LF_SFF_MIO(cnfg)
+dut.init(fast=True)
+dut.boot_seq()
+dut.load_defaults(VRESET = VRESET)
 
-    dut.boot_seq()
-    dut.load_defaults(VRESET = VRESET)
-    dut.set_acquire_state('RUN')
-except:
-    print('Firmware not flashed. This can be because a firmware was already flashed or your setup is broken')
-
-oszi = Dut('./lab_devices/tektronix_tds_3034b.yaml')
+oszi = oscilloscope('./lab_devices/tektronix_tds_3034b.yaml')
 oszi.init()
 
 # Configure viewport of the oscilloscope
@@ -91,7 +86,7 @@ def double_err(function, x, x_error, y, y_error, presets):
 def take_data(RST,time,axs):
     V_out_time = np.array([])
     V_out_data = np.array([])
-    meas_waveform_LF_SFF = oszi['Oscilloscope'].get_waveform(channel=2, continue_meas=True)
+    meas_waveform_LF_SFF = oszi.get_waveform(channel=2, continue_meas=True)
     CH_LF_SFF         = meas_waveform_LF_SFF[0]
     V_out_data = np.append(V_out_data,meas_waveform_LF_SFF[1])
     CH_xscale_LF_SFF  = meas_waveform_LF_SFF[2]
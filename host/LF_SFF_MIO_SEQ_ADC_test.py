@@ -81,14 +81,16 @@ def test_read_pulse():
     func_gen.load_IR_LED_ext_config(1.8, pulse_width, int(1/pulse_width*0.1))
     time.sleep(1)
     pltfit.beauty_plot(tight=False)
-    for adc_ch in ['fadc0_rx','fadc1_rx','fadc2_rx','fadc3_rx']:
-        data, data_err = dut.read_adc(adc_ch=adc_ch, nSamples=10000)
+    adcs = dut.read_adcs(nSamples=10000, adcs=['fadc0_rx','fadc1_rx','fadc2_rx','fadc3_rx'])
+    for adc_ch in adcs:
+        data, data_err = dut.calibreate_data(adcs[adc_ch], adc_ch)
         plt.plot(data, label=adc_ch)
     plt.legend()
     plt.show()
     dut_config = update_config('./lab_devices/conifg/LF_SFF_SEQ_ADC_test.csv')
 
     while True:
+        dut_config.wait()
         dut_config.check_config(dut)
 
 #test_read_pulse()
@@ -100,8 +102,7 @@ def read_test_input(adc_ch = 'fadc0_rx'):
     test_SEQ()
     dut[adc_ch].set_delay(10)
     dut[adc_ch].start()
-    while not dut[adc_ch].is_done():
-        pass
+    dut.wait_for_adc(adc_ch, 100)
     data = dut['sram'].get_data() 
     data = data & 0x3fff
     plt.plot(data)
@@ -112,5 +113,14 @@ def demo_capture_one_event():
     data, data_err = dut.read_triggered_adc(adc_ch='fadc0_rx',SEQ_config=test_SEQ, nSamples=40000)
     plt.plot(data)
     plt.show()
+
+def demo_capture_events(nEvents=100):
+    pltfit.beauty_plot(tight=False)
+    events, timestamps, dead_time = dut.read_triggered_events(adc_ch='fadc0_rx', SEQ_config=test_SEQ, nSamples=4000, nEvents=nEvents)
+    print('Trigger rate: %.1f Hz, mean dead time: %.2f ms'%(len(events)/(timestamps[-1]-timestamps[0]), np.mean(dead_time[1:])*1e3))
+    for event in events:
+        plt.plot(event, alpha=0.3)
+    plt.show()
+
 demo_capture_one_event()
 dut.close()
@@ -6,31 +6,267 @@
 
 import time
 from basil.dut import Dut
+from basil.HL.RegisterHardwareLayer import RegisterHardwareLayer
 import socket
 import numpy as np
 import time
 import os 
 import logging
+import json
+import threading
+import hashlib
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+
+from utils.ring_buffer import ring_buffer
+from utils.buffer_pool import buffer_pool
+from lab_devices.adc_calibration import adc_calibration
+from utils.raw_data import raw_writer
+from lab_devices.register_batch import register_batch, coalesced_i2c
+from lab_devices.conifg.config_handler import read_config
+
+# FIFO word of the gpac_adc_rx firmware module: {HEADER_ID, ADC_ID[1:0], SYNC/TRIGGER, 14'b0, DATA[13:0]} (single data mode)
+ADC_ID_MASK = 0x60000000
+ADC_ID_SHIFT = 29
+# With EN_TRIGGER the flag is set for the first sample after each trigger
+ADC_TRIGGER_MASK = 0x10000000
+# ADC_ENC, see device/src/clk_gen.v
+ADC_SAMPLE_CLOCK = 10e6
+# Hold time of the pixel reset in boot_seq and on/off time of the two reset pulses (0x1f) that follow
+RESET_HOLD = 0.1
+RESET_PULSE = 0.2
+# Host side record of the last boot, see LF_SFF_MIO.init(fast=True)
+BOOT_STATE_FILE = './output/LF_SFF_MIO_state.json'
+
+wait_stats = namedtuple('wait_stats', ['polls', 'waited', 'expected'])
+
+# Timeout of captures started by the host (not waiting for a trigger), in s
+def capture_timeout(nSamples):
+    return max(1, 10*nSamples/ADC_SAMPLE_CLOCK)
+
+class trigger_stream():
+    # Words drained from a FIFO during a triggered capture and the positions of their trigger flags.
+    # CONF_DONE of fadc_rx is only cleared by START, not by a trigger, so the end of a triggered
+    # event is taken from the data: it is complete once nSamples words follow its trigger flag.
+    def __init__(self, fifo):
+        self.fifo = fifo
+        self.chunks = []
+        self.words = 0
+        self.flags = []
+
+    def drain(self):
+        data = self.fifo.get_data()
+        self.flags.extend(np.flatnonzero(data & ADC_TRIGGER_MASK)+self.words)
+        self.chunks.append(data)
+        self.words += len(data)
+
+    def complete(self, event, nSamples):
+        return len(self.flags) > event and self.words-self.flags[event] >= nSamples
+
+    def data(self):
+        return np.concatenate(self.chunks) if self.chunks else np.empty(0, dtype=np.uint32)
+
+# GPAC methods that are run with LF_SFF_MIO.lock held, each is a sequence of I2C transfers behind the I2C mux
+GPAC_LOCKED = ['set_voltage', 'get_voltage', 'set_current', 'get_current', 'set_enable', 'get_over_current', 'set_current_limit']
+
+# Supplies and biases of read_status(), register names of LF_SFF_MIO.yaml
+STATUS_CHANNELS = ['VDD', 'IBN', 'IBP', 'VRESET', 'opAMP_offset', 'DIODE_HV']
+# Voltage in V, current in A
+channel_reading = namedtuple('channel_reading', ['voltage', 'current'])
+
+class status_snapshot(namedtuple('status_snapshot', ['time', 'hostname']+STATUS_CHANNELS)):
+    # Immutable result of LF_SFF_MIO.read_status(), a channel_reading per channel (None if not read)
+    __slots__ = ()
+    current_units = {'VDD': 'mA', 'DIODE_HV': 'mA'}  # uA otherwise
+    unit_scale = {'A': 1, 'mA': 1e3, 'uA': 1e6}
+
+    def readings(self):
+        return [(name, getattr(self, name)) for name in STATUS_CHANNELS if getattr(self, name) is not None]
+
+    def __str__(self):
+        lines = ['Status '+time.strftime("%d.%m.%Y %H:%M:%S", time.localtime(self.time))]
+        for name, reading in self.readings():
+            unit = self.current_units.get(name, 'uA')
+            lines.append('%-15s %8.4f V %9.3f %s'%(name+':', reading.voltage, reading.current*self.unit_scale[unit], unit))
+        return '\n'.join(lines)
+
+    # Plain dict for logging and json files
+    def as_dict(self):
+        status = {'Time': time.strftime("%d.%m.%Y %H:%M:%S", time.localtime(self.time)), 'Hostname': self.hostname}
+        for name, reading in self.readings():
+            unit = self.current_units.get(name, 'uA')
+            status[name] = {'voltage(V)': reading.voltage, 'current(%s)'%(unit): reading.current*self.unit_scale[unit]}
+        return status
+
+def wait_until(condition, expected=0, timeout=None, min_interval=1e-4, max_interval=0.05, on_poll=None):
+    # Waits until condition() is true. Sleeps through most of the expected time first and then polls
+    # with an exponentially growing interval, so the USB link is not flooded with status reads.
+    # on_poll() is called before every poll (e.g. to drain a FIFO), then there is no initial sleep.
+    # Raises TimeoutError after timeout seconds, None waits without a limit.
+    start = time.time()
+    if expected > min_interval and not on_poll:
+        time.sleep(0.9*expected)
+    polls = 0
+    interval = min_interval
+    while True:
+        if on_poll:
+            on_poll()
+        polls += 1
+        if condition():
+            break
+        if timeout is not None and time.time()-start > timeout:
+            raise TimeoutError('Not done after %.3f s (%i polls, expected %.3f s)'%(time.time()-start, polls, expected))
+        time.sleep(interval)
+        interval = min(2*interval, max_interval)
+    return wait_stats(polls, time.time()-start, expected)
 
 class LF_SFF_MIO(Dut):
 
-    def boot_seq(self):
-        for i in range(3):
-            self['CONTROL'] = 0x02 << i
-            self['CONTROL'].write()
-            time.sleep(0.1)
-        self['CONTROL']['RESET'] = 0x1 
-        self['CONTROL'].write()
-        time.sleep(0.1)
-        for i in range(0,2):
-            self['CONTROL'] = 0x1f
-            self['CONTROL'].write()
-            time.sleep(0.2)
-            self['CONTROL'] = 0x00
-            self['CONTROL'].write()
-            time.sleep(0.2)
-        self['CONTROL'] = 0x00
-        self['CONTROL'].write()
+    def __init__(self, conf):
+        super(LF_SFF_MIO, self).__init__(conf)
+        # Reusable capture buffers (see out/reuse arguments of the ADC read methods)
+        self.buffers = buffer_pool()
+        # ADC calibrations are parsed once and reloaded when the csv files change
+        self.calibration = adc_calibration()
+        self.calibration.load_all()
+        # Held for every access that is a sequence of transfers (GPAC I2C, batches, status scans),
+        # so they are not interleaved when other threads (e.g. slow_control_monitor) use the board
+        self.lock = threading.RLock()
+        gpac = self['GPAC']
+        for name in GPAC_LOCKED:
+            setattr(gpac, name, self._locked(getattr(gpac, name)))
+        # Queue of the open batch(), None outside of a batch
+        self._batch = None
+        # Settings written by batches since init(): (register, action): value, see register_batch
+        self.applied = {}
+        self.fast_booted = False
+        self._only_changed = False
+
+    def _locked(self, method):
+        def locked(*args, **kwargs):
+            with self.lock:
+                return method(*args, **kwargs)
+        return locked
+
+    def init(self, init_conf=None, fast=False, **kwargs):
+        # fast=True keeps the GPAC supplies powered during init. If the board still runs the firmware
+        # of the last boot (firmware_signature() and the supply enables match BOOT_STATE_FILE),
+        # boot_seq() is skipped and the next load_defaults() only writes the settings that differ.
+        # Otherwise the supplies are switched off as in a normal init and the board is booted fully.
+        gpac = self['GPAC']
+        no_power_reset = {}
+        if fast:
+            for drv in [gpac, getattr(gpac, 'power_gpio', None)]:
+                if drv is not None:
+                    no_power_reset[drv] = drv._init.get('no_power_reset', False)
+                    drv._init['no_power_reset'] = True
+        try:
+            super(LF_SFF_MIO, self).init(init_conf, **kwargs)
+        finally:
+            for drv in no_power_reset:
+                drv._init['no_power_reset'] = no_power_reset[drv]
+        self.applied = {}
+        self.fast_booted = False
+        if not fast:
+            return
+        state = self._load_boot_state()
+        if state is None:
+            reason = 'no boot state in %s'%(BOOT_STATE_FILE)
+        elif state['signature'] != self.firmware_signature():
+            reason = 'firmware signature changed'
+        elif state['power'] != self._power_state():
+            reason = 'supplies were switched'
+        else:
+            reason = None
+        if reason is None:
+            # GPAC.init sets all current sources to 0 and the FPGA modules are reset, only the DAC voltages and supply enables are kept
+            self.applied = {key: value for key, value in state['applied'].items() if key[1] in ['set_voltage', 'set_enable']}
+            self.fast_booted = True
+            self._only_changed = True
+            logging.info('Board already booted with this firmware (%s), skipping the boot sequence'%(time.strftime("%d.%m.%Y %H:%M:%S", time.localtime(state['time']))))
+        else:
+            logging.info('Full boot: %s'%(reason))
+            with self.batch() as batch:
+                for name in self._power_state():
+                    batch.set_enable(name, False)
+
+    # Bit file, USB board and version of every firmware module
+    def firmware_signature(self):
+        signature = {'bit_file': None, 'board_id': None, 'modules': {}}
+        for tl in self._transfer_layer.values():
+            bit_file = tl._init.get('bit_file')
+            if bit_file and os.path.isfile(bit_file):
+                with open(bit_file, 'rb') as f:
+                    signature['bit_file'] = hashlib.sha1(f.read()).hexdigest()
+            signature['board_id'] = getattr(getattr(tl, '_sidev', None), 'board_id', None)
+        for name, drv in self._hardware_layer.items():
+            if isinstance(drv, RegisterHardwareLayer) and 'VERSION' in drv._registers:
+                signature['modules'][name] = int(drv.VERSION)
+        return signature
+
+    # Enable state of the GPAC supplies, read back from the power GPIO
+    def _power_state(self):
+        state = {}
+        with self.lock:
+            for name, reg in self._registers.items():
+                channel = reg._conf.get('arg_add', {}).get('channel', '')
+                if channel.startswith('PWR'):
+                    state[name] = bool(reg._drv._get_power_gpio_value(reg._drv._ch_map[channel]['GPIOEN']['bit']))
+        return state
+
+    def _load_boot_state(self):
+        try:
+            with open(BOOT_STATE_FILE, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        state['applied'] = {tuple(key.split(':')): value for key, value in state['applied'].items()}
+        return state
+
+    def save_boot_state(self):
+        state = {'time': time.time(),
+                 'signature': self.firmware_signature(),
+                 'power': self._power_state(),
+                 'applied': {'%s:%s'%key: value for key, value in self.applied.items()}}
+        os.makedirs(os.path.dirname(BOOT_STATE_FILE), exist_ok=True)
+        with open(BOOT_STATE_FILE, 'w') as f:
+            json.dump(state, f, indent=1, default=float)
+
+    @contextmanager
+    def batch(self):
+        # Queues register writes and GPAC settings and writes them on exit (see lab_devices/register_batch.py)
+        # Nested batches are flushed by the outermost one. On an exception the queue is discarded.
+        if self._batch is not None:
+            yield self._batch
+            return
+        self._batch = register_batch(self, only_changed=self._only_changed)
+        try:
+            yield self._batch
+            self._batch.flush()
+        except BaseException:
+            self._batch.discard()
+            raise
+        finally:
+            self._batch = None
+
+    def boot_seq(self, blink=False):
+        # Holds the pixel reset and pulses it twice, with the timing of the original boot sequence.
+        # SEL0-2 only drive the LEDs 1-3 (device/src/LF_SFF_MIO.v), the LED walk before the reset
+        # is shown with blink=True. Skipped after a fast init() that found the board already booted.
+        if self.fast_booted:
+            return
+        with self.batch() as batch:
+            if blink:
+                for i in range(3):
+                    batch.write('CONTROL', 0x02 << i)
+                    batch.settle(0.1)
+            batch.write('CONTROL', 0x00, RESET=1)
+            batch.settle(RESET_HOLD)
+            for i in range(2):
+                batch.write('CONTROL', 0x1f)
+                batch.settle(RESET_PULSE)
+                batch.write('CONTROL', 0x00)
+                batch.settle(RESET_PULSE)
 
 
     def load_defaults(self, VDD = 1.2,VDD_Unit = 'V',
@@ -40,31 +276,20 @@ class LF_SFF_MIO(Dut):
                         IBP = -10, IBP_Unit = 'uA',
                         DIODE_HV = 0.2, DIODE_HV_Unit = 'V',
                         print_out=False):
-        # Voltages
-        #VDD = 1.2
-        #VDD_Unit = 'V'
-        #VRESET = 1.1
-        #VRESET_Unit = 'V'
-        #opAMP_offset = 0
-        #opAMP_offset_Unit = 'V'
-
-        # Currents
-        #IBN =  100 
-        #IBN_Unit = 'uA'
-        #IBP = 10
-        #IBP_Unit = 'uA'
-
-        self['VDD'].set_voltage(VDD, unit=VDD_Unit)
-        self['VDD'].set_enable(True)
-
-        self['IBN'].set_current(IBN, unit=IBN_Unit)
-
-        self['IBP'].set_current(IBP, unit=IBP_Unit)
-
-        self['VRESET'].set_voltage(VRESET, unit=VRESET_Unit)
-
-        self['opAMP_offset'].set_voltage(opAMP_offset, unit=opAMP_offset_Unit)
-        self['DIODE_HV'].set_voltage(DIODE_HV, unit=DIODE_HV_Unit)
+        # The DACs are written in one batch, the power GPIO last so VDD is enabled with its new value
+        with self.batch() as batch:
+            batch.set_voltage('VDD', VDD, unit=VDD_Unit)
+            batch.set_current('IBN', IBN, unit=IBN_Unit)
+            batch.set_current('IBP', IBP, unit=IBP_Unit)
+            batch.set_voltage('VRESET', VRESET, unit=VRESET_Unit)
+            batch.set_voltage('opAMP_offset', opAMP_offset, unit=opAMP_offset_Unit)
+            batch.set_voltage('DIODE_HV', DIODE_HV, unit=DIODE_HV_Unit)
+            batch.set_enable('VDD', True)
+        if batch.unchanged:
+            logging.info('load_defaults: %i settings unchanged, %i written'%(batch.unchanged, batch.writes))
+        self._only_changed = False
+        if self._batch is None:
+            self.save_boot_state()
 
         if print_out:
             print('opAMP_offset:', self['opAMP_offset'].get_voltage(unit='V'), VRESET_Unit, self['opAMP_offset'].get_current(), 'uA')
@@ -75,49 +300,132 @@ class LF_SFF_MIO(Dut):
             print('DIODE_HV:', self['DIODE_HV'].get_voltage(unit='V'), 'V', self['DIODE_HV'].get_current(), 'mA')
 
 
+    def read_status(self, channels=None):
+        # Reads voltage and current of every channel once. Both come from the same GPAC ADC conversion,
+        # which is only done once per ADC input, and the I2C mux is only switched once for the whole scan.
+        # The scan holds self.lock.
+        with self.lock:
+            channels = STATUS_CHANNELS if channels is None else channels
+            drivers = set([self[name]._drv for name in channels])
+            adc_values = {}  # (driver, address): raw values of both ADC channels
+            for drv in drivers:
+                def get_adc_value(address, drv=drv, read=drv._get_adc_value):
+                    if (drv, address) not in adc_values:
+                        adc_values[(drv, address)] = read(address=address)
+                    return adc_values[(drv, address)]
+                drv._get_adc_value = get_adc_value
+            readings = {}
+            try:
+                with coalesced_i2c(drivers):
+                    for name in channels:
+                        readings[name] = channel_reading(self[name].get_voltage(unit='V'), self[name].get_current(unit='A'))
+            finally:
+                for drv in drivers:
+                    del drv._get_adc_value
+        return status_snapshot(time.time(), socket.gethostname(), *[readings.get(name) for name in STATUS_CHANNELS])
+
+    # Returns the dict of the former get_status (VDD, IBN, IBP, VRESET), the currents are in the default unit
+    # of the GPAC driver (A) under the historical key 'current(mA)'. read_status() returns the status_snapshot
+    # with all channels and proper units.
     def get_status(self, print_status=True):
-            status = {}
-            status['Time'] = time.strftime("%d.%M.%Y %H:%M:%S")
-            status['Hostname'] = socket.gethostname()
-
-            status['VDD'] = {'voltage(V)': self['VDD'].get_voltage(unit='V'), 'current(mA)':  self['VDD'].get_current() }
-            status['IBN'] = {'voltage(V)': self['IBN'].get_voltage(unit='V'), 'current(mA)':  self['IBN'].get_current() }
-            status['IBP'] = {'voltage(V)': self['IBP'].get_voltage(unit='V'), 'current(mA)':  self['IBP'].get_current() }
-            status['VRESET'] = {'voltage(V)': self['VRESET'].get_voltage(unit='V'), 'current(mA)':  self['VRESET'].get_current() }
-            if print_status:
-                print_digits = 6
-                print('Status ', time.strftime("%d.%M.%Y %H:%M:%S"))
-                print('VDD:\t\t', str(self['VDD'].get_voltage(unit='V'))[:print_digits], 'V', str(self['VDD'].get_current())[:print_digits], 'mA')
-                print('ISCR1 IBN:\t', str(self['IBN'].get_voltage(unit='V'))[:print_digits], 'V', str(self['IBN'].get_current(unit='uA'))[:print_digits], 'uA')
-                print('ISRC0 IBP:\t', str(self['IBP'].get_voltage(unit='V'))[:print_digits], 'V', str(self['IBP'].get_current(unit='uA'))[:print_digits], 'uA')
-                print('VRESET:\t\t', str(self['VRESET'].get_voltage(unit='V'))[:print_digits], 'V', str(self['VRESET'].get_current())[:print_digits], 'uA')
-                print('opAMP_offset:\t', str(self['opAMP_offset'].get_voltage(unit='V'))[:print_digits], 'V', str(self['opAMP_offset'].get_current())[:print_digits], 'uA')
-                print('\n')
-            return status
-
-    def take_adc_data(self, channel, how_much = 1000000):
-        self['DATA_FIFO'].reset()
+        snapshot = self.read_status()
+        if print_status:
+            print(snapshot)
+            print('\n')
+        status = {'Time': time.strftime("%d.%m.%Y %H:%M:%S", time.localtime(snapshot.time)), 'Hostname': snapshot.hostname}
+        for name in ['VDD', 'IBN', 'IBP', 'VRESET']:
+            reading = getattr(snapshot, name)
+            status[name] = {'voltage(V)': reading.voltage, 'current(mA)': reading.current}
+        return status
+
+    def stream_adc_data(self, channel, how_much = 1000000, block_size = 65536, fifo = 'DATA_FIFO', raw_file = None):
+        # Generator that yields decoded (val, sync) blocks of 2*block_size samples while the capture is running.
+        # FIFO words are collected in a preallocated ring buffer, so the memory usage does not depend on how_much.
+        # The yielded arrays are reused for the next block, copy them if you want to keep them.
+        # Every block is also appended to raw_file (see open_raw_file) if given.
+        ring = ring_buffer(4*block_size)
+        words = np.empty(block_size, dtype=np.uint32)
+        val = np.empty(2*block_size, dtype=np.uint32)
+        sync = np.empty(2*block_size, dtype=np.uint32)
+
+        self[fifo].reset()
         self[channel].set_data_count(how_much)
         self[channel].start()
-        
-        nmdata = self['DATA_FIFO'].get_data()
-        
-        while self[channel].is_done() == False:
-            nmdata = np.append(nmdata, self['DATA_FIFO'].get_data());
-        
-        nmdata = np.append(nmdata, self['DATA_FIFO'].get_data());
-        
-        if(how_much/2 != len(nmdata)):
-            print ("Error: Data lost!", how_much/2, len(nmdata))
-        
-        val0 = np.right_shift(np.bitwise_and(nmdata, 0x0fffc000), 14)
-        val1 = np.bitwise_and(nmdata, 0x00003fff)
-        vals = np.right_shift(np.bitwise_and(nmdata, 0x10000000), 28)
-        
-        val = np.reshape(np.vstack((val0, val1)), -1, order='F')
-        sync = np.reshape(np.vstack((vals, vals)), -1, order='F')
 
-        return val, sync
+        done = False
+        while True:
+            # read once more after the channel is done to get the remaining words
+            done = self[channel].is_done()
+            data = self[fifo].get_data()
+            stored = 0
+            while True:
+                stored += ring.put(data[stored:])
+                while len(ring) >= block_size:
+                    yield self._decode_block(ring.get(block_size, out=words), val, sync, raw_file)
+                if stored == len(data):
+                    break
+            if done:
+                break
+        if len(ring):
+            yield self._decode_block(ring.get(len(ring), out=words), val, sync, raw_file)
+
+    def _decode_block(self, words, val, sync, raw_file=None):
+        block_val, block_sync = self._decode_adc_words(words, val, sync)
+        if raw_file:
+            raw_file.append(block_val)
+        return block_val, block_sync
+
+    def _decode_adc_words(self, words, val, sync):
+        # Every FIFO word holds two 14 bit samples (bits 27:14 and 13:0) and the sync flag (bit 28)
+        n = 2*len(words)
+        np.bitwise_and(words, 0x0fffc000, out=val[0:n:2])
+        np.right_shift(val[0:n:2], 14, out=val[0:n:2])
+        np.bitwise_and(words, 0x00003fff, out=val[1:n:2])
+        np.bitwise_and(words, 0x10000000, out=sync[0:n:2])
+        np.right_shift(sync[0:n:2], 28, out=sync[0:n:2])
+        sync[1:n:2] = sync[0:n:2]
+        return val[:n], sync[:n]
+
+    def take_adc_data(self, channel, how_much = 1000000, block_size = 65536, fifo = 'DATA_FIFO', out = None, reuse = False, raw_file = None):
+        # out = (val, sync) writes the samples into the given arrays, reuse=True takes them from the buffer pool
+        if out is None and reuse:
+            out = (self.buffers.get(channel, 'val', how_much, np.uint32), self.buffers.get(channel, 'sync', how_much, np.uint32))
+        if out is None:
+            val = np.empty(how_much, dtype=np.uint32)
+            sync = np.empty(how_much, dtype=np.uint32)
+        else:
+            val, sync = out
+        pos = 0
+        for block_val, block_sync in self.stream_adc_data(channel, how_much, block_size=block_size, fifo=fifo, raw_file=raw_file):
+            n = min(len(block_val), how_much-pos)
+            val[pos:pos+n] = block_val[:n]
+            sync[pos:pos+n] = block_sync[:n]
+            pos += n
+
+        if(how_much != pos):
+            print ("Error: Data lost!", how_much/2, pos/2)
+
+        return val[:pos], sync[:pos]
+
+    def wait_for_adc(self, adcs, nSamples=0, timeout=None, on_poll=None):
+        # Waits for one or several fadcN_rx channels. The expected time is estimated from nSamples and the sample clock.
+        if isinstance(adcs, str):
+            adcs = [adcs]
+        running = list(adcs)
+        def done():
+            running[:] = [adc_ch for adc_ch in running if not self[adc_ch].is_done()]
+            return not running
+        expected = nSamples/ADC_SAMPLE_CLOCK
+        self.last_wait = wait_until(done, expected=expected, timeout=timeout, on_poll=on_poll)
+        logging.debug('%s done after %.4f s (%i polls, expected %.4f s)'%(', '.join(adcs), self.last_wait.waited, self.last_wait.polls, expected))
+        return self.last_wait
+
+    def wait_for_event(self, stream, event, nSamples, timeout=None):
+        # Drains the trigger_stream until the event-th triggered event is complete
+        expected = nSamples/ADC_SAMPLE_CLOCK
+        self.last_wait = wait_until(lambda: stream.complete(event, nSamples), expected=expected, timeout=timeout, on_poll=stream.drain)
+        logging.debug('Event %i complete after %.4f s (%i polls, expected %.4f s)'%(event, self.last_wait.waited, self.last_wait.polls, expected))
+        return self.last_wait
 
     def reset(self, sleep=0.01):
         self['CONTROL']['RESET'] = 0x1 
@@ -127,21 +435,34 @@ class LF_SFF_MIO(Dut):
         self['CONTROL'].write()
     
     def load_config(self, config_path):
+        print('Loading config: ')
+        self.apply_config(read_config(config_path))
+
+    # Writes settings {setting: (value, unit)} (see conifg/config_handler.read_config) within their limits
+    # in one batch and returns the written ones
+    def apply_config(self, config):
         limits = {'VDD': [1.5, 'V'],
             'VRESET': [1.1, 'V'],
             'IBN': [100, 'uA'],
             'IBP':[-10, 'uA'],
             'DIODE_HV': [0.5, 'V']}
-        config = np.genfromtxt(config_path, delimiter=',',dtype='str')[1:]
-        print('Loading config: ')
-        for conf in config:
-            if float(conf[1])<=limits[conf[0]][0] and limits[conf[0]][1] in conf[2]:
-                if 'A' in conf[2]:
-                    self[conf[0]].set_current(float(conf[1]), unit=conf[2])
-                    print('Set ',conf[0], ' = ',  round(self[conf[0]].get_current(unit=conf[2]),2), ' ', conf[2])
-                elif 'V' in conf[2]:
-                    self[conf[0]].set_voltage(float(conf[1]), unit=conf[2])
-                    print('Set ', conf[0], ' = ', round(self[conf[0]].get_voltage(unit=conf[2]),2), ' ', conf[2])
+        applied = OrderedDict()
+        with self.batch() as batch:
+            for name, (value, unit) in config.items():
+                if name in limits and value<=limits[name][0] and limits[name][1] in unit:
+                    if 'A' in unit:
+                        batch.set_current(name, value, unit=unit)
+                    elif 'V' in unit:
+                        batch.set_voltage(name, value, unit=unit)
+                    applied[name] = (value, unit)
+                else:
+                    logging.warning('Config setting %s = %s %s is out of limits or unknown, not set'%(name, value, unit))
+        for name, (value, unit) in applied.items():
+            if 'A' in unit:
+                print('Set ',name, ' = ',  round(self[name].get_current(unit=unit),2), ' ', unit)
+            else:
+                print('Set ', name, ' = ', round(self[name].get_voltage(unit=unit),2), ' ', unit)
+        return applied
     
     def init_adc(self, howmuch=10000):
         self['DATA_FIFO'].reset()
@@ -169,37 +490,90 @@ class LF_SFF_MIO(Dut):
         for ch in ['OUT_0', 'OUT_1', 'OUT_2', 'OUT_3']:        
             self[ch].reset()
     
-    def read_raw_adc(self, nSamples, adc_ch):
+    def read_raw_adc(self, nSamples, adc_ch, out = None, reuse = False, settle = 'detect', max_settle = 2, raw_file = None):
+        # settle: 'detect' waits until the baseline stopped drifting (at most max_settle seconds),
+        #         'sleep' always waits max_settle seconds, None starts the capture right away
         self['sram'].reset()
         self[adc_ch].reset()
         self[adc_ch].set_delay(10)
-        self[adc_ch].set_data_count(nSamples)
         self[adc_ch].set_single_data(True)
         self[adc_ch].set_en_trigger(False)
-        time.sleep(2)
+        if settle == 'detect':
+            self.wait_for_settling(adc_ch, max_wait=max_settle)
+        elif settle == 'sleep':
+            time.sleep(max_settle)
 
+        self[adc_ch].set_data_count(nSamples)
         self[adc_ch].start()
-        while not self[adc_ch].is_done():
-            pass
+        self.wait_for_adc(adc_ch, nSamples, timeout=capture_timeout(nSamples))
 
         lost = self[adc_ch].get_count_lost()
         data = self['sram'].get_data() 
-        data = data & 0x3fff
+        data = self._mask_adc_data(data, adc_ch, out, reuse)
+        if raw_file:
+            raw_file.append(data)
         return data
 
-    def read_adc(self, nSamples, adc_ch):
-        data = self.read_raw_adc(nSamples, adc_ch)
-        print(data)
-        a, a_err, b, b_err = self.load_adc_calib(adc_ch)
-        if a and a_err and b and b_err:
-            data = np.array(data)*a+b
-            data_err = np.sqrt((data*a_err)**2+(b_err)**2)
-            return data, data_err # Units V
+    def wait_for_settling(self, adc_ch, max_wait=2, probe_samples=1000, probe_interval=0.05, tolerance=2, n_stable=3):
+        # Takes short probe captures until the mean ADC code of n_stable consecutive probes changed by less
+        # than tolerance codes, or max_wait seconds passed. Expects a configured, untriggered channel.
+        start = time.time()
+        self[adc_ch].set_data_count(probe_samples)
+        last = None
+        stable = 0
+        probes = 0
+        while time.time()-start < max_wait:
+            self[adc_ch].start()
+            self.wait_for_adc(adc_ch, probe_samples, timeout=capture_timeout(probe_samples))
+            baseline = np.mean(self['sram'].get_data() & 0x3fff)
+            probes += 1
+            if last is not None and abs(baseline-last) < tolerance:
+                stable += 1
+                if stable >= n_stable:
+                    break
+            else:
+                stable = 0
+            last = baseline
+            time.sleep(probe_interval)
         else:
-            logging.error("Could not read calibration data")
-            exit
-            
-    def read_adcs(self, nSamples, adcs):
+            logging.warning('%s baseline did not settle within %.1f s'%(adc_ch, max_wait))
+        waited = time.time()-start
+        logging.debug('%s settled after %.3f s (%i probes)'%(adc_ch, waited, probes))
+        return waited
+
+    def _mask_adc_data(self, data, adc_ch, out=None, reuse=False):
+        # Masks the 14 bit ADC codes, in place if an output buffer is given or taken from the pool
+        if out is None and reuse:
+            out = self.buffers.get(adc_ch, 'codes', len(data), np.uint32)
+        if out is None:
+            return data & 0x3fff
+        if len(data) > len(out):
+            logging.warning('Output buffer too small, dropping %i samples of %s'%(len(data)-len(out), adc_ch))
+            data = data[:len(out)]
+        return np.bitwise_and(data, 0x3fff, out=out[:len(data)])
+
+    def read_adc(self, nSamples, adc_ch, out = None, reuse = False, dtype = np.float64):
+        # out = (data, data_err) writes the calibrated values into the given float arrays.
+        # Raises OSError if there is no calibration of adc_ch (see LF_SFF_MIO_Calibrate_ADC.py).
+        a, a_err, b, b_err = self.load_adc_calib(adc_ch)
+        if a is None:
+            raise OSError('Could not read calibration data of %s'%(adc_ch))
+        data = self.read_raw_adc(nSamples, adc_ch, reuse=(out is not None or reuse))
+        if out is None and reuse:
+            out = (self.buffers.get(adc_ch, 'data', len(data), dtype), self.buffers.get(adc_ch, 'data_err', len(data), dtype))
+        if out is None:
+            out = (np.empty(len(data), dtype=dtype), np.empty(len(data), dtype=dtype))
+        data_err = out[1][:len(data)]
+        data = self.calibration.apply(data, adc_ch, out=out[0][:len(data)], dtype=dtype)
+        np.multiply(data, a_err, out=data_err)
+        np.square(data_err, out=data_err)
+        data_err += b_err**2
+        np.sqrt(data_err, out=data_err)
+        return data, data_err # Units V
+
+    def read_adcs(self, nSamples, adcs, reuse = False, raw_file = None):
+        # Captures the given fadcN_rx channels at the same time. The shared sram FIFO is drained
+        # during the capture and the words are split by their ADC_ID. Returns {adc_ch: codes}
         self['sram'].reset()
         for adc_ch in adcs:
             self[adc_ch].reset()
@@ -207,6 +581,31 @@ class LF_SFF_MIO(Dut):
             self[adc_ch].set_data_count(nSamples)
             self[adc_ch].set_single_data(True)
             self[adc_ch].set_en_trigger(False)
+        for adc_ch in adcs:
+            self[adc_ch].start()
+
+        chunks = []
+        self.wait_for_adc(adcs, nSamples, timeout=capture_timeout(nSamples), on_poll=lambda: chunks.append(self['sram'].get_data()))
+        chunks.append(self['sram'].get_data())
+        words = np.concatenate(chunks)
+
+        data = self._demux_adc_words(words, adcs, reuse)
+        if raw_file:
+            # all samples of every channel, shorter channels are padded (see utils/raw_data.py)
+            raw_file.append([data[adc_ch] for adc_ch in adcs])
+        for adc_ch in adcs:
+            lost = self[adc_ch].get_count_lost()
+            if len(data[adc_ch]) != nSamples or lost != 0:
+                logging.warning('%s: expected %i samples, got %i (lost: %i)'%(adc_ch, nSamples, len(data[adc_ch]), lost))
+        return data
+
+    def _demux_adc_words(self, words, adcs, reuse=False):
+        adc_id = np.right_shift(np.bitwise_and(words, ADC_ID_MASK), ADC_ID_SHIFT)
+        data = {}
+        for adc_ch in adcs:
+            # fadcN_rx is instantiated with ADC_ID=N in the firmware
+            data[adc_ch] = self._mask_adc_data(words[adc_id == int(adc_ch[4])], adc_ch, reuse=reuse)
+        return data
 
         
     def read_adc_testpattern(self, adc_ch):
@@ -222,8 +621,7 @@ class LF_SFF_MIO(Dut):
             self['fadc_conf'].enable_pattern(pattern)  
 
             self[adc_ch].start()
-            while not self[adc_ch].is_done():
-                pass
+            self.wait_for_adc(adc_ch, 10, timeout=capture_timeout(10))
 
             lost = self[adc_ch].get_count_lost()
             data = self['sram'].get_data() 
@@ -233,36 +631,103 @@ class LF_SFF_MIO(Dut):
             else:
                 logging.info("OK Data:" + str(data) + " Lost: " + str(lost))
     
-    def read_triggered_adc(self, adc_ch, SEQ_config, nSamples):
+    def read_triggered_adc(self, adc_ch, SEQ_config, nSamples, out = None, reuse = False, dtype = np.float64):
             self[adc_ch].reset()
             self['sram'].reset()
             self[adc_ch].set_data_count(nSamples)
             self[adc_ch].set_en_trigger(True)
             self[adc_ch].set_single_data(True)
             self[adc_ch].set_delay(10)
+            stream = trigger_stream(self['sram'])
             SEQ_config(self, nSamples)
-            while not self[adc_ch].is_done():
-                pass
-            data = self['sram'].get_data() 
-            data = data & 0x3fff
-            data, data_err = self.calibreate_data(data, adc_ch)
+            self.wait_for_event(stream, 0, nSamples)
+            data = stream.data()[stream.flags[0]:stream.flags[0]+nSamples]
+            data = self._mask_adc_data(data, adc_ch, reuse=reuse)
+            if out is None and reuse:
+                out = self.buffers.get(adc_ch, 'data', len(data), dtype)
+            data, data_err = self.calibreate_data(data, adc_ch, out=out, dtype=dtype)
             return data, data_err
     
+    def read_triggered_events(self, adc_ch, SEQ_config, nSamples, nEvents, trigger=None, dtype = np.float64, raw_file = None, timeout = None):
+        # Arms the channel and the sequencer once and records nEvents triggers of nSamples each.
+        # SEQ_config programs the sequencer and fires the first trigger, the following ones are fired by
+        # trigger() (default: restarting the already programmed sequencer) once the previous event is
+        # complete in the drained FIFO data (see trigger_stream, CONF_DONE does not mark the end of a
+        # triggered capture). The capture re-arms on every trigger. Returns the (events, samples) array,
+        # the host time stamps of the end of each event and the dead time between the end of an event
+        # and the next trigger. timeout limits the wait for each event (None: no limit).
+        self[adc_ch].reset()
+        self['sram'].reset()
+        self[adc_ch].set_data_count(nSamples)
+        self[adc_ch].set_en_trigger(True)
+        self[adc_ch].set_single_data(True)
+        self[adc_ch].set_delay(10)
+        if trigger is None:
+            trigger = self['SEQ'].start
+
+        stream = trigger_stream(self['sram'])
+        timestamps = np.zeros(nEvents)
+        dead_time = np.zeros(nEvents)
+        SEQ_config(self, nSamples)
+        for i in range(nEvents):
+            if i > 0:
+                trigger()
+                dead_time[i] = time.time()-timestamps[i-1]
+            self.wait_for_event(stream, i, nSamples, timeout=timeout)
+            timestamps[i] = time.time()
+        stream.drain()
+
+        events = self._split_events(stream.data(), nSamples)
+        if raw_file:
+            raw_file.append(events)
+        if len(events) != nEvents:
+            logging.warning('%s: recorded %i of %i events (lost: %i)'%(adc_ch, len(events), nEvents, self[adc_ch].get_count_lost()))
+        try:
+            events = self.calibration.apply(events, adc_ch, dtype=dtype)
+        except OSError:
+            logging.error('MISSING ADC calibration, returning raw ADC codes')
+        return events, timestamps, dead_time
+
+    def _split_events(self, words, nSamples):
+        # Cuts the FIFO stream at the trigger flags into an (events, nSamples) array of ADC codes.
+        # Incomplete events (lost words) are dropped.
+        starts = np.flatnonzero(words & ADC_TRIGGER_MASK)
+        lengths = np.diff(np.append(starts, len(words)))
+        starts = starts[lengths >= nSamples]
+        if np.any(lengths < nSamples):
+            logging.warning('Dropped %i incomplete events'%(np.sum(lengths < nSamples)))
+        return words[starts[:, np.newaxis]+np.arange(nSamples)] & 0x3fff
+
+    def open_raw_file(self, path, adcs, layout='stream', **meta):
+        # Creates a raw data file (see utils/raw_data.py) with the calibration and the bias settings as metadata
+        if isinstance(adcs, str):
+            adcs = [adcs]
+        calibration = {}
+        for adc_ch in adcs:
+            try:
+                calibration[adc_ch] = list(self.calibration.get(adc_ch))
+            except OSError:
+                calibration[adc_ch] = None
+        bias = {}
+        for reg in ['VDD', 'VRESET', 'opAMP_offset', 'DIODE_HV', 'ADC_REF']:
+            bias[reg] = {'voltage(V)': self[reg].get_voltage(unit='V')}
+        for reg in ['IBN', 'IBP']:
+            bias[reg] = {'current(uA)': self[reg].get_current(unit='uA')}
+        return raw_writer(path, adcs, layout=layout, sample_clock=ADC_SAMPLE_CLOCK, calibration=calibration, bias=bias, **meta)
+
     def load_adc_calib(self, adc_ch):
         try:
-            calib = np.genfromtxt('./output/ADC_Calibration/data/'+adc_ch+'.csv', delimiter=',')
-            calib = calib[1:]
-            a, a_err, b, b_err = calib[0][0],calib[0][1],calib[1][0],calib[1][1]
-            logging.info('Successfully loaded ADC calibratio for %s'%(adc_ch))
-            return a, a_err, b, b_err
+            return self.calibration.get(adc_ch)
         except:
             logging.error('Calibration for %s not found! Please run LF_SFF_MIO_Calibrate_ADC.py!'%(adc_ch))
             return None, None, None, None
         
-    def calibreate_data(self, data, adc_ch):
+    def calibreate_data(self, data, adc_ch, out=None, dtype=np.float64):
         a, a_err, b, b_err = self.load_adc_calib(adc_ch)
         if a:
-            data = a*data+b
+            if out is not None:
+                out = out[:len(data)]
+            data = self.calibration.apply(data, adc_ch, out=out, dtype=dtype)
             data_err = np.std(data)
             return data, data_err
         else:
@@ -0,0 +1,641 @@
+#####
+# Software model of the LF_SFF_MIO board for hardware-free testing and benchmarking
+#
+# LF_SFF_MIO_sim loads the unchanged LF_SFF_MIO.yaml. The transfer layer and the hardware drivers are
+# replaced by the models below, the register layer (CONTROL, SEQ, GPAC functional registers) and the
+# FadcConf driver are the real basil classes:
+#   GPAC       voltage/current sources with readback noise, every access costs an I2C transaction
+#   gpio       CONTROL register, RESET holds the pixel in reset
+#   seq_gen    sequencer memory written by the SEQ TrackRegister, runs on the 10 MHz ADC clock
+#   spi        FADC configuration (test pattern), decoded from the FadcConf SPI writes
+#   fadc_rx    10 MS/s sampling with data count, trigger (SEQ_OUT[2]), single/double data words, lost count
+#   sram_fifo  shared FIFO with finite size, read out at a modelled USB rate
+# The pixel output is a baseline following VRESET and opAMP_offset with a pulse for every rising edge
+# of the SEQ Trigger track. Samples are produced in real time, so timings measured against the model
+# are comparable to the board.
+#
+# Usage: dut = LF_SFF_MIO_sim(yaml.load(open("./lab_devices/LF_SFF_MIO.yaml", 'r'), Loader=yaml.Loader))
+#####
+import time
+import logging
+import numpy as np
+from scipy import signal
+from basil.TL.SiTransferLayer import SiTransferLayer
+from basil.HL.HardwareLayer import HardwareLayer
+
+from lab_devices.LF_SFF_MIO import LF_SFF_MIO, ADC_SAMPLE_CLOCK, ADC_ID_SHIFT, ADC_TRIGGER_MASK
+
+# Seconds per access, can be changed with the timing argument of LF_SFF_MIO_sim
+SIM_TIMING = {'register': 5e-5,      # register read/write over USB
+              'i2c': 1.5e-3,         # GPAC DAC write or ADC conversion
+              'usb_overhead': 3e-4,  # per sram read (FIFO size + bulk transfer setup)
+              'usb_rate': 20e6}      # bulk transfer in bytes/s
+
+SIM_PIXEL = {'sf_gain': 0.85,        # source follower gain
+             'sf_vth': 0.35,         # V, source follower threshold
+             'channel_offset': 0.01, # V, offset between the four pixels
+             'adc_range': 2.,        # V, full scale around ADC_REF
+             'noise': 2.,            # ADC codes (rms)
+             'pulse_height': 0.05,   # V, negative going
+             'tau_rise': 2.,         # samples
+             'tau_fall': 100.}       # samples
+
+SRAM_WORDS = 2**19  # 2 MB SRAM of the MIO
+CHANNEL_FIFO_WORDS = 1024
+FADC_COUNT_BITS = 24  # size of the COUNT register of fadc_rx
+SEQ_OUT_BITS = 16  # see device/src/LF_SFF_MIO.v
+SEQ_RESET, SEQ_TRIGGER, SEQ_ADC_TRIGGER = 0, 1, 2
+HEADER_ID = 0x80000000
+
+
+class mio_board():
+    # Shared state of the simulated board, the driver models talk to each other through it
+    def __init__(self, timing=None, pixel=None, seed=None):
+        self.timing = dict(SIM_TIMING, **(timing or {}))
+        self.pixel = dict(SIM_PIXEL, **(pixel or {}))
+        self.rng = np.random.default_rng(seed)
+        self._noise = self.rng.normal(0, self.pixel['noise'], 2**20)
+        self._t0 = time.time()
+        self.gpac = None
+        self.gpio = None
+        self.seq = None
+        self.spi = None
+        self.fifo = None
+        self.adcs = {}
+        self.pattern = None
+
+    def now(self):
+        # time in ADC clock cycles
+        return int((time.time()-self._t0)*ADC_SAMPLE_CLOCK)
+
+    def access(self, kind='register', n=1):
+        time.sleep(self.timing[kind]*n)
+
+    def update(self):
+        # Moves everything the channels sampled since the last call into the FIFO
+        now = self.now()
+        for adc in self.adcs.values():
+            adc._update(now)
+
+    def baseline(self, adc_id):
+        vreset = self.gpac._values.get('VSRC0', 0.)
+        offset = self.gpac._values.get('VSRC1', 0.)
+        return self.pixel['sf_gain']*vreset-self.pixel['sf_vth']+offset+adc_id*self.pixel['channel_offset']
+
+    def codes(self, adc_id, start, stop):
+        # Samples [start, stop) of channel adc_id in ADC codes
+        n = stop-start
+        if self.pattern is not None:
+            return np.full(n, self.pattern, dtype=np.uint32)
+        volts = np.full(n, self.baseline(adc_id))
+        if self.seq and not (self.gpio and self.gpio._data & 0x1):
+            volts -= self._pulses(start, stop)
+        adc_ref = self.gpac._values.get('VSRC3', 0.)
+        codes = 8192+(volts-adc_ref)/self.pixel['adc_range']*16384
+        offset = self.rng.integers(len(self._noise))
+        codes += np.take(self._noise, np.arange(offset, offset+n), mode='wrap')
+        return np.clip(codes, 0, 2**14-1).astype(np.uint32)
+
+    def _pulses(self, start, stop):
+        # Pulses of the Trigger track edges, the tail of earlier pulses is taken into account
+        tail = int(10*self.pixel['tau_fall'])
+        edges = self.seq._edges(SEQ_TRIGGER, start-tail, stop)
+        if len(edges) == 0:
+            return 0.
+        impulses = np.zeros(stop-start+tail)
+        np.add.at(impulses, edges-(start-tail), self.pixel['pulse_height'])
+        # difference of two exponentials, normalised to the pulse height
+        rise, fall = np.exp(-1/self.pixel['tau_rise']), np.exp(-1/self.pixel['tau_fall'])
+        t = np.arange(tail)
+        norm = np.max(np.power(fall, t)-np.power(rise, t))
+        out = signal.lfilter([1], [1, -fall], impulses)-signal.lfilter([1], [1, -rise], impulses)
+        return out[tail:]/norm
+
+
+class usb_sim(SiTransferLayer):
+    # The driver models do not use the bus, every access is only timed
+    def __init__(self, conf, board):
+        super(usb_sim, self).__init__(conf)
+        self._board = board
+
+    def write(self, addr, data):
+        self._board.access()
+
+    def read(self, addr, size):
+        self._board.access()
+        return bytes(size)
+
+
+class sim_driver(HardwareLayer):
+    def __init__(self, intf, conf, board):
+        super(sim_driver, self).__init__(intf, conf)
+        self._board = board
+
+
+def _gpac_ch_map():
+    # Channel map in the format of basil.HL.GPAC._ch_map, the ADC address is the channel name
+    ch_map = {}
+    for channel in ['PWR%i'%(i) for i in range(4)]+['VSRC%i'%(i) for i in range(4)]+['ISRC%i'%(i) for i in range(12)]:
+        ch_map[channel] = {'ADCV': {'address': channel, 'adc_ch': 0}, 'ADCI': {'address': channel, 'adc_ch': 1}}
+        if 'PWR' in channel:
+            ch_map[channel]['GPIOEN'] = {'bit': 1 << int(channel[3])}
+    return ch_map
+
+
+class gpac_sim(sim_driver):
+    # Channel names and units as in basil.HL.GPAC. Readback adds a small offset and noise.
+    # As on the GPAC, one ADC conversion (_get_adc_value) returns voltage and current of a channel.
+    _ch_map = _gpac_ch_map()
+
+    def __init__(self, intf, conf, board):
+        super(gpac_sim, self).__init__(intf, conf, board)
+        board.gpac = self
+        self._values = {}
+        self._enabled = {}
+        self._current_limit = None
+
+    def init(self):
+        super(gpac_sim, self).init()
+        self._init.setdefault('no_power_reset', False)
+        if self._init['no_power_reset']:
+            # the supplies keep their voltage and state, the current sources are set to 0 as in GPAC.init
+            self._values = {channel: value for channel, value in self._values.items() if 'ISRC' not in channel}
+        else:
+            self._values = {}
+            self._enabled = {}
+
+    def _readback(self, value, noise):
+        return value+self._board.rng.normal(0, noise)
+
+    # Returns (voltage in V, current in A) of a channel, the address is the channel name
+    def _get_adc_value(self, address):
+        self._board.access('i2c')
+        channel = address
+        if 'ISRC' in channel:
+            voltage = 0.5
+            current = self._values.get(channel, 0.)
+        elif 'PWR' in channel:
+            # digital and analog supply of the chip
+            enabled = self._enabled.get(channel, False)
+            voltage = self._values.get(channel, 0.) if enabled else 0.
+            current = 5e-3*self._values.get(channel, 0.) if enabled else 0.
+        else:
+            voltage = self._values.get(channel, 0.)
+            current = 1e-6*self._values.get(channel, 0.)
+        return self._readback(voltage, 2e-4), self._readback(current, 5e-8)
+
+    def set_voltage(self, channel, value, unit='V'):
+        self._board.access('i2c')
+        if unit == 'raw':
+            value = value/1000.
+        elif unit == 'mV':
+            value = value/1000.
+        elif unit != 'V':
+            raise TypeError("Invalid unit type.")
+        self._values[channel] = value
+
+    def get_voltage(self, channel, unit='V'):
+        voltage = self._get_adc_value(address=self._ch_map[channel]['ADCV']['address'])[self._ch_map[channel]['ADCV']['adc_ch']]
+        if unit == 'raw':
+            return int(voltage*1000)
+        elif unit == 'V':
+            return voltage
+        elif unit == 'mV':
+            return voltage*1000
+        else:
+            raise TypeError("Invalid unit type.")
+
+    def set_current(self, channel, value, unit='A'):
+        self._board.access('i2c')
+        scale = {'A': 1, 'mA': 1e-3, 'uA': 1e-6, 'raw': 1e-6}
+        if unit not in scale:
+            raise TypeError("Invalid unit type.")
+        self._values[channel] = value*scale[unit]
+
+    def get_current(self, channel, unit='A'):
+        current = self._get_adc_value(address=self._ch_map[channel]['ADCI']['address'])[self._ch_map[channel]['ADCI']['adc_ch']]
+        scale = {'A': 1, 'mA': 1e3, 'uA': 1e6, 'raw': 1e6}
+        if unit not in scale:
+            raise TypeError("Invalid unit type.")
+        return current*scale[unit]
+
+    def set_enable(self, channel, value):
+        if 'PWR' not in channel:
+            raise ValueError('set_enable() not supported for channel %s' % channel)
+        self._board.access('i2c')
+        self._enabled[channel] = bool(value)
+
+    def _get_power_gpio_value(self, bit):
+        self._board.access('i2c')
+        return all([self._enabled.get(channel, False) for channel in self._ch_map if 'GPIOEN' in self._ch_map[channel] and self._ch_map[channel]['GPIOEN']['bit'] & bit])
+
+    def get_over_current(self, channel):
+        if 'PWR' not in channel:
+            raise ValueError('get_over_current() not supported for channel %s' % channel)
+        self._board.access('i2c')
+        return False
+
+    def set_current_limit(self, channel, value, unit='A'):
+        self._board.access('i2c')
+        self._current_limit = value
+
+
+class gpio_sim(sim_driver):
+    def __init__(self, intf, conf, board):
+        super(gpio_sim, self).__init__(intf, conf, board)
+        board.gpio = self
+        self._data = 0
+        self._output_en = 0
+
+    def reset(self):
+        self._board.access()
+        self._data = 0
+
+    def set_output_en(self, value):
+        self._board.access()
+        self._output_en = int.from_bytes(bytes(value), 'little')
+
+    def get_output_en(self):
+        self._board.access()
+        return self._output_en.to_bytes(self._conf['size']//8, 'little')
+
+    def set_data(self, value):
+        self._board.access()
+        self._data = int.from_bytes(bytes(value), 'little')
+
+    def get_data(self):
+        self._board.access()
+        return self._data.to_bytes(self._conf['size']//8, 'little')
+
+
+class spi_sim(sim_driver):
+    # SPI interface of the FADC, decodes the test pattern registers (see basil.HL.FadcConf)
+    def __init__(self, intf, conf, board):
+        super(spi_sim, self).__init__(intf, conf, board)
+        board.spi = self
+        self._mem = bytearray(conf.get('mem_bytes', 2))
+        self._adc_regs = {}
+
+    def reset(self):
+        self._board.access()
+
+    def set_data(self, data, addr=0):
+        self._board.access()
+        self._mem[addr:addr+len(data)] = bytes(data)
+
+    def get_data(self, size=None, addr=None):
+        self._board.access()
+        return bytes(self._mem)
+
+    def start(self):
+        self._board.access()
+        reg, value = self._mem[0], self._mem[1]
+        self._adc_regs[reg] = value
+        pattern_high = self._adc_regs.get(0x03, 0)
+        if pattern_high & 0x80:
+            self._board.pattern = ((pattern_high & 0x3f) << 8) | self._adc_regs.get(0x04, 0)
+        else:
+            self._board.pattern = None
+
+    def is_done(self):
+        self._board.access()
+        return True
+
+    def get_mem_size(self):
+        return len(self._mem)
+
+
+class seq_gen_sim(sim_driver):
+    def __init__(self, intf, conf, board):
+        super(seq_gen_sim, self).__init__(intf, conf, board)
+        board.seq = self
+        self._mem = bytearray(8192)
+        self._size = 0
+        self._clk_divide = 1
+        self._repeat = 1
+        self._repeat_start = 0
+        self._wait = 0
+        self._start = None
+        self._tracks = {}
+
+    def reset(self):
+        self._board.access()
+        self._start = None
+
+    def start(self):
+        self._board.access()
+        steps = np.unpackbits(np.frombuffer(bytes(self._mem[:2*self._size]), dtype=np.uint8)).reshape(-1, SEQ_OUT_BITS)
+        self._tracks = {}
+        for position in [SEQ_RESET, SEQ_TRIGGER, SEQ_ADC_TRIGGER]:
+            bits = steps[:, SEQ_OUT_BITS-1-position]
+            self._tracks[position] = np.flatnonzero(bits & ~np.roll(bits, 1) & 1)*self._clk_divide
+            if len(bits) and bits[0]:
+                self._tracks[position] = np.union1d(self._tracks[position], [0])
+        self._start = self._board.now()
+
+    def _edges(self, position, start, stop):
+        # Times of the rising edges of a track in [start, stop), in ADC clock cycles
+        edges = self._tracks.get(position)
+        if self._start is None or edges is None or len(edges) == 0:
+            return np.empty(0, dtype=np.int64)
+        period = max(self._size, 1)*self._clk_divide
+        first = max((start-self._start)//period-1, 0)
+        last = (stop-self._start)//period+1
+        if self._repeat:
+            last = min(last, self._repeat-1)
+        if last < first:
+            return np.empty(0, dtype=np.int64)
+        times = (self._start+np.arange(first, last+1)[:, np.newaxis]*period+edges).ravel()
+        return times[(times >= start) & (times < stop)]
+
+    def set_size(self, value):
+        self._board.access()
+        self._size = value
+
+    def get_size(self):
+        self._board.access()
+        return self._size
+
+    def set_wait(self, value):
+        self._board.access()
+        self._wait = value
+
+    def get_wait(self):
+        self._board.access()
+        return self._wait
+
+    def set_clk_divide(self, value):
+        self._board.access()
+        self._clk_divide = max(value, 1)
+
+    def get_clk_divide(self):
+        self._board.access()
+        return self._clk_divide
+
+    def set_repeat_start(self, value):
+        self._board.access()
+        self._repeat_start = value
+
+    def get_repeat_start(self):
+        self._board.access()
+        return self._repeat_start
+
+    def set_repeat(self, value):
+        self._board.access()
+        self._repeat = value
+
+    def get_repeat(self):
+        self._board.access()
+        return self._repeat
+
+    def is_done(self):
+        self._board.access()
+        if self._start is None:
+            return True
+        if self._repeat == 0:
+            return False
+        return self._board.now() >= self._start+self._repeat*self._size*self._clk_divide
+
+    def is_ready(self):
+        return self.is_done()
+
+    def get_done(self):
+        return self.is_done()
+
+    def get_mem_size(self):
+        return len(self._mem)
+
+    def set_data(self, data, addr=0):
+        self._board.access()
+        self._mem[addr:addr+len(data)] = bytes(data)
+
+    def get_data(self, size=None, addr=0):
+        self._board.access()
+        size = len(self._mem)-addr if size is None else size
+        return bytes(self._mem[addr:addr+size])
+
+
+class fadc_rx_sim(sim_driver):
+    def __init__(self, intf, conf, board):
+        super(fadc_rx_sim, self).__init__(intf, conf, board)
+        # fadcN_rx is instantiated with ADC_ID=N in the firmware
+        self._id = int(conf['name'][4])
+        board.adcs[self._id] = self
+        self._count = 0
+        self._single = False
+        self._align = False
+        self._en_trigger = False
+        self._delay = 0
+        self.reset()
+
+    def reset(self):
+        self._board.access()
+        self._lost = 0
+        self._done = True
+        self._window = None  # (start, stop) of the running capture in ADC clock cycles
+        self._produced = 0
+        # with EN_TRIGGER every ADC_Trigger edge after this time starts a capture
+        self._armed = self._board.now() if self._en_trigger else None
+
+    def start(self):
+        self._board.access()
+        self._board.update()
+        self._done = False
+        self._produced = 0
+        start = self._board.now()+self._delay
+        self._window = (start, start+self._count)
+
+    def _update(self, now):
+        while True:
+            if self._window is None:
+                if not self._en_trigger or self._armed is None:
+                    return
+                edges = self._board.seq._edges(SEQ_ADC_TRIGGER, self._armed, now)
+                if len(edges) == 0:
+                    return
+                start = edges[0]+self._delay
+                # as in gpac_adc_rx_core.v only START clears CONF_DONE, a triggered capture leaves it set
+                self._window = (start, start+self._count)
+                self._produced = 0
+            start, stop = self._window
+            begin = start+self._produced
+            end = min(now, stop)
+            if end > begin:
+                self._emit(begin, end, first=(self._produced == 0))
+                self._produced += end-begin
+            if end < stop:
+                return
+            self._done = True
+            self._window = None
+            if self._en_trigger:
+                self._armed = stop  # re-armed by the next trigger
+
+    def _emit(self, begin, end, first):
+        fifo = self._board.fifo
+        n = end-begin
+        words_per_sample = 1 if self._single else 0.5
+        space = fifo._free()+CHANNEL_FIFO_WORDS
+        if int(np.ceil(n*words_per_sample)) > space:
+            keep = int(space/words_per_sample)
+            self._lost += int(np.ceil((n-keep)*words_per_sample))
+            n = keep
+            if n == 0:
+                return
+        codes = self._board.codes(self._id, begin, begin+n)
+        if self._single:
+            words = codes
+        else:
+            if n % 2:
+                codes = np.append(codes, codes[-1])
+            words = (codes[0::2] << 14) | codes[1::2]
+        words |= HEADER_ID | (self._id << ADC_ID_SHIFT)
+        if first and self._en_trigger:
+            words[0] |= ADC_TRIGGER_MASK
+        fifo._push(words)
+
+    def set_align_to_sync(self, value):
+        self._board.access()
+        self._align = bool(value)
+
+    def get_align_to_sync(self):
+        self._board.access()
+        return self._align
+
+    def set_single_data(self, value):
+        self._board.access()
+        self._single = bool(value)
+
+    def set_data_count(self, count):
+        self._board.access()
+        # COUNT is a 24 bit register, basil refuses larger values
+        if not 0 <= int(count) < 2**FADC_COUNT_BITS:
+            raise ValueError('Value is too big for given size: COUNT (%i bits) = %i'%(FADC_COUNT_BITS, count))
+        self._count = int(count)
+
+    def get_data_count(self):
+        self._board.access()
+        return self._count
+
+    def set_en_trigger(self, val):
+        self._board.access()
+        self._board.update()
+        self._en_trigger = bool(int(val))
+        self._armed = self._board.now() if self._en_trigger else None
+
+    def get_en_trigger(self):
+        self._board.access()
+        return self._en_trigger
+
+    def set_delay(self, val):
+        self._board.access()
+        self._delay = int(val)
+
+    def get_delay(self):
+        self._board.access()
+        return self._delay
+
+    def get_count_lost(self):
+        self._board.access()
+        self._board.update()
+        return self._lost
+
+    def is_done(self):
+        self._board.access()
+        self._board.update()
+        return self._done
+
+    def is_ready(self):
+        return self.is_done()
+
+    def get_done(self):
+        return self.is_done()
+
+
+class sram_fifo_sim(sim_driver):
+    def __init__(self, intf, conf, board):
+        super(sram_fifo_sim, self).__init__(intf, conf, board)
+        board.fifo = self
+        self._chunks = []
+        self._words = 0
+        self._read_errors = 0
+
+    def _free(self):
+        return SRAM_WORDS-self._words
+
+    def _push(self, words):
+        self._chunks.append(words)
+        self._words += len(words)
+
+    def reset(self):
+        self._board.access()
+        self._chunks = []
+        self._words = 0
+        time.sleep(0.01)  # as basil.HL.sram_fifo
+
+    def set_almost_full_threshold(self, value):
+        self._board.access()
+
+    def set_almost_empty_threshold(self, value):
+        self._board.access()
+
+    def get_fifo_size(self):
+        self._board.access()
+        self._board.update()
+        return 4*self._words
+
+    @property
+    def FIFO_SIZE(self):
+        return self.get_fifo_size()
+
+    @property
+    def FIFO_INT_SIZE(self):
+        return self.get_fifo_size()//4
+
+    def get_fifo_int_size(self):
+        return self.FIFO_INT_SIZE
+
+    def get_FIFO_INT_SIZE(self):
+        return self.FIFO_INT_SIZE
+
+    def get_read_error_counter(self):
+        self._board.access()
+        return self._read_errors
+
+    def get_data(self):
+        self._board.access('register', 2)  # FIFO_INT_SIZE is read twice
+        self._board.update()
+        if self._chunks:
+            data = np.concatenate(self._chunks).astype('<u4')
+        else:
+            data = np.empty(0, dtype='<u4')
+        self._chunks = []
+        self._words = 0
+        self._board.access('usb_overhead')
+        time.sleep(4*len(data)/self._board.timing['usb_rate'])
+        return data
+
+    def get_size(self):
+        return self.get_fifo_size()
+
+
+SIM_DRIVERS = {'basil.HL.GPAC': gpac_sim,
+               'basil.HL.gpio': gpio_sim,
+               'basil.HL.spi': spi_sim,
+               'basil.HL.seq_gen': seq_gen_sim,
+               'basil.HL.fadc_rx': fadc_rx_sim,
+               'basil.HL.sram_fifo': sram_fifo_sim}
+
+
+class LF_SFF_MIO_sim(LF_SFF_MIO):
+    # timing and pixel update SIM_TIMING and SIM_PIXEL, seed makes the noise reproducible
+    def __init__(self, conf, timing=None, pixel=None, seed=None):
+        self.board = mio_board(timing, pixel, seed)
+        super(LF_SFF_MIO_sim, self).__init__(conf)
+
+    def _factory(self, importname, *args, **kargs):
+        if importname.startswith('basil.TL.'):
+            logging.debug('Simulating %s'%(importname))
+            return usb_sim(kargs['conf'], self.board)
+        if importname in SIM_DRIVERS:
+            return SIM_DRIVERS[importname](kargs['intf'], kargs['conf'], self.board)
+        return super(LF_SFF_MIO_sim, self)._factory(importname, *args, **kargs)
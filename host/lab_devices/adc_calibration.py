@@ -0,0 +1,49 @@
+#####
+# Registry of the FADC calibrations created by LF_SFF_MIO_Calibrate_ADC.py
+# The csv files are parsed once and only reloaded when their modification time changes.
+#####
+import os
+import logging
+import numpy as np
+
+class adc_calibration():
+    def __init__(self, path='./output/ADC_Calibration/data/', channels=['fadc0_rx','fadc1_rx','fadc2_rx','fadc3_rx']):
+        self.path = path
+        self.channels = channels
+        self._entries = {}  # adc_ch: (mtime, (a, a_err, b, b_err))
+
+    def load_all(self):
+        for adc_ch in self.channels:
+            try:
+                self.get(adc_ch)
+            except OSError:
+                logging.debug('No ADC calibration for %s'%(adc_ch))
+
+    # Returns (a, a_err, b, b_err) of U = a*code+b. Raises OSError if there is no calibration file.
+    def get(self, adc_ch):
+        file = self.path+adc_ch+'.csv'
+        try:
+            mtime = os.stat(file).st_mtime
+        except OSError:
+            self._entries.pop(adc_ch, None)
+            raise
+        entry = self._entries.get(adc_ch)
+        if entry is None or entry[0] != mtime:
+            calib = np.genfromtxt(file, delimiter=',')[1:]
+            entry = (mtime, (calib[0][0], calib[0][1], calib[1][0], calib[1][1]))
+            self._entries[adc_ch] = entry
+            logging.info('Successfully loaded ADC calibration for %s'%(adc_ch))
+        return entry[1]
+
+    def invalidate(self, adc_ch=None):
+        if adc_ch is None:
+            self._entries = {}
+        else:
+            self._entries.pop(adc_ch, None)
+
+    # Converts ADC codes to volts, a*data+b in one vectorized pass (in place if out is given)
+    def apply(self, data, adc_ch, out=None, dtype=np.float64):
+        a, a_err, b, b_err = self.get(adc_ch)
+        out = np.multiply(data, a, out=out, dtype=dtype)
+        np.add(out, b, out=out, dtype=dtype)
+        return out
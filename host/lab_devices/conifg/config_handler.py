@@ -1,13 +1,131 @@
 import os
+import sys
+import select
+import struct
+import ctypes
+import ctypes.util
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Settings of a config csv (Setting, Value, Unit) as {setting: (value, unit)}
+def read_config(file_path):
+    config = OrderedDict()
+    for conf in np.genfromtxt(file_path, delimiter=',', dtype='str', autostrip=True, ndmin=2)[1:]:
+        config[conf[0]] = (float(conf[1]), conf[2])
+    return config
+
+
+class inotify():
+    # Minimal inotify binding (Linux), raises OSError where it is not available
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    _event = struct.Struct('iIII')
+
+    def __init__(self, directory, mask=IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify is only available on Linux')
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        try:
+            init, add_watch = libc.inotify_init1, libc.inotify_add_watch
+        except AttributeError:
+            raise OSError('libc has no inotify')
+        self.fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        if add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed', directory)
+
+    # Names of the files changed in the watched directory, empty if nothing happened within timeout
+    def read(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        data = os.read(self.fd, 4096)
+        names = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, cookie, length = self._event.unpack_from(data, pos)
+            pos += self._event.size
+            names.append(os.fsdecode(data[pos:pos+length].rstrip(b'\0')))
+            pos += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
 
 class update_config():
-    def __init__(self, file_path):
-        self._cached_stamp = os.stat(file_path).st_mtime
+    # Watches a config csv in a background thread (inotify, stat polling every interval seconds as fallback).
+    # check_config only tests a flag set by the watcher and writes the settings that changed since the last check.
+    def __init__(self, file_path, interval=0.5):
         self.file = file_path
+        self.interval = interval
+        self.applied = read_config(file_path)  # the file content at the last check
+        self._changed = threading.Event()
+        self._stop = threading.Event()
+        try:
+            self._inotify = inotify(os.path.dirname(os.path.abspath(file_path)))
+            target = self._watch_inotify
+        except OSError as e:
+            logging.debug('update_config: %s, polling %s'%(e, file_path))
+            self._inotify = None
+            target = self._watch_stat
+        self._thread = threading.Thread(target=target, daemon=True, name='update_config')
+        self._thread.start()
 
-    def check_config(self, dut):
+    def _watch_inotify(self):
+        # editors often replace the file instead of writing it, so the directory is watched
+        name = os.path.basename(self.file)
+        while not self._stop.is_set():
+            if name in self._inotify.read(self.interval):
+                self._changed.set()
+        self._inotify.close()
+
+    def _watch_stat(self):
         stamp = os.stat(self.file).st_mtime
-        if stamp != self._cached_stamp:
-            self._cached_stamp = stamp
-            if dut: dut.load_config(self.file)
-            print('file has changed')
+        while not self._stop.wait(self.interval):
+            try:
+                new_stamp = os.stat(self.file).st_mtime
+            except FileNotFoundError:
+                continue  # being replaced
+            if new_stamp != stamp:
+                stamp = new_stamp
+                self._changed.set()
+
+    @property
+    def pending(self):
+        return self._changed.is_set()
+
+    # Waits until the file changed, returns False after timeout seconds without change
+    def wait(self, timeout=None):
+        return self._changed.wait(timeout)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    # Writes the changed settings to the dut and returns them as {setting: (value, unit)}
+    def check_config(self, dut):
+        if not self._changed.is_set():
+            return {}
+        self._changed.clear()
+        try:
+            config = read_config(self.file)
+        except (OSError, ValueError, IndexError) as e:
+            # e.g. read while the file is written, the next event triggers a new check
+            logging.warning('Could not read config %s: %s'%(self.file, e))
+            return {}
+        changed = OrderedDict((name, setting) for name, setting in config.items() if self.applied.get(name) != setting)
+        if not changed:
+            return {}
+        logging.info('%s changed: %s'%(self.file, ', '.join(changed)))
+        if dut:
+            changed = dut.apply_config(changed)
+        # the file content, also the rejected (out of limit) settings, so only new edits are checked again
+        self.applied = config
+        return changed
@@ -0,0 +1,119 @@
+#####
+# Command queue for concurrent access to a LF_SFF_MIO
+# One worker thread owns the USB link: other threads (monitors, live displays, readout loops) submit
+# commands and get a concurrent.futures.Future of the result. Commands run one after another with
+# dut.lock held, so they never interleave with each other or with direct GPAC calls of the main thread.
+# Pending commands are run by priority (READOUT before CONTROL before SLOW_CONTROL), in submission
+# order within one priority. A running command is never interrupted.
+#
+# Example:
+#   with device_worker(dut) as worker:
+#       data = worker.submit(dut.read_adcs, 10000, ['fadc0_rx'], priority=READOUT)
+#       worker.write('CONTROL', RESET=0)
+#       print(data.result())
+#####
+import time
+import logging
+import itertools
+import threading
+import queue
+from concurrent.futures import Future
+
+READOUT = 0
+CONTROL = 1
+SLOW_CONTROL = 2
+PRIORITIES = [READOUT, CONTROL, SLOW_CONTROL]
+
+class device_worker():
+    def __init__(self, dut, name='device_worker'):
+        self.dut = dut
+        self.name = name
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()  # keeps the submission order within a priority
+        self._thread = None
+        self._running = False
+        self.executed = [0, 0, 0]  # per priority
+        self.busy_time = 0.
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True, name=self.name)
+        self._thread.start()
+
+    # Runs the commands that are already queued and stops the worker, commands submitted afterwards fail
+    def stop(self):
+        if self._thread is None:
+            return
+        self._running = False
+        self._queue.put((SLOW_CONTROL+1, next(self._order), None, None, None, None))
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        while True:
+            priority, order, future, fn, args, kwargs = self._queue.get()
+            if future is None:
+                break
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                with self.dut.lock:
+                    result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            self.busy_time += time.perf_counter()-start
+            self.executed[priority] += 1
+        # cancels the commands that were submitted while stopping
+        while not self._queue.empty():
+            future = self._queue.get_nowait()[2]
+            if future is not None:
+                future.cancel()
+
+    # Queues fn(*args, **kwargs) and returns a Future of its result
+    def submit(self, fn, *args, priority=CONTROL, **kwargs):
+        if priority not in PRIORITIES:
+            raise ValueError('Unknown priority %s, use READOUT, CONTROL or SLOW_CONTROL'%(priority))
+        future = Future()
+        if threading.current_thread() is self._thread:
+            # called by a running command: queueing it would wait for itself
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+        if not self._running:
+            raise RuntimeError('%s is not running'%(self.name))
+        self._queue.put((priority, next(self._order), future, fn, args, kwargs))
+        return future
+
+    # Like submit, but waits for the result
+    def call(self, fn, *args, priority=CONTROL, timeout=None, **kwargs):
+        return self.submit(fn, *args, priority=priority, **kwargs).result(timeout)
+
+    # Sets fields of a StdRegister (e.g. CONTROL) and writes it as one command
+    def write(self, register, value=None, priority=CONTROL, **fields):
+        def write():
+            if value is not None:
+                self.dut[register] = value
+            for field in fields:
+                self.dut[register][field] = fields[field]
+            self.dut[register].write()
+        return self.submit(write, priority=priority)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def log_stats(self):
+        logging.info('%s: %i readout, %i control, %i slow control commands, busy %.1f s'%(self.name, self.executed[READOUT], self.executed[CONTROL], self.executed[SLOW_CONTROL], self.busy_time))
@@ -1,46 +1,73 @@
+from contextlib import contextmanager
 from basil.dut import Dut
+from lab_devices.scpi_shadow import shadow_scpi_drivers
+from lab_devices.scpi_coalescer import coalesced_scpi
 
 class function_generator(Dut):
+    def init(self):
+        super(function_generator, self).init()
+        # every command costs several ms on the serial link, redundant settings are dropped (see scpi_shadow)
+        self.shadows = shadow_scpi_drivers(self)
+
+    # Queries all shadowed settings again, e.g. after changing settings on the front panel
+    def resync(self):
+        return {name: shadow.resync() for name, shadow in self.shadows.items()}
+
+    # The settings within are sent as one line and confirmed with one *OPC? (see scpi_coalescer)
+    @contextmanager
+    def coalesce(self):
+        with coalesced_scpi(list(self.shadows.values())):
+            yield
+
     def load_dc_sweep_config(self, voltage_high):
-        self['Pulser'].set_pulse_period(1000)
-        self['Pulser'].set_voltage_high(voltage_high)
-        self['Pulser'].set_voltage_low(voltage_high-0.002)
-        self['Pulser'].set_enable(1)
+        with self.coalesce():
+            self['Pulser'].set_pulse_period(1000)
+            self['Pulser'].set_voltage_high(voltage_high)
+            self['Pulser'].set_voltage_low(voltage_high-0.002)
+            self['Pulser'].set_enable(1)
 
     def load_ac_sweep_config(self, offset, amplitude, frequency):
-        self['Pulser'].set_sin(frequency)
-        self['Pulser'].set_voltage_high(offset+amplitude/2)
-        self['Pulser'].set_voltage_low(offset-amplitude/2)
-        self['Pulser'].set_enable(1)
-        
+        with self.coalesce():
+            self['Pulser'].set_sin(frequency)
+            self['Pulser'].set_voltage_high(offset+amplitude/2)
+            self['Pulser'].set_voltage_low(offset-amplitude/2)
+            self['Pulser'].set_enable(1)
+
     def load_IR_LED_config(self, voltage_high, frequency, pulse_width):
-        self['Pulser'].set_pulse(frequency)
-        self['Pulser'].set_pulse_width(pulse_width)
-        self['Pulser'].set_voltage_high(voltage_high)
-        self['Pulser'].set_voltage_low(0)
-        self['Pulser'].set_enable(1)    
-        self['Pulser'].set_burst_state('ON')
-        self['Pulser'].set_burst_mode('TRIGgered')
-        self['Pulser'].set_trigger_source('BUS')
+        with self.coalesce():
+            self['Pulser'].set_pulse(frequency)
+            self['Pulser'].set_pulse_width(pulse_width)
+            self['Pulser'].set_voltage_high(voltage_high)
+            self['Pulser'].set_voltage_low(0)
+            self['Pulser'].set_enable(1)
+            self['Pulser'].set_burst_state('ON')
+            self['Pulser'].set_burst_mode('TRIGgered')
+            self['Pulser'].set_trigger_source('BUS')
 
     def load_IR_LED_ext_config(self, voltage_high, pulse_width, frequency):
-        self['Pulser'].set_pulse(frequency)
-        self['Pulser'].set_pulse_width(pulse_width)
-        self['Pulser'].set_voltage_high(voltage_high)
-        self['Pulser'].set_voltage_low(0)
-        self['Pulser'].set_enable(1)    
-        self['Pulser'].set_burst_state('ON')
-        self['Pulser'].set_burst_mode('TRIGgered')
-        self['Pulser'].set_trigger_source('EXT')
-    
+        with self.coalesce():
+            self['Pulser'].set_pulse(frequency)
+            self['Pulser'].set_pulse_width(pulse_width)
+            self['Pulser'].set_voltage_high(voltage_high)
+            self['Pulser'].set_voltage_low(0)
+            self['Pulser'].set_enable(1)
+            self['Pulser'].set_burst_state('ON')
+            self['Pulser'].set_burst_mode('TRIGgered')
+            self['Pulser'].set_trigger_source('EXT')
+
     def adc_test_config(self, amplitude, offset, frequency):
-        self['Pulser'].set_sin(frequency)
-        self['Pulser'].set_voltage_high(offset+amplitude/2)
-        self['Pulser'].set_voltage_low(offset-amplitude/2)
-        self['Pulser'].set_enable(1)
-        self['Pulser'].set_enable(1)    
-        self['Pulser'].set_burst_state('OFF')
+        with self.coalesce():
+            self['Pulser'].set_sin(frequency)
+            self['Pulser'].set_voltage_high(offset+amplitude/2)
+            self['Pulser'].set_voltage_low(offset-amplitude/2)
+            self['Pulser'].set_enable(1)
+            self['Pulser'].set_enable(1)
+            self['Pulser'].set_burst_state('OFF')
 
+    # Retunes the period and waits until the generator has applied it (one line with *OPC?)
+    def set_pulse_period(self, period):
+        with self.coalesce():
+            self['Pulser'].set_pulse_period(period)
 
     def send_trigger(self):
-        self['Pulser'].trigger()
\ No newline at end of file
+        self['Pulser'].trigger()
@@ -0,0 +1,812 @@
+#####
+# Stand-ins for the Tektronix TDS3034B oscilloscope and the Agilent 33250A function generator
+#
+# Both instruments are modelled at the SCPI level, so the basil drivers talk to them through their normal
+# transfer layers (see tektronix_tds_3034b_sim.yaml and agilent33250a_pyserial_sim.yaml):
+#   scope      TCP socket server (VISA resource TCPIP::localhost::<port>::SOCKET)
+#   generator  pseudo terminal, linked to a fixed device name (e.g. /tmp/ttySIM_33250A)
+# Headers are matched like on the instruments (short or long form, case insensitive, ';' concatenation).
+# Unknown commands are put into the error queue (SYSTem:ERRor? / ALLEv?) instead of answering.
+#
+# The scope sees the generator output on CH1 and the pixel response on CH2 (gain and a first order
+# low pass), if both stand-ins share the same bench_signal (LF_SFF_MIO_Instrument_Sim.py does that).
+# Every command, query and byte on the link is delayed according to a latency model.
+#####
+import os
+import re
+import time
+import logging
+import threading
+import socketserver
+import tty
+import numpy as np
+from scipy import signal
+
+# Seconds per access and link rates in bytes/s, can be changed with the timing argument
+SCOPE_TIMING = {'command': 1e-3,      # processing of a set command
+                'query': 3e-3,        # processing of a query
+                'curve': 20e-3,       # preparing a CURVe? / measurement result
+                'link_rate': 60e3,    # effective ethernet throughput of the TDS3000
+                'rearm': 20e-3}       # dead time between two acquisitions
+GENERATOR_TIMING = {'command': 5e-3,
+                    'query': 10e-3,
+                    'apply': 60e-3,   # APPLy/FUNCtion changes switch relays
+                    'baudrate': 57600}
+
+BENCH_PIXEL = {'gain': 0.85,          # small signal gain of the source follower
+               'offset': -0.35,       # V
+               'f_3dB': 300e3,        # Hz
+               'noise': 1e-3}         # V (rms) on every scope channel
+
+
+class bench_signal():
+    # Signals on the bench: generator output (CH1) and pixel output (CH2)
+    def __init__(self, pixel=None, seed=None):
+        self.pixel = dict(BENCH_PIXEL, **(pixel or {}))
+        self.rng = np.random.default_rng(seed)
+        self.generator = {'function': 'SIN', 'frequency': 1e3, 'high': 0.05, 'low': -0.05,
+                          'output': False, 'pulse_period': 1e-3, 'pulse_width': 1e-4}
+        self.lock = threading.Lock()
+
+    def generator_output(self, t):
+        gen = self.generator
+        if not gen['output']:
+            return np.zeros(len(t))
+        high, low = gen['high'], gen['low']
+        if gen['function'] == 'SIN':
+            return (high+low)/2+(high-low)/2*np.sin(2*np.pi*gen['frequency']*t)
+        if gen['function'] == 'SQU':
+            return np.where(np.mod(t*gen['frequency'], 1) < 0.5, high, low)
+        if gen['function'] == 'PULS':
+            return np.where(np.mod(t, gen['pulse_period']) < gen['pulse_width'], high, low)
+        if gen['function'] == 'RAMP':
+            return low+(high-low)*np.mod(t*gen['frequency'], 1)
+        return np.full(len(t), (high+low)/2)  # DC
+
+    def period(self):
+        gen = self.generator
+        return gen['pulse_period'] if gen['function'] == 'PULS' else 1/gen['frequency']
+
+    def waveforms(self, channels, t):
+        # Returns {channel: volts} for the sample times t (equally spaced)
+        with self.lock:
+            dt = t[1]-t[0] if len(t) > 1 else 1e-9
+            tau = 1/(2*np.pi*self.pixel['f_3dB'])
+            settle = int(min(10*tau/dt, 10*len(t)))
+            t_ext = np.concatenate([t[0]-dt*np.arange(settle, 0, -1), t])
+            vin = self.generator_output(t_ext)
+            out = {}
+            for ch in channels:
+                if ch == 1:
+                    v = vin[settle:]
+                elif ch == 2:
+                    alpha = 1-np.exp(-dt/tau)
+                    v = self.pixel['offset']+self.pixel['gain']*signal.lfilter([alpha], [1, alpha-1], vin, zi=[vin[0]*(1-alpha)])[0][settle:]
+                else:
+                    v = np.zeros(len(t))
+                out[ch] = v+self.rng.normal(0, self.pixel['noise'], len(t))
+            return out
+
+    def trigger_time(self, level, channel=1):
+        # Time of a rising edge through level within one period of the generator, random if there is none
+        period = self.period()
+        t = np.linspace(0, period, 2001)
+        with self.lock:
+            v = self.generator_output(t) if channel == 1 else self.pixel['offset']+self.pixel['gain']*self.generator_output(t)
+        rising = np.flatnonzero((v[:-1] < level) & (v[1:] >= level))
+        if len(rising):
+            return t[rising[0]]
+        return self.rng.uniform(0, period)
+
+
+def _header_regex(header):
+    # 'HORizontal:MAIn:SCAle' -> matches HOR:MAI:SCA, horizontal:main:scale, ... ; '#' is a numeric suffix
+    nodes = []
+    for node in header.split(':'):
+        suffix = node.endswith('#')
+        node = node.rstrip('#')
+        short = ''.join([c for c in node if c.isupper() or c.isdigit() or c in '*_'])
+        options = sorted(set([short, node.upper()]), key=len, reverse=True)
+        nodes.append('(?:%s)%s'%('|'.join([re.escape(o) for o in options]), '([1-4])?' if suffix else ''))
+    return re.compile('^:?'+':'.join(nodes)+'$', re.IGNORECASE)
+
+
+class scpi_instrument():
+    # Parses SCPI lines and dispatches them to handle_<name>(value, query, *suffixes) methods
+    commands = {}  # header: handler name
+    identification = ''
+
+    def __init__(self, timing):
+        self.timing = timing
+        self.errors = []
+        self._lock = threading.Lock()
+        self._commands = [(_header_regex(header), getattr(self, 'handle_'+name)) for header, name in self.commands.items()]
+
+    def process(self, line):
+        # Returns the response to a line (None if it contained no query)
+        responses = []
+        path = []
+        with self._lock:
+            for command in [c.strip() for c in line.strip().split(';') if c.strip()]:
+                header, _, value = command.partition(' ')
+                query = header.endswith('?')
+                header = header.rstrip('?')
+                handler, suffixes = self._find(header)
+                if handler is None and path and not header.startswith(':') and not header.startswith('*'):
+                    handler, suffixes = self._find(':'.join(path+[header]))
+                if handler is None:
+                    self.errors.append('-113,"Undefined header; %s"'%(command))
+                    continue
+                if not header.startswith('*') and ':' in header.lstrip(':'):
+                    path = header.lstrip(':').split(':')[:-1]
+                self.delay('query' if query else 'command')
+                try:
+                    response = handler(value.strip() or None, query, *suffixes)
+                except (ValueError, IndexError, TypeError):
+                    self.errors.append('-224,"Illegal parameter value; %s"'%(command))
+                    continue
+                if query:
+                    responses.append(response if isinstance(response, binary_block) else str(response))
+        if len(responses) == 1:
+            return responses[0]
+        if any([isinstance(response, binary_block) for response in responses]):
+            return binary_block('', b';'.join([response.data if isinstance(response, binary_block) else response.encode('ascii') for response in responses]))
+        return ';'.join(responses) if responses else None
+
+    def _find(self, header):
+        for regex, handler in self._commands:
+            match = regex.match(header)
+            if match:
+                return handler, [int(s) for s in match.groups() if s is not None]
+        return None, []
+
+    def delay(self, kind, n=1):
+        time.sleep(self.timing[kind]*n)
+
+    def handle_idn(self, value, query):
+        return self.identification
+
+    def handle_rst(self, value, query):
+        self.__init__(self.timing, *self._reset_args())
+
+    def _reset_args(self):
+        return ()
+
+    def handle_cls(self, value, query):
+        self.errors = []
+
+    def handle_opc(self, value, query):
+        return 1 if query else None
+
+    def handle_wai(self, value, query):
+        pass
+
+    def handle_error(self, value, query):
+        return self.errors.pop(0) if self.errors else '0,"No error"'
+
+
+def _float(value):
+    return float(value)
+
+
+def _fmt(value):
+    return '%.4E'%(value)
+
+
+class tds3034b_sim(scpi_instrument):
+    commands = {'*IDN': 'idn', '*RST': 'rst', '*CLS': 'cls', '*OPC': 'opc', '*WAI': 'wai',
+                'ALLEv': 'error', 'SYSTem:ERRor': 'error', 'HEADer': 'header', 'VERBose': 'verbose',
+                'HORizontal:MAIn:SCAle': 'horizontal_scale', 'HORizontal:SCAle': 'horizontal_scale',
+                'HORizontal:RECOrdlength': 'record_length', 'HORizontal:TRIGger:POSition': 'trigger_position',
+                'CH#:SCAle': 'vertical_scale', 'CH#:POSition': 'vertical_position', 'CH#:OFFSet': 'vertical_offset',
+                'CH#:COUPling': 'coupling', 'SELect:CH#': 'select',
+                'TRIGger:A:EDGe:SOUrce': 'trigger_source', 'TRIGger:A:LEVel': 'trigger_level',
+                'TRIGger:A:MODe': 'trigger_mode', 'TRIGger:A:TYPe': 'trigger_type',
+                'TRIGger:A:EDGe:SLOpe': 'trigger_slope', 'TRIGger:STATE': 'trigger_state', 'TRIGger': 'trigger',
+                'ACQuire:STATE': 'acquire_state', 'ACQuire:STOPAfter': 'stop_after', 'ACQuire:MODe': 'acquire_mode',
+                'ACQuire:NUMAVg': 'num_avg', 'ACQuire:NUMACq': 'num_acq',
+                'DATa:SOUrce': 'data_source', 'DATa:ENCdg': 'data_encoding', 'DATa:WIDth': 'data_width',
+                'DATa:STARt': 'data_start', 'DATa:STOP': 'data_stop', 'DATa:INIT': 'data_init',
+                'WFMPre:XINcr': 'xincr', 'WFMPre:XZEro': 'xzero', 'WFMPre:PT_Off': 'pt_off',
+                'WFMPre:YMUlt': 'ymult', 'WFMPre:YOFf': 'yoff', 'WFMPre:YZEro': 'yzero',
+                'WFMPre:NR_Pt': 'nr_pt', 'WFMPre:BYT_Nr': 'data_width', 'WFMPre:ENCdg': 'data_encoding',
+                'WFMPre:XUNit': 'xunit', 'WFMPre:YUNit': 'yunit', 'WFMPre': 'preamble',
+                'CURVe': 'curve',
+                'MEASUrement:IMMed:TYPe': 'meas_type', 'MEASUrement:IMMed:SOUrce1': 'meas_source',
+                'MEASUrement:IMMed:SOUrce': 'meas_source', 'MEASUrement:IMMed:VALue': 'meas_value',
+                'MEASUrement:IMMed:UNIts': 'meas_units',
+                'MEASUrement:MEAS#:TYPe': 'meas_type', 'MEASUrement:MEAS#:SOUrce1': 'meas_source',
+                'MEASUrement:MEAS#:SOUrce': 'meas_source', 'MEASUrement:MEAS#:STATE': 'meas_state',
+                'MEASUrement:MEAS#:VALue': 'meas_value', 'MEASUrement:MEAS#:UNIts': 'meas_units'}
+    identification = 'TEKTRONIX,TDS 3034B,0,CF:91.1CT FV:v3.41 TDS3GM:v1.00 TDS3FFT:v1.00 TDS3TRG:v1.00'
+    levels_per_div = 25  # digitizing levels per division (1 byte data)
+
+    def __init__(self, timing=None, bench=None):
+        super(tds3034b_sim, self).__init__(dict(SCOPE_TIMING, **(timing or {})))
+        self.bench = bench or bench_signal()
+        self.header = False
+        self.horizontal = {'scale': 200e-6, 'record_length': 10000, 'trigger_position': 50.}
+        self.channels = {ch: {'scale': 1., 'position': 0., 'offset': 0., 'coupling': 'DC', 'select': ch == 1} for ch in range(1, 5)}
+        self.trig = {'source': 1, 'level': 0., 'mode': 'AUTO', 'type': 'EDGE', 'slope': 'RISE'}
+        self.acquire = {'state': True, 'stop_after': 'RUNSTOP', 'mode': 'SAMPLE', 'num_avg': 16, 'count': 0}
+        self.data = {'source': 1, 'encoding': 'ASCII', 'width': 1, 'start': 1, 'stop': 10000}
+        self.measurements = {slot: {'type': 'MEAN', 'source': 1, 'state': slot == 0} for slot in range(5)}  # 0 = IMMed
+        self._record = None  # (time of the acquisition, sample times, {channel: volts})
+        self._acquired = 0.  # end of the last acquisition
+
+    def _reset_args(self):
+        return (None, self.bench)
+
+    def handle_header(self, value, query):
+        if query:
+            return int(self.header)
+        self.header = value.upper() in ['ON', '1']
+
+    def handle_verbose(self, value, query):
+        return 1 if query else None
+
+    # Horizontal
+    def handle_horizontal_scale(self, value, query):
+        if query:
+            return _fmt(self.horizontal['scale'])
+        self.horizontal['scale'] = _float(value)
+        self._record = None
+
+    def handle_record_length(self, value, query):
+        if query:
+            return self.horizontal['record_length']
+        # the TDS3000 only knows 500 and 10000 points
+        self.horizontal['record_length'] = 500 if int(_float(value)) <= 500 else 10000
+        self.data['stop'] = min(self.data['stop'], self.horizontal['record_length'])
+        self._record = None
+
+    def handle_trigger_position(self, value, query):
+        if query:
+            return _fmt(self.horizontal['trigger_position'])
+        self.horizontal['trigger_position'] = min(max(_float(value), 0), 100)
+
+    # Vertical
+    def handle_vertical_scale(self, value, query, ch):
+        if query:
+            return _fmt(self.channels[ch]['scale'])
+        self.channels[ch]['scale'] = _float(value)
+
+    def handle_vertical_position(self, value, query, ch):
+        if query:
+            return _fmt(self.channels[ch]['position'])
+        self.channels[ch]['position'] = min(max(_float(value), -5), 5)
+
+    def handle_vertical_offset(self, value, query, ch):
+        if query:
+            return _fmt(self.channels[ch]['offset'])
+        self.channels[ch]['offset'] = _float(value)
+
+    def handle_coupling(self, value, query, ch):
+        if query:
+            return self.channels[ch]['coupling']
+        value = value.upper()
+        if value not in ['AC', 'DC', 'GND']:
+            raise ValueError(value)
+        self.channels[ch]['coupling'] = value
+
+    def handle_select(self, value, query, ch):
+        if query:
+            return int(self.channels[ch]['select'])
+        self.channels[ch]['select'] = value.upper() in ['ON', '1']
+
+    # Trigger
+    def handle_trigger_source(self, value, query):
+        if query:
+            return 'CH%i'%(self.trig['source'])
+        self.trig['source'] = int(value.upper().replace('CH', ''))
+
+    def handle_trigger_level(self, value, query):
+        if query:
+            return _fmt(self.trig['level'])
+        self.trig['level'] = _float(value)
+
+    def handle_trigger_mode(self, value, query):
+        if query:
+            return self.trig['mode']
+        self.trig['mode'] = 'NORMAL' if value.upper().startswith('NORM') else 'AUTO'
+
+    def handle_trigger_type(self, value, query):
+        if query:
+            return self.trig['type']
+        self.trig['type'] = value.upper()
+
+    def handle_trigger_slope(self, value, query):
+        if query:
+            return self.trig['slope']
+        self.trig['slope'] = 'FALL' if value.upper().startswith('FALL') else 'RISE'
+
+    def handle_trigger_state(self, value, query):
+        return 'TRIGGER' if self.acquire['state'] else 'SAVE'
+
+    def handle_trigger(self, value, query):
+        if value and value.upper().startswith('FORC'):
+            self._acquire(force=True)
+
+    # Acquisition
+    def handle_acquire_state(self, value, query):
+        if query:
+            self._finish_sequence()
+            return int(self.acquire['state'])
+        state = value.upper() in ['ON', 'RUN', '1']
+        if state and self.acquire['stop_after'] == 'SEQUENCE':
+            # single sequence: one acquisition that is done after trigger + record span
+            self.acquire['state'] = True
+            self._record = None
+            self._sequence_end = time.time()+self._span()+self.timing['rearm']
+        else:
+            self.acquire['state'] = state
+
+    def _finish_sequence(self):
+        if self.acquire['stop_after'] == 'SEQUENCE' and self.acquire['state'] and time.time() >= getattr(self, '_sequence_end', 0):
+            self._acquire(force=True)
+            self.acquire['state'] = False
+
+    def handle_opc(self, value, query):
+        if not query:
+            return None
+        # waits for a running single sequence
+        if self.acquire['stop_after'] == 'SEQUENCE' and self.acquire['state']:
+            time.sleep(max(getattr(self, '_sequence_end', 0)-time.time(), 0))
+            self._finish_sequence()
+        return 1
+
+    def handle_stop_after(self, value, query):
+        if query:
+            return self.acquire['stop_after']
+        self.acquire['stop_after'] = 'SEQUENCE' if value.upper().startswith('SEQ') else 'RUNSTOP'
+
+    def handle_acquire_mode(self, value, query):
+        if query:
+            return self.acquire['mode']
+        self.acquire['mode'] = value.upper()
+
+    def handle_num_avg(self, value, query):
+        if query:
+            return self.acquire['num_avg']
+        self.acquire['num_avg'] = int(_float(value))
+
+    def handle_num_acq(self, value, query):
+        return self.acquire['count']
+
+    def _span(self):
+        return 10*self.horizontal['scale']
+
+    def _acquire(self, force=False):
+        # Records all channels at once, in RUN mode a new record is taken if the last one is older than its span
+        now = time.time()
+        if self._record is not None and not force:
+            if not self.acquire['state'] or now-self._acquired < self._span()+self.timing['rearm']:
+                return self._record
+        n = self.horizontal['record_length']
+        dt = self._span()/n
+        trig = self.bench.trigger_time(self.trig['level'], self.trig['source'])+self.bench.period()*self.bench.rng.integers(1000)
+        t = trig+(np.arange(n)-n*self.horizontal['trigger_position']/100.)*dt
+        volts = self.bench.waveforms([1, 2, 3, 4], t)
+        for ch, v in volts.items():
+            if self.channels[ch]['coupling'] == 'AC':
+                v -= np.mean(v)
+            elif self.channels[ch]['coupling'] == 'GND':
+                v[:] = 0
+        self._record = (now, t, volts)
+        self._acquired = now
+        self.acquire['count'] += 1
+        return self._record
+
+    def _digitize(self, ch):
+        # Converts the record of a channel into the digitizing levels of the current data width
+        cfg = self.channels[ch]
+        volts = self._acquire()[2][ch]
+        scale = 256**(self.data['width']-1)
+        ymult = cfg['scale']/self.levels_per_div/scale
+        yoff = cfg['position']*self.levels_per_div*scale
+        raw = np.round((volts-cfg['offset'])/ymult+yoff)
+        limit = 127*scale if self.data['width'] == 1 else 32767
+        return np.clip(raw, -limit, limit).astype(np.int32), ymult, yoff
+
+    # Waveform transfer
+    def handle_data_source(self, value, query):
+        if query:
+            return 'CH%i'%(self.data['source'])
+        self.data['source'] = int(value.upper().replace('CH', ''))
+
+    def handle_data_encoding(self, value, query):
+        if query:
+            return self.data['encoding']
+        value = value.upper()
+        encodings = {'ASCI': 'ASCII', 'RIB': 'RIBINARY', 'RPB': 'RPBINARY', 'SRI': 'SRIBINARY', 'SRP': 'SRPBINARY'}
+        for short, encoding in encodings.items():
+            if value.startswith(short):
+                self.data['encoding'] = encoding
+                return
+        raise ValueError(value)
+
+    def handle_data_width(self, value, query):
+        if query:
+            return self.data['width']
+        self.data['width'] = 2 if int(_float(value)) >= 2 else 1
+
+    def handle_data_start(self, value, query):
+        if query:
+            return self.data['start']
+        self.data['start'] = min(max(int(_float(value)), 1), self.horizontal['record_length'])
+
+    def handle_data_stop(self, value, query):
+        if query:
+            return self.data['stop']
+        self.data['stop'] = min(max(int(_float(value)), 1), self.horizontal['record_length'])
+
+    def handle_data_init(self, value, query):
+        self.data = {'source': 1, 'encoding': 'RIBINARY', 'width': 1, 'start': 1, 'stop': self.horizontal['record_length']}
+
+    def _window(self):
+        start = self.data['start']-1
+        stop = min(max(self.data['stop'], self.data['start']), self.horizontal['record_length'])
+        return start, stop
+
+    def handle_xincr(self, value, query):
+        return _fmt(self._span()/self.horizontal['record_length'])
+
+    def handle_xzero(self, value, query):
+        start, stop = self._window()
+        return _fmt(self._acquire()[1][start]-self._acquire()[1][0])
+
+    def handle_pt_off(self, value, query):
+        return 0
+
+    def handle_ymult(self, value, query):
+        cfg = self.channels[self.data['source']]
+        return _fmt(cfg['scale']/self.levels_per_div/256**(self.data['width']-1))
+
+    def handle_yoff(self, value, query):
+        # includes the offset of the unsigned (RP) encodings, so volts = (curve-YOFf)*YMUlt+YZEro holds for all of them
+        cfg = self.channels[self.data['source']]
+        unsigned = (128 if self.data['width'] == 1 else 32768) if self.data['encoding'] in ['RPBINARY', 'SRPBINARY'] else 0
+        return _fmt(cfg['position']*self.levels_per_div*256**(self.data['width']-1)+unsigned)
+
+    def handle_yzero(self, value, query):
+        return _fmt(self.channels[self.data['source']]['offset'])
+
+    def handle_nr_pt(self, value, query):
+        start, stop = self._window()
+        return stop-start
+
+    def handle_xunit(self, value, query):
+        return '"s"'
+
+    def handle_yunit(self, value, query):
+        return '"V"'
+
+    def handle_preamble(self, value, query):
+        ch = self.data['source']
+        binary = self.data['encoding'] != 'ASCII'
+        return ';'.join([str(self.data['width']), str(8*self.data['width']), 'BIN' if binary else 'ASC',
+                         'RI' if self.data['encoding'] in ['ASCII', 'RIBINARY', 'SRIBINARY'] else 'RP',
+                         'LSB' if self.data['encoding'].startswith('S') else 'MSB',
+                         '"Ch%i, %s coupling, %s V/div, %s s/div, %i points, Sample mode"'%(ch, self.channels[ch]['coupling'], _fmt(self.channels[ch]['scale']), _fmt(self.horizontal['scale']), self.horizontal['record_length']),
+                         str(self.handle_nr_pt(None, True)), 'Y', '"s"', self.handle_xincr(None, True), self.handle_xzero(None, True), '0',
+                         '"V"', self.handle_ymult(None, True), self.handle_yzero(None, True), self.handle_yoff(None, True)])
+
+    def handle_curve(self, value, query):
+        raw, ymult, yoff = self._digitize(self.data['source'])
+        start, stop = self._window()
+        raw = raw[start:stop]
+        self.delay('curve')
+        if self.data['encoding'] == 'ASCII':
+            response = ','.join(map(str, raw))
+        else:
+            width = self.data['width']
+            if self.data['encoding'] in ['RPBINARY', 'SRPBINARY']:
+                raw = raw+(128 if width == 1 else 32768)
+            dtype = {('RI', 1): '>i1', ('RI', 2): '>i2', ('RP', 1): '>u1', ('RP', 2): '>u2'}[(self.data['encoding'][-8:-6], width)]
+            if self.data['encoding'].startswith('S'):
+                dtype = '<'+dtype[1:]
+            data = raw.astype(dtype).tobytes()
+            length = str(len(data))
+            response = binary_block('#%i%s'%(len(length), length), data)
+        return response
+
+    # Measurements, evaluated on the current record
+    def _slot(self, suffixes):
+        return suffixes[0] if suffixes else 0
+
+    def handle_meas_type(self, value, query, *slot):
+        m = self.measurements[self._slot(slot)]
+        if query:
+            return m['type']
+        m['type'] = value.upper()
+
+    def handle_meas_source(self, value, query, *slot):
+        m = self.measurements[self._slot(slot)]
+        if query:
+            return 'CH%i'%(m['source'])
+        m['source'] = int(value.upper().replace('CH', ''))
+
+    def handle_meas_state(self, value, query, *slot):
+        m = self.measurements[self._slot(slot)]
+        if query:
+            return int(m['state'])
+        m['state'] = value.upper() in ['ON', '1']
+
+    def handle_meas_units(self, value, query, *slot):
+        m = self.measurements[self._slot(slot)]
+        return '"Hz"' if m['type'].startswith('FREQ') else '"s"' if m['type'].startswith('PERI') else '"V"'
+
+    def handle_meas_value(self, value, query, *slot):
+        m = self.measurements[self._slot(slot)]
+        self.delay('curve')
+        record = self._acquire()
+        v = record[2][m['source']]
+        kind = m['type']
+        if kind.startswith('MEAN'):
+            result = np.mean(v)
+        elif kind.startswith('PK2'):
+            result = np.ptp(v)
+        elif kind.startswith('AMP'):
+            result = np.percentile(v, 98)-np.percentile(v, 2)
+        elif kind.startswith('RMS'):
+            result = np.sqrt(np.mean(np.square(v)))
+        elif kind.startswith('MAX'):
+            result = np.max(v)
+        elif kind.startswith('MINI'):
+            result = np.min(v)
+        elif kind.startswith('HIGH'):
+            result = np.percentile(v, 98)
+        elif kind.startswith('LOW'):
+            result = np.percentile(v, 2)
+        elif kind.startswith('FREQ') or kind.startswith('PERI'):
+            # rising crossings with 10 % hysteresis, so noise does not add crossings
+            centered = v-np.mean(v)
+            hysteresis = 0.1*np.ptp(v)
+            state = np.where(centered > hysteresis, 1, np.where(centered < -hysteresis, -1, 0))
+            last = np.maximum.accumulate(np.where(state != 0, np.arange(len(state)), 0))
+            crossings = np.flatnonzero(np.diff(state[last]) == 2)
+            if len(crossings) < 2:
+                return '9.9000E+37'  # the TDS3000 returns 9.9E37 if there is no valid result
+            period = (record[1][crossings[-1]]-record[1][crossings[0]])/(len(crossings)-1)
+            result = 1/period if kind.startswith('FREQ') else period
+        else:
+            return '9.9000E+37'
+        return _fmt(result)
+
+
+class binary_block(str):
+    # IEEE 488.2 definite length block, sent as raw bytes
+    def __new__(cls, header, data):
+        obj = str.__new__(cls, header)
+        obj.data = header.encode('ascii')+data
+        return obj
+
+
+class agilent33250a_sim(scpi_instrument):
+    commands = {'*IDN': 'idn', '*RST': 'rst', '*CLS': 'cls', '*OPC': 'opc', '*WAI': 'wai', '*TRG': 'trg',
+                'SYSTem:ERRor': 'error',
+                'APPLy:SINusoid': 'apply_sin', 'APPLy:SQUare': 'apply_square', 'APPLy:PULSe': 'apply_pulse',
+                'APPLy:RAMP': 'apply_ramp', 'APPLy:DC': 'apply_dc', 'APPLy': 'apply',
+                'FUNCtion': 'function', 'FUNCtion:SHAPe': 'function', 'FREQuency': 'frequency',
+                'VOLTage': 'amplitude', 'VOLTage:AMPLitude': 'amplitude', 'VOLTage:OFFSet': 'offset',
+                'VOLTage:HIGH': 'high', 'VOLTage:LOW': 'low',
+                'PULSe:PERiod': 'pulse_period', 'PULSe:WIDTh': 'pulse_width',
+                'OUTPut': 'output', 'OUTPut:STATe': 'output', 'OUTPut:LOAD': 'load',
+                'BURSt:STATe': 'burst_state', 'BURSt:MODE': 'burst_mode', 'BURSt:NCYCles': 'burst_cycles',
+                'TRIGger:SOURce': 'trigger_source', 'TRIGger:DELay': 'trigger_delay'}
+    identification = 'Agilent Technologies,33250A,0,2.05-2.05-1.02-2.00'
+
+    def __init__(self, timing=None, bench=None):
+        super(agilent33250a_sim, self).__init__(dict(GENERATOR_TIMING, **(timing or {})))
+        self.bench = bench or bench_signal()
+        self.bench.generator.update({'function': 'SIN', 'frequency': 1e3, 'high': 0.05, 'low': -0.05, 'output': False})
+        self.settings = {'load': 50., 'burst_state': False, 'burst_mode': 'TRIGGERED', 'burst_cycles': 1,
+                         'trigger_source': 'IMMEDIATE', 'trigger_delay': 0.}
+        self.triggers = 0
+
+    def _reset_args(self):
+        return (None, self.bench)
+
+    def delay(self, kind, n=1):
+        if kind == 'byte':
+            time.sleep(10.*n/self.timing['baudrate'])
+        else:
+            super(agilent33250a_sim, self).delay(kind, n)
+
+    def _set(self, **kwargs):
+        with self.bench.lock:
+            self.bench.generator.update(kwargs)
+
+    def _apply(self, function, value):
+        self.delay('apply')
+        args = [_float(v) for v in (value or '').split(',') if v.strip() and v.strip().upper() != 'DEF']
+        gen = self.bench.generator
+        frequency = args[0] if len(args) > 0 else gen['frequency']
+        amplitude = args[1] if len(args) > 1 else gen['high']-gen['low']
+        offset = args[2] if len(args) > 2 else (gen['high']+gen['low'])/2
+        self._set(function=function, frequency=frequency, high=offset+amplitude/2, low=offset-amplitude/2, output=True)
+        if function == 'PULS':
+            self._set(pulse_period=1/frequency)
+
+    def handle_apply_sin(self, value, query):
+        self._apply('SIN', value)
+
+    def handle_apply_square(self, value, query):
+        self._apply('SQU', value)
+
+    def handle_apply_pulse(self, value, query):
+        self._apply('PULS', value)
+
+    def handle_apply_ramp(self, value, query):
+        self._apply('RAMP', value)
+
+    def handle_apply_dc(self, value, query):
+        self._apply('DC', ','.join(['1e3', '0', (value or '0').split(',')[-1]]))
+
+    def handle_apply(self, value, query):
+        gen = self.bench.generator
+        return '"%s %s,%s,%s"'%(gen['function'], _fmt(gen['frequency']), _fmt(gen['high']-gen['low']), _fmt((gen['high']+gen['low'])/2))
+
+    def handle_function(self, value, query):
+        if query:
+            return self.bench.generator['function']
+        self.delay('apply')
+        value = value.upper()
+        for function in ['SIN', 'SQU', 'PULS', 'RAMP', 'DC']:
+            if value.startswith(function):
+                self._set(function=function)
+                return
+        raise ValueError(value)
+
+    def handle_frequency(self, value, query):
+        if query:
+            return _fmt(self.bench.generator['frequency'])
+        self._set(frequency=_float(value))
+
+    def handle_amplitude(self, value, query):
+        gen = self.bench.generator
+        if query:
+            return _fmt(gen['high']-gen['low'])
+        offset = (gen['high']+gen['low'])/2
+        self._set(high=offset+_float(value)/2, low=offset-_float(value)/2)
+
+    def handle_offset(self, value, query):
+        gen = self.bench.generator
+        if query:
+            return _fmt((gen['high']+gen['low'])/2)
+        amplitude = gen['high']-gen['low']
+        self._set(high=_float(value)+amplitude/2, low=_float(value)-amplitude/2)
+
+    def handle_high(self, value, query):
+        if query:
+            return _fmt(self.bench.generator['high'])
+        self._set(high=_float(value))
+
+    def handle_low(self, value, query):
+        if query:
+            return _fmt(self.bench.generator['low'])
+        self._set(low=_float(value))
+
+    def handle_pulse_period(self, value, query):
+        if query:
+            return _fmt(self.bench.generator['pulse_period'])
+        self._set(pulse_period=_float(value))
+
+    def handle_pulse_width(self, value, query):
+        if query:
+            return _fmt(self.bench.generator['pulse_width'])
+        self._set(pulse_width=_float(value))
+
+    def handle_output(self, value, query):
+        if query:
+            return int(self.bench.generator['output'])
+        self.delay('apply')
+        self._set(output=value.upper() in ['ON', '1'])
+
+    def handle_load(self, value, query):
+        if query:
+            return _fmt(self.settings['load'])
+        self.settings['load'] = 9.9e37 if value.upper().startswith('INF') else _float(value)
+
+    def handle_burst_state(self, value, query):
+        if query:
+            return int(self.settings['burst_state'])
+        self.settings['burst_state'] = value.upper() in ['ON', '1']
+
+    def handle_burst_mode(self, value, query):
+        if query:
+            return self.settings['burst_mode'][:4]
+        self.settings['burst_mode'] = 'GATED' if value.upper().startswith('GAT') else 'TRIGGERED'
+
+    def handle_burst_cycles(self, value, query):
+        if query:
+            return self.settings['burst_cycles']
+        self.settings['burst_cycles'] = int(_float(value))
+
+    def handle_trigger_source(self, value, query):
+        if query:
+            return self.settings['trigger_source'][:3]
+        value = value.upper()
+        self.settings['trigger_source'] = 'BUS' if value.startswith('BUS') else 'EXTERNAL' if value.startswith('EXT') else 'IMMEDIATE'
+
+    def handle_trigger_delay(self, value, query):
+        if query:
+            return _fmt(self.settings['trigger_delay'])
+        self.settings['trigger_delay'] = _float(value)
+
+    def handle_trg(self, value, query):
+        self.triggers += 1
+
+
+class _socket_handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        instrument = self.server.instrument
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            response = instrument.process(line.decode('ascii', errors='ignore'))
+            if response is None:
+                continue
+            data = response.data if isinstance(response, binary_block) else response.encode('ascii')
+            data += b'\n'
+            time.sleep(len(data)/instrument.timing['link_rate'])
+            self.wfile.write(data)
+
+
+class _socket_server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_scope_sim(port=4000, host='localhost', **kwargs):
+    # Serves a tds3034b_sim on host:port in a background thread, returns the server (server.instrument)
+    server = _socket_server((host, port), _socket_handler)
+    server.instrument = tds3034b_sim(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True, name='scope_sim').start()
+    logging.info('TDS3034B stand-in listening on TCPIP::%s::%i::SOCKET'%(host, port))
+    return server
+
+
+class pty_device():
+    # Serves an agilent33250a_sim on a pseudo terminal, link is a stable name for the slave device
+    def __init__(self, instrument, link='/tmp/ttySIM_33250A'):
+        self.instrument = instrument
+        self.link = link
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)  # no echo, no line editing
+        self.port = os.ttyname(self._slave)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(self.port, link)
+        self._thread = threading.Thread(target=self._serve, daemon=True, name='generator_sim')
+        self._thread.start()
+
+    def _serve(self):
+        buffer = b''
+        while True:
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                break
+            self.instrument.delay('byte', len(data))
+            buffer += data
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                response = self.instrument.process(line.decode('ascii', errors='ignore'))
+                if response is not None:
+                    response = response.encode('ascii')+b'\n'
+                    self.instrument.delay('byte', len(response))
+                    os.write(self._master, response)
+
+    def close(self):
+        if os.path.islink(self.link):
+            os.remove(self.link)
+        os.close(self._master)
+        os.close(self._slave)
+
+
+def start_generator_sim(link='/tmp/ttySIM_33250A', **kwargs):
+    device = pty_device(agilent33250a_sim(**kwargs), link)
+    logging.info('33250A stand-in on %s (%s)'%(link, device.port))
+    return device
@@ -3,16 +3,73 @@ import sys
 sys.path.append("../")
 import utils.plot_fit as pltfit 
 import numpy as np
+from collections import OrderedDict
+from lab_devices.scpi_shadow import shadow_scpi_drivers
 import matplotlib.pyplot as plt
 import time
 
+# numpy dtypes of the binary CURVe? encodings (RI: signed, RP: unsigned, S: LSB first) per DATa:WIDth
+CURVE_DTYPES = {'RIBINARY': {1: '>i1', 2: '>i2'}, 'RPBINARY': {1: '>u1', 2: '>u2'},
+                'SRIBINARY': {1: '<i1', 2: '<i2'}, 'SRPBINARY': {1: '<u1', 2: '<u2'}}
+
+# The TDS3000 has four measurement slots (MEASUrement:MEAS1-4) and the immediate measurement (MEASUrement:IMMed)
+MEASUREMENT_SLOTS = 4
+NO_RESULT = 9.9e37  # returned if there is no valid result (e.g. no edge for FREQuency)
+# The TDS3000 records 10 divisions with 500 or 10000 points
+RECORD_LENGTHS = [500, 10000]
+DIVISIONS = 10
+# Settings that change by themselves or are written by this class without the driver, they are not shadowed
+SHADOW_VOLATILE = ['acquire_state', 'acquire_stop_after', 'horizontal_record_length', 'source',
+                   'data_encoding', 'data_width', 'data_start', 'data_stop']
+
 class oscilloscope(Dut):
+    # encoding: 'RIBinary', 'RPBinary', 'SRIBinary', 'SRPBinary' or 'ASCii' for the CURVe? transfer,
+    # width: bytes per point (1: 8 bit as digitized, 2: 16 bit, only useful for averaged waveforms)
+    def __init__(self, conf, encoding='RIBinary', width=1):
+        super(oscilloscope, self).__init__(conf)
+        self.encoding = encoding.upper()
+        self.width = width
+        self._preamble = {}  # channel: waveform scaling, see get_preamble
+        self._acquiring = None  # unknown
+        self._measurements = OrderedDict()  # name: slot, see setup_measurements
+        self._horizontal_scale = None  # unknown
+        self._record_length = None
+
+    def init(self):
+        super(oscilloscope, self).init()
+        # redundant settings of the load_*_config methods and sweeps are dropped, see scpi_shadow
+        self.shadows = shadow_scpi_drivers(self, volatile=SHADOW_VOLATILE)
+        self.set_waveform_encoding(self.encoding, self.width)
+
+    # Queries all shadowed settings again, e.g. after changing settings on the front panel
+    def resync(self):
+        self.invalidate_preamble()
+        return {name: shadow.resync() for name, shadow in self.shadows.items()}
+
+    def set_waveform_encoding(self, encoding='RIBinary', width=1):
+        self.encoding = encoding.upper()
+        self.width = width
+        if not self.encoding.startswith('ASC') and self.encoding not in CURVE_DTYPES:
+            raise ValueError('Unknown waveform encoding %s'%(encoding))
+        self['Visa'].write('DATa:ENCdg %s;WIDth %i'%(encoding, width))
+        self.invalidate_preamble()
+
+    # The scaling of the waveforms is cached per channel, it has to be invalidated after changing
+    # the vertical or horizontal settings (done by the load_*_config methods and set_waveform_encoding)
+    def invalidate_preamble(self, channel=None):
+        if channel is None:
+            self._preamble = {}
+            self._horizontal_scale = None
+            self._record_length = None
+        else:
+            self._preamble.pop(channel, None)
 
     #################################
     # Configs for experiments
     #################################
 
     def load_dc_sweep_config(self):
+        self.invalidate_preamble()
         self['Oscilloscope'].set_horizontal_scale(200e-6)
         self['Oscilloscope'].set_vertical_scale('2.0E-1',channel=1)
         self['Oscilloscope'].set_vertical_scale('200.0E-3',channel=2)
@@ -22,9 +79,11 @@ class oscilloscope(Dut):
         self['Oscilloscope'].set_coupling('DC', channel=1)
         self['Oscilloscope'].set_coupling('DC', channel=2)
         self['Oscilloscope'].set_acquire_state('RUN')
+        self._acquiring = True
         time.sleep(2)
 
     def load_ac_sweep_config(self):
+        self.invalidate_preamble()
         self['Oscilloscope'].set_horizontal_scale(200e-6)
         self['Oscilloscope'].set_vertical_scale('50.0E-3',channel=1)
         self['Oscilloscope'].set_vertical_scale('50.0E-3',channel=2)
@@ -36,10 +95,12 @@ class oscilloscope(Dut):
         self['Oscilloscope'].set_trigger_source(channel=1)
         self['Oscilloscope'].set_trigger_level(-12e-3)
         self['Oscilloscope'].set_acquire_state('RUN')
+        self._acquiring = True
 
         time.sleep(2)
 
     def load_IR_LED_config(self, frequency, CH2_DC):
+        self.invalidate_preamble()
         self['Oscilloscope'].set_horizontal_scale(20*1e-3)
         self['Oscilloscope'].set_vertical_scale('1',channel=1)
         self['Oscilloscope'].set_vertical_scale('100e-3',channel=2)
@@ -53,6 +114,7 @@ class oscilloscope(Dut):
         self['Oscilloscope'].set_trigger_mode('NORM')
         self['Oscilloscope'].set_trigger_type('EDG')
         self['Oscilloscope'].set_acquire_state('RUN')
+        self._acquiring = True
         if CH2_DC:
             self['Oscilloscope'].set_coupling('DC', channel=2)
             self['Oscilloscope'].set_vertical_position('-5.0E0',channel=2)
@@ -64,16 +126,172 @@ class oscilloscope(Dut):
     # General measurement methods
     #################################
 
-        
+    def set_horizontal_scale(self, scale):
+        if scale == self._horizontal_scale:
+            return
+        self['Oscilloscope'].set_horizontal_scale(scale)
+        self.invalidate_preamble()
+        self._horizontal_scale = scale
+
+    def get_horizontal_scale(self):
+        if self._horizontal_scale is None:
+            self._horizontal_scale = float(self['Visa'].query('HORizontal:MAIn:SCAle?').split()[-1])
+        return self._horizontal_scale
+
+    def set_record_length(self, points):
+        self['Visa'].write('HORizontal:RECOrdlength %i'%(points))
+        self._preamble = {}
+        self._record_length = None
+
+    def get_record_length(self):
+        if self._record_length is None:
+            self._record_length = int(float(self['Visa'].query('HORizontal:RECOrdlength?').split()[-1]))
+        return self._record_length
+
+    # Transfers only the points start to stop (1 based, inclusive) of the record, None for the whole record
+    # (the scope limits stop to the record length, set it after set_record_length)
+    def set_data_window(self, start=1, stop=None):
+        self['Visa'].write('DATa:STARt %i;STOP %i'%(start, stop or max(RECORD_LENGTHS)))
+        self._preamble = {}
+
+    # Selects the smallest record length with at least points_per_period points per period of frequency
+    # at the current horizontal scale and a window of the first periods periods (the whole record, if it
+    # holds less). Returns the number of points per transferred waveform.
+    def set_periods_window(self, frequency, periods=5, points_per_period=50):
+        span = DIVISIONS*self.get_horizontal_scale()
+        for record_length in RECORD_LENGTHS:
+            if record_length/(span*frequency) >= points_per_period:
+                break
+        if record_length != self.get_record_length():
+            self.set_record_length(record_length)
+            self._record_length = record_length
+        points = min(int(np.ceil(periods*record_length/(span*frequency))), record_length)
+        self.set_data_window(1, points)
+        return points
+
+    # Scaling of the waveform of a channel (one query, cached): ymult, yoff, yzero, xincr, points and the vertical scale (V/div)
+    def get_preamble(self, channel=1):
+        if channel not in self._preamble:
+            self['Visa'].write('DATa:SOUrce CH%i'%(channel))
+            response = self['Visa'].query('WFMPre:YMUlt?;YOFf?;YZEro?;XINcr?;NR_Pt?;:CH%i:SCAle?'%(channel))
+            # the values are the last word of each field, with HEADer ON the fields start with the header
+            values = [float(field.split()[-1]) for field in response.strip().split(';')]
+            self._preamble[channel] = dict(zip(['ymult', 'yoff', 'yzero', 'xincr', 'points', 'scale'], values))
+        return self._preamble[channel]
+
+    # Reads an IEEE 488.2 definite length block (#<digits><length><data>) and the following separator (';' or termination)
+    def _read_block(self):
+        resource = self['Visa']._resource
+        while resource.read_bytes(1) != b'#':  # skips the header of the response (HEADer ON)
+            pass
+        digits = int(resource.read_bytes(1))
+        length = int(resource.read_bytes(digits))
+        data = resource.read_bytes(length)
+        resource.read_bytes(1)
+        return data
+
+    # Curves of several channels in digitizing levels, requested in one message and read as one response
+    def get_curves(self, channels=(1, 2)):
+        query = ';:'.join(['DATa:SOUrce CH%i;:CURVe?'%(channel) for channel in channels])
+        if self.encoding.startswith('ASC'):
+            response = self['Visa'].query(query)
+            return [np.array(curve.split()[-1].split(','), dtype=np.float64) for curve in response.strip().split(';')]
+        self['Visa'].write(query)
+        return [np.frombuffer(self._read_block(), dtype=CURVE_DTYPES[self.encoding][self.width]) for channel in channels]
+
+    def get_curve(self, channel=1):
+        return self.get_curves([channel])[0]
+
+    def _to_volts(self, channel, raw):
+        preamble = self.get_preamble(channel)
+        return (raw-preamble['yoff'])*preamble['ymult']+preamble['yzero']
+
+    # Same result as get_waveform of the basil driver: [channel, volts, [x increment], [vertical scale]].
+    # The acquisition is stopped, so several channels can be read from the same acquisition with
+    # continue_meas=False, it is restarted after the read with continue_meas=True.
+    def get_waveform(self, channel=1, continue_meas=True):
+        if self._acquiring is not False:
+            self['Visa'].write('ACQuire:STATE STOP')
+            self._acquiring = False
+        preamble = self.get_preamble(channel)
+        volts = self._to_volts(channel, self.get_curve(channel))
+        if continue_meas:
+            self['Visa'].write('ACQuire:STATE RUN')
+            self._acquiring = True
+        return ['CH%i'%(channel), volts, [preamble['xincr']], [preamble['scale']]]
+
+    # Waveforms of several channels from one acquisition: returns the time axis (s) and the volts as array (channel, point).
+    # single=True takes a new single sequence (waits for the next trigger), single=False freezes the running acquisition.
+    # With continue_meas the scope runs freely again afterwards.
+    def get_waveforms(self, channels=(1, 2), continue_meas=True, single=True):
+        for channel in channels:
+            self.get_preamble(channel)
+        if single:
+            self['Visa'].write('ACQuire:STOPAfter SEQuence;:ACQuire:STATE RUN')
+            self['Visa'].query('*OPC?')  # returns when the sequence is acquired
+        elif self._acquiring is not False:
+            self['Visa'].write('ACQuire:STATE STOP')
+        self._acquiring = False
+        curves = self.get_curves(channels)
+        if continue_meas:
+            self['Visa'].write('ACQuire:STOPAfter RUNSTop;:ACQuire:STATE RUN')
+            self._acquiring = True
+        volts = np.empty((len(channels), min([len(curve) for curve in curves])))
+        for i, channel in enumerate(channels):
+            volts[i] = self._to_volts(channel, curves[i][:volts.shape[1]])
+        t = np.arange(volts.shape[1])*self.get_preamble(channels[0])['xincr']
+        return t, volts
+
     def get_cos_fit(self,frequency, channel=1, continue_meas=True):
-        meas = self['Oscilloscope'].get_waveform(channel=channel, continue_meas=continue_meas)
+        meas = self.get_waveform(channel=channel, continue_meas=continue_meas)
         y = meas[1]
         x = np.linspace(0,meas[2][0]*len(y),len(y))
         p_approx = pltfit.guess_cos_params(y,frequency)
         popt, perr =  pltfit.fit_no_err(function=pltfit.func_cos, x=x, y=y, presets=p_approx)
         return popt, perr
 
+    # Cosine fits of several channels of one acquisition, returns lists of popt and perr
+    def get_cos_fits(self, frequency, channels=(1, 2), continue_meas=True):
+        t, volts = self.get_waveforms(channels, continue_meas=continue_meas)
+        fits = [pltfit.fit_no_err(function=pltfit.func_cos, x=t, y=y, presets=pltfit.guess_cos_params(y, frequency)) for y in volts]
+        return [fit[0] for fit in fits], [fit[1] for fit in fits]
+
     
+    # Configures measurement slots once, e.g. {'VOUT': ('MEAN', 2), 'VOUT_PK2PK': ('PK2pk', 2)} (name: (type, channel)),
+    # types of the TDS3000: MEAN, RMS, PK2pk, AMPlitude, FREQuency, PERIod, HIGH, LOW, MAXimum, MINImum, ...
+    def setup_measurements(self, measurements):
+        if len(measurements) > MEASUREMENT_SLOTS:
+            raise ValueError('The scope has only %i measurement slots'%(MEASUREMENT_SLOTS))
+        self._measurements = OrderedDict()
+        commands = []
+        for slot, (name, (kind, channel)) in enumerate(measurements.items(), start=1):
+            commands.append('MEASUrement:MEAS%i:TYPe %s;SOUrce1 CH%i;STATE ON'%(slot, kind, channel))
+            self._measurements[name] = slot
+        for slot in range(len(measurements)+1, MEASUREMENT_SLOTS+1):
+            commands.append('MEASUrement:MEAS%i:STATE OFF'%(slot))
+        self['Visa'].write(';:'.join(commands))
+
+    # Results of the measurement slots as {name: value}, only a few bytes instead of a waveform.
+    # Measurements without valid result are nan.
+    def get_measurements(self, names=None):
+        names = list(self._measurements) if names is None else names
+        self._run()
+        response = self['Visa'].query(';:'.join(['MEASUrement:MEAS%i:VALue?'%(self._measurements[name]) for name in names]))
+        values = [float(field.split()[-1]) for field in response.strip().split(';')]
+        return OrderedDict((name, np.nan if value >= NO_RESULT else value) for name, value in zip(names, values))
+
+    # Single measurement without slot (MEASUrement:IMMed)
+    def get_measurement(self, kind='MEAN', channel=1):
+        self._run()
+        value = float(self['Visa'].query('MEASUrement:IMMed:TYPe %s;SOUrce1 CH%i;:MEASUrement:IMMed:VALue?'%(kind, channel)).split()[-1])
+        return np.nan if value >= NO_RESULT else value
+
+    # Measurements of a stopped acquisition would not change anymore
+    def _run(self):
+        if self._acquiring is False:
+            self['Visa'].write('ACQuire:STOPAfter RUNSTop;:ACQuire:STATE RUN')
+            self._acquiring = True
+
     # Generates x values for a taken waveform measurement (We only know the number of dots and the scale width)
     def gen_waveform_x(self, waveform):
         return np.linspace(0, waveform[2][0]*len(waveform[1]),len(waveform[1]))
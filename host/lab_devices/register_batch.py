@@ -0,0 +1,147 @@
+#####
+# Batched register transactions for LF_SFF_MIO (see LF_SFF_MIO.batch())
+# Register writes and GPAC settings are queued and written once when the batch is flushed.
+# Several settings of the same register/channel only write the last value.
+# Every written setting is recorded in dut.applied, with only_changed=True settings that are
+# already applied with the same value are skipped.
+#####
+import time
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from basil.HL.HardwareLayer import HardwareLayer
+from basil.HL.GPAC import MuxPca9540B
+
+class i2c_mux_coalescer():
+    # Stands in for the interface of a GPAC while a batch is flushed. basil selects the bus of the
+    # I2C mux (PCA9540B) before and switches back after every DAC, ADC and power GPIO access, which
+    # are two extra USB transfers each. Here a mux selection is only sent when the next access needs
+    # another bus than the one currently selected.
+    def __init__(self, intf, mux_addr):
+        self._intf = intf
+        self._mux_addr = mux_addr
+        self._bus = None  # unknown until the first selection was sent
+        self._pending = None
+        self.transfers = 0
+        self.skipped = 0
+
+    def _select(self):
+        if self._pending is not None:
+            if self._pending != self._bus:
+                self._intf.write(self._mux_addr, self._pending)
+                self.transfers += 1
+                self._bus = self._pending
+            else:
+                self.skipped += 1
+            self._pending = None
+
+    def write(self, addr, data, *args, **kwargs):
+        if addr == self._mux_addr:
+            if self._pending is not None:
+                self.skipped += 1
+            self._pending = bytes(data)
+            return
+        self._select()
+        self.transfers += 1
+        return self._intf.write(addr, data, *args, **kwargs)
+
+    def read(self, addr, *args, **kwargs):
+        self._select()
+        self.transfers += 1
+        return self._intf.read(addr, *args, **kwargs)
+
+    # Sends the last mux selection, so the mux is left on the bus basil expects
+    def close(self):
+        self._select()
+
+    def __getattr__(self, name):
+        return getattr(self._intf, name)
+
+
+# The GPAC accesses the power and ADC mux GPIOs through own driver objects on the same interface
+def _set_intf(drv, old, new):
+    for obj in [drv]+list(vars(drv).values()):
+        if isinstance(obj, HardwareLayer) and obj._intf is old:
+            obj._intf = new
+
+
+@contextmanager
+def coalesced_i2c(drivers):
+    # Routes the accesses of the given drivers through an i2c_mux_coalescer, drivers without I2C mux are ignored
+    coalescers = []
+    for drv in drivers:
+        if isinstance(drv, MuxPca9540B) and drv not in [c[0] for c in coalescers]:
+            coalescers.append((drv, drv._intf))
+            _set_intf(drv, drv._intf, i2c_mux_coalescer(drv._intf, drv._base_addr+drv.PCA9540B_ADD))
+    try:
+        yield
+    finally:
+        for drv, intf in coalescers:
+            coalescer = drv._intf
+            try:
+                coalescer.close()
+                logging.debug('%s: %i I2C transfers, %i mux selections skipped'%(drv.name, coalescer.transfers, coalescer.skipped))
+            finally:
+                _set_intf(drv, coalescer, intf)
+
+
+class register_batch():
+    def __init__(self, dut, only_changed=False):
+        self._dut = dut
+        self.only_changed = only_changed
+        self._queue = OrderedDict()  # (register, action): (args, kwargs)
+        self.writes = 0
+        self.merged = 0
+        self.unchanged = 0
+
+    def _add(self, key, *args, **kwargs):
+        if key in self._queue:
+            del self._queue[key]
+            self.merged += 1
+        self._queue[key] = (args, kwargs)
+
+    # Queues a write of a StdRegister (e.g. CONTROL). value sets the whole register, fields single fields.
+    # The register content changes immediately, the write happens on flush.
+    def write(self, register, value=None, **fields):
+        if value is not None:
+            self._dut[register] = value
+        for field in fields:
+            self._dut[register][field] = fields[field]
+        self._add((register, 'write'))
+
+    def set_voltage(self, register, value, unit='V'):
+        self._add((register, 'set_voltage'), value, unit=unit)
+
+    def set_current(self, register, value, unit='A'):
+        self._add((register, 'set_current'), value, unit=unit)
+
+    def set_enable(self, register, value):
+        self._add((register, 'set_enable'), value)
+
+    # Flushes the queue and waits, for hardware settling constraints (e.g. holding the reset)
+    def settle(self, seconds):
+        self.flush()
+        time.sleep(seconds)
+
+    def flush(self):
+        if not self._queue:
+            return
+        try:
+            with self._dut.lock, coalesced_i2c([self._dut[register]._drv for register, action in self._queue]):
+                for (register, action), (args, kwargs) in self._queue.items():
+                    # StdRegisters are recorded with their content, GPAC settings with their arguments
+                    if action == 'write':
+                        value = {'data': list(self._dut[register].tobytes())}
+                    else:
+                        value = {'args': list(args), 'kwargs': kwargs}
+                    if self.only_changed and self._dut.applied.get((register, action)) == value:
+                        self.unchanged += 1
+                        continue
+                    getattr(self._dut[register], action)(*args, **kwargs)
+                    self._dut.applied[(register, action)] = value
+                    self.writes += 1
+        finally:
+            self._queue = OrderedDict()
+
+    def discard(self):
+        self._queue = OrderedDict()
@@ -0,0 +1,80 @@
+#####
+# Coalescing of SCPI commands for slow links (e.g. the function generator at 57600 baud)
+# While coalesced, the commands written to the interface of a driver are collected and sent as one line
+# ("PULS:PER 0.001;:VOLT:HIGH 1.2;:VOLT:LOW 1.1;:OUTP ON;*OPC?"), which ends with one *OPC? so the
+# instrument has executed all of them when the block is left. Queries are sent on their own, after the
+# commands collected before them.
+#
+# Example:
+#   with coalesced_scpi([func_gen['Pulser']]):
+#       func_gen['Pulser'].set_voltage_high(1.2)
+#       func_gen['Pulser'].set_voltage_low(1.1)
+#####
+import logging
+from contextlib import contextmanager
+
+MAX_LINE = 128  # characters per line, the input buffer of the instruments is small
+
+class scpi_coalescer():
+    def __init__(self, intf, max_line=MAX_LINE):
+        self._intf = intf
+        self.max_line = max_line
+        self._pending = []
+        self.commands = 0
+        self.lines = 0
+
+    def _join(self, commands):
+        # commands are absolute (':' prefix), except the common commands (*XXX)
+        return ';'.join([c if c.startswith('*') or c.startswith(':') or i == 0 else ':'+c for i, c in enumerate(commands)])
+
+    def write(self, data):
+        self._pending.append(data.strip())
+        self.commands += 1
+
+    # Sends the collected commands, with sync the last line ends with *OPC? and its response is read
+    def flush(self, sync=False):
+        lines = []
+        for command in self._pending:
+            if lines and len(self._join(lines[-1]+[command, '*OPC?'])) <= self.max_line:
+                lines[-1].append(command)
+            else:
+                lines.append([command])
+        self._pending = []
+        for i, line in enumerate(lines):
+            self.lines += 1
+            if sync and i == len(lines)-1:
+                response = self._intf.query(self._join(line+['*OPC?']))
+                if response.strip() != '1':
+                    logging.warning('Unexpected *OPC? response after %s: %s'%(self._join(line), response))
+            else:
+                self._intf.write(self._join(line))
+
+    def query(self, data):
+        self.flush()
+        self.lines += 1
+        return self._intf.query(data)
+
+    def read(self, *args, **kwargs):
+        self.flush()
+        return self._intf.read(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._intf, name)
+
+
+@contextmanager
+def coalesced_scpi(drivers, max_line=MAX_LINE):
+    # drivers are basil scpi hardware layers (or their scpi_shadow)
+    drivers = [getattr(drv, '_drv', drv) for drv in drivers]
+    coalescers = []
+    for drv in drivers:
+        coalescers.append((drv, drv._intf))
+        drv._intf = scpi_coalescer(drv._intf, max_line)
+    try:
+        yield
+        for drv, intf in coalescers:
+            drv._intf.flush(sync=True)
+            logging.debug('%s: %i commands in %i lines'%(drv.name, drv._intf.commands, drv._intf.lines))
+    finally:
+        for drv, intf in coalescers:
+            drv._intf = intf
@@ -0,0 +1,133 @@
+#####
+# Write-through shadow of the settings of basil scpi instruments (oscilloscope, function generator)
+# Wraps the hardware layer of a Dut (e.g. dut['Oscilloscope']) and keeps the last written value of every
+# set_<name> and the last response of every get_<name> command:
+#   - a set with the value that is already set is not sent
+#   - a get of a setting is answered from the cache, only settings that have a set_<name> command are cached,
+#     measured or read-only values (and the names in volatile) are always queried
+#   - a set drops the cached response of the setting, commands that change several settings at once
+#     (e.g. APPLy, *RST) drop the whole shadow
+# Changes done on the front panel are not seen, resync() queries all shadowed settings again.
+#####
+import logging
+
+from basil.HL.scpi import scpi
+
+class scpi_shadow():
+    invalidate_all = ['reset', 'data_init']  # commands (by name) that change many settings
+    invalidate_all_scpi = ['APPL', '*RST', 'SYST:PRES', 'FACT']  # ... or by SCPI command prefix
+
+    def __init__(self, drv, volatile=()):
+        self._drv = drv
+        self.volatile = set(volatile)
+        self._set = {}  # (name, channel): str(value)
+        self._get = {}  # (name, channel): response
+        self.hits = 0
+        self.misses = 0
+
+    def _command(self, name, channel):
+        commands = self._drv._scpi_commands
+        try:
+            return commands['channel %s'%(channel)][name] if channel is not None else commands[name]
+        except KeyError:
+            return None
+
+    def _cacheable(self, setting, channel):
+        return setting not in self.volatile and self._command('set_'+setting, channel) is not None
+
+    def __getattr__(self, name):
+        attr = getattr(self._drv, name)
+        if not callable(attr) or name.startswith('_'):
+            return attr
+        prefix, _, setting = name.partition('_')
+
+        def method(*args, **kwargs):
+            channel = kwargs.get('channel', None)
+            key = (setting, channel)
+            if prefix == 'set' and len(args) == 1 and self._cacheable(setting, channel):
+                if self._set.get(key) == str(args[0]):
+                    self.hits += 1
+                    return
+                self.misses += 1
+                self._get.pop(key, None)
+                result = attr(*args, **kwargs)
+                self._set[key] = str(args[0])
+                self._invalidate_by(name, channel)
+                return result
+            if prefix == 'get' and not args and self._cacheable(setting, channel):
+                if key in self._get:
+                    self.hits += 1
+                    return self._get[key]
+                self.misses += 1
+                self._get[key] = attr(*args, **kwargs)
+                return self._get[key]
+            self._invalidate_by(name, channel)
+            return attr(*args, **kwargs)
+        return method
+
+    def _invalidate_by(self, name, channel):
+        command = (self._command(name, channel) or '').upper()
+        if name in self.invalidate_all or any([command.startswith(prefix) for prefix in self.invalidate_all_scpi]):
+            self.invalidate()
+
+    def invalidate(self):
+        self._set = {}
+        self._get = {}
+
+    # Drops a setting, e.g. after writing it without the shadow
+    def discard(self, setting, channel=None):
+        self._set.pop((setting, channel), None)
+        self._get.pop((setting, channel), None)
+
+    # Value of a setting as float (the last word of the response, so it works with HEADer ON and OFF)
+    def get_value(self, setting, channel=None):
+        kwargs = {} if channel is None else {'channel': channel}
+        return float(str(getattr(self, 'get_'+setting)(**kwargs)).split()[-1])
+
+    # Queries all shadowed settings that can be queried and returns the ones that differ from the shadow
+    def resync(self):
+        keys = set(self._set) | set(self._get)
+        expected = dict(self._get)
+        expected.update(self._set)
+        self.invalidate()
+        changed = {}
+        for setting, channel in keys:
+            if self._command('get_'+setting, channel) is None:
+                continue
+            kwargs = {} if channel is None else {'channel': channel}
+            response = getattr(self._drv, 'get_'+setting)(**kwargs)
+            self._get[(setting, channel)] = response
+            if not _same(expected[(setting, channel)], response):
+                changed[(setting, channel)] = (expected[(setting, channel)], response)
+        if changed:
+            logging.warning('%s: settings changed outside of the shadow: %s'%(self._drv.name, changed))
+        return changed
+
+    def hit_rate(self):
+        return self.hits/float(self.hits+self.misses) if self.hits+self.misses else 0.
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate()}
+
+    def log_stats(self):
+        logging.info('%s: %i of %i commands answered or dropped by the shadow (%.0f %%)'%(self._drv.name, self.hits, self.hits+self.misses, 100*self.hit_rate()))
+
+
+# Compares a written value with a query response, numerically if possible ('2.0E-1' == ':CH2:SCALE 200.0E-3')
+def _same(value, response):
+    value = str(value).split()[-1].strip('"')
+    response = str(response).split()[-1].strip('"')
+    try:
+        return float(value) == float(response)
+    except ValueError:
+        # SCPI answers with the short form of keywords (e.g. TRIGgered -> TRIG)
+        return value.upper().startswith(response.upper()) or response.upper().startswith(value.upper())
+
+
+# Wraps all scpi hardware layers of a Dut with a scpi_shadow, returns {name: shadow}
+def shadow_scpi_drivers(dut, volatile=()):
+    shadows = {}
+    for name, drv in dut._hardware_layer.items():
+        if isinstance(drv, scpi):
+            shadows[name] = dut._hardware_layer[name] = scpi_shadow(drv, volatile)
+    return shadows
@@ -0,0 +1,129 @@
+#####
+# Background monitor of the LF_SFF_MIO supplies and biases
+# A thread samples LF_SFF_MIO.read_status() every interval seconds into a fixed size numpy ring buffer
+# (one record per sample: time and voltage/current of every channel) and optionally appends the samples
+# to a csv file. get() returns the samples of any time window from memory without touching the hardware.
+# With a device_worker the reads are queued as SLOW_CONTROL commands and wait for pending readouts.
+#####
+import os
+import time
+import logging
+import threading
+import numpy as np
+
+from utils.ring_buffer import ring_buffer
+from lab_devices.LF_SFF_MIO import STATUS_CHANNELS
+from lab_devices.device_worker import SLOW_CONTROL
+
+class slow_control_monitor():
+    def __init__(self, dut, interval=1., size=86400, channels=None, file=None, worker=None):
+        self.dut = dut
+        self.worker = worker
+        self.interval = interval
+        self.channels = list(STATUS_CHANNELS if channels is None else channels)
+        # voltage in V, current in A
+        self.dtype = np.dtype([('time', np.float64)]+[(name+suffix, np.float64) for name in self.channels for suffix in ['_V', '_I']])
+        self._history = ring_buffer(size, dtype=self.dtype)
+        self._lock = threading.Lock()  # protects the history
+        self._stop = threading.Event()
+        self._thread = None
+        self.file = file
+        self._file = None
+        self.samples = 0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.file:
+            new_file = not os.path.isfile(self.file)
+            self._file = open(self.file, 'a')
+            if new_file:
+                self._file.write(','.join(self.dtype.names)+'\n')
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='slow_control')
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._file:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self):
+        next_sample = time.time()
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception:
+                # a failed read (e.g. I2C not acknowledged) must not end the monitor
+                self.errors += 1
+                logging.exception('slow_control_monitor: reading the status failed')
+            next_sample += self.interval
+            delay = next_sample-time.time()
+            if delay < 0:
+                # the reads take longer than the interval, do not try to catch up
+                next_sample = time.time()
+                delay = 0
+            self._stop.wait(delay)
+
+    # Reads all channels once and stores the sample, can also be called without the thread
+    def sample(self):
+        if self.worker is not None:
+            status = self.worker.call(self.dut.read_status, self.channels, priority=SLOW_CONTROL)
+        else:
+            status = self.dut.read_status(self.channels)
+        record = np.zeros(1, dtype=self.dtype)
+        record['time'] = status.time
+        for name in self.channels:
+            reading = getattr(status, name)
+            record[name+'_V'] = reading.voltage
+            record[name+'_I'] = reading.current
+        with self._lock:
+            self._history.push(record)
+            self.samples += 1
+        if self._file:
+            self._file.write(','.join(['%.6f'%(record['time'][0])]+['%.9g'%(record[field][0]) for field in self.dtype.names[1:]])+'\n')
+            self._file.flush()
+        return record[0]
+
+    # Samples with start <= time < stop (unix time, None for no limit), oldest first
+    def get(self, start=None, stop=None):
+        with self._lock:
+            data = self._history.peek()
+        mask = np.ones(len(data), dtype=bool)
+        if start is not None:
+            mask &= data['time'] >= start
+        if stop is not None:
+            mask &= data['time'] < stop
+        return data[mask]
+
+    # Samples of the last seconds
+    def last(self, seconds):
+        return self.get(start=time.time()-seconds)
+
+    def latest(self):
+        with self._lock:
+            data = self._history.peek()
+        return data[-1] if len(data) else None
+
+    # Mean and standard deviation of every field over a time window, e.g. to check the drift during a sweep point
+    def summary(self, start=None, stop=None):
+        data = self.get(start, stop)
+        return {name: (np.mean(data[name]), np.std(data[name])) for name in self.dtype.names[1:]} if len(data) else {}
+
+    # Samples of a csv file written by a monitor, as structured array
+    @staticmethod
+    def load(file):
+        return np.genfromtxt(file, delimiter=',', names=True)
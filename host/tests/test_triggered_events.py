@@ -0,0 +1,56 @@
+#####
+# Triggered acquisition against the simulated board (lab_devices/LF_SFF_MIO_sim.py)
+# Run from host/: python -m pytest tests
+#####
+import os
+import sys
+import yaml
+import numpy as np
+import pytest
+from bitarray import bitarray
+
+HOST = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, HOST)
+from lab_devices.LF_SFF_MIO_sim import LF_SFF_MIO_sim
+
+
+# One ADC_Trigger edge per sequencer start, so every event needs its own trigger()
+def single_trigger_SEQ(dut, nSamples):
+    adc_trigger = bitarray('0100000000')
+    dut['SEQ'].reset()
+    dut['SEQ'].set_clk_divide(1)
+    dut['SEQ'].set_repeat_start(0)
+    dut['SEQ'].set_repeat(1)
+    dut['SEQ'].set_size(len(adc_trigger))
+    dut['SEQ']['ADC_Trigger'][0:len(adc_trigger)] = adc_trigger
+    dut['SEQ'].write()
+    dut['SEQ'].start()
+
+
+@pytest.fixture
+def dut(monkeypatch):
+    monkeypatch.chdir(HOST)
+    # fast USB, so the transfer time of a drain does not hide a missing wait for the end of an event
+    dut = LF_SFF_MIO_sim(yaml.load(open('./lab_devices/LF_SFF_MIO.yaml', 'r'), Loader=yaml.Loader), timing={'usb_rate': 1e9}, seed=0)
+    dut.init()
+    yield dut
+    dut.close()
+
+
+def test_triggered_done_flag_stays_set(dut):
+    # as in the firmware, a trigger does not clear CONF_DONE
+    dut['fadc0_rx'].reset()
+    dut['fadc0_rx'].set_data_count(20000)
+    dut['fadc0_rx'].set_en_trigger(True)
+    single_trigger_SEQ(dut, 20000)
+    assert dut['fadc0_rx'].is_done()
+
+
+def test_read_triggered_events(dut):
+    nSamples, nEvents = 20000, 10
+    events, timestamps, dead_time = dut.read_triggered_events('fadc0_rx', single_trigger_SEQ, nSamples, nEvents, timeout=5)
+    assert events.shape == (nEvents, nSamples)
+    assert dut['fadc0_rx'].get_count_lost() == 0
+    # each event ends at least its capture time (2 ms) after the previous one
+    assert np.all(np.diff(timestamps) >= nSamples/10e6)
+
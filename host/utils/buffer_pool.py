@@ -0,0 +1,25 @@
+#####
+# Per channel pool of numpy arrays. Repeated captures with the same (or a smaller)
+# length get the same memory back instead of allocating new arrays every time.
+#####
+import numpy as np
+
+class buffer_pool():
+    def __init__(self):
+        self._buffers = {}
+
+    # Returns a buffer of the given size for (channel, name, dtype). The content is undefined.
+    def get(self, channel, name, size, dtype=np.float64):
+        key = (channel, name, np.dtype(dtype))
+        buf = self._buffers.get(key)
+        if buf is None or len(buf) < size:
+            buf = np.empty(size, dtype=dtype)
+            self._buffers[key] = buf
+        return buf[:size]
+
+    def clear(self, channel=None):
+        if channel is None:
+            self._buffers = {}
+        else:
+            for key in [key for key in self._buffers if key[0] == channel]:
+                del self._buffers[key]
@@ -92,6 +92,9 @@ def create_dir_tree():
                 'name':'data',
                 'sub':[]
             }]
+        },{
+            'name': 'benchmarks',
+            'sub':[]
         }]
     }
 
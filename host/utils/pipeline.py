@@ -0,0 +1,50 @@
+#####
+# Overlaps data taking and analysis
+# The measurement loop submits the analysis of every point (fits, plots) to a pool of worker processes
+# and continues with the next point, results() returns the results in the order they were submitted.
+# At most max_pending analyses are queued, submit() waits if the analysis can not keep up.
+# The workers are started fresh (spawn) instead of forked from a process with open instrument links and
+# threads, so the calling script needs the if __name__ == '__main__' guard and fn a module level function.
+#
+# Example:
+#   with ordered_pipeline() as pipeline:
+#       for point in points:
+#           pipeline.submit(point, analyse, take_data(point))
+#       for point, result in pipeline.results():
+#           ...
+#####
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import matplotlib.pyplot as plt
+
+# Workers render into files only, without the GUI backend of the measurement script
+def _init_worker():
+    plt.switch_backend('Agg')
+
+class ordered_pipeline():
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or max(1, (os.cpu_count() or 2)-1)  # one core stays with the data taking
+        self.max_pending = max_pending or 4*self.workers
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker)
+        self._jobs = []  # (key, future) in submission order
+
+    def submit(self, key, fn, *args, **kwargs):
+        pending = [future for _, future in self._jobs if not future.done()]
+        if len(pending) >= self.max_pending:
+            wait(pending, return_when=FIRST_COMPLETED)
+        self._jobs.append((key, self._pool.submit(fn, *args, **kwargs)))
+
+    # (key, result) of all submitted jobs in submission order, waits for the running ones
+    def results(self):
+        for key, future in self._jobs:
+            yield key, future.result()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
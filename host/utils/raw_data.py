@@ -0,0 +1,333 @@
+#####
+# Chunked binary container for raw 14 bit FADC codes
+#
+# A raw file is a plain sequence of .npy records (numpy format 1.0) written back to back:
+#   record 0:   uint8 array with the UTF-8 encoded JSON metadata
+#               {'format': 'LF_SFF_RAW', 'version': 1, 'layout': 'stream'|'events', 'channels': [...],
+#                'sample_clock': Hz, 'calibration': {channel: [a, a_err, b, b_err]}, 'bias': {...}, 'pad': code, ...}
+#   record 1-N: data segments (uint16 codes by default), one per append() call
+#               layout 'stream': shape (channels, samples), consecutive segments continue the stream.
+#               If the channels of a segment have different lengths (lost words), the shorter ones are
+#               filled up with the pad code (the largest value of the dtype, no 14 bit ADC code)
+#               layout 'events': shape (events, channels, samples)
+# Segments can be appended while the acquisition is running. Every record can be read with np.load()
+# from an open file object, so the files stay readable without this module.
+# raw_reader memory-maps the segments, so files larger than the RAM can be sliced and reduced block-wise.
+#####
+import json
+import time
+import logging
+import numpy as np
+
+RAW_FORMAT = 'LF_SFF_RAW'
+RAW_VERSION = 1
+RAW_PAD = 0xffff  # pad code of uint16 files
+
+class raw_writer():
+    def __init__(self, path, channels, layout='stream', sample_clock=10e6, calibration=None, bias=None, dtype=np.uint16, **meta):
+        if layout not in ['stream', 'events']:
+            raise ValueError('Unknown layout: %s'%(layout))
+        if isinstance(channels, str):
+            channels = [channels]
+        self.path = path
+        self.channels = list(channels)
+        self.layout = layout
+        self.dtype = np.dtype(dtype)
+        self.segments = 0
+        self.length = 0  # samples per channel ('stream') or number of events ('events')
+        self.pad = int(np.iinfo(self.dtype).max) if self.dtype.kind in 'ui' else None
+        self.padded = {channel: 0 for channel in self.channels}  # pad samples written per channel
+        self.meta = {'format': RAW_FORMAT,
+                     'version': RAW_VERSION,
+                     'layout': layout,
+                     'channels': self.channels,
+                     'sample_clock': sample_clock,
+                     'calibration': calibration or {},
+                     'bias': bias or {},
+                     'pad': self.pad,
+                     'created': time.strftime("%d.%m.%Y %H:%M:%S")}
+        self.meta.update(meta)
+        self._file = open(path, 'wb')
+        header = np.frombuffer(json.dumps(self.meta, default=float).encode('utf-8'), dtype=np.uint8)
+        np.lib.format.write_array(self._file, header, version=(1, 0))
+
+    # data: (samples,) or (channels, samples) for 'stream', (events, samples) or (events, channels, samples) for 'events'
+    # For 'stream' a list with one array per channel can be given, shorter channels are filled up with the pad code
+    def append(self, data):
+        if self.layout == 'stream' and isinstance(data, (list, tuple)):
+            data = self._pad_channels(data)
+        data = np.asarray(data)
+        if self.layout == 'stream' and data.ndim == 1:
+            data = data[np.newaxis]
+        elif self.layout == 'events' and data.ndim == 2:
+            data = data[:, np.newaxis]
+        if data.shape[-2] != len(self.channels):
+            raise ValueError('Got %i channels, file has %i'%(data.shape[-2], len(self.channels)))
+        np.lib.format.write_array(self._file, data.astype(self.dtype, copy=False), version=(1, 0))
+        self.segments += 1
+        self.length += data.shape[-1] if self.layout == 'stream' else data.shape[0]
+
+    def _pad_channels(self, data):
+        length = max([len(channel) for channel in data])
+        out = np.full((len(data), length), self.pad, dtype=self.dtype)
+        for i, channel in enumerate(data):
+            out[i, :len(channel)] = channel
+            if len(channel) < length:
+                self.padded[self.channels[i]] += length-len(channel)
+                logging.warning('%s: %i samples missing, padded with %i'%(self.channels[i], length-len(channel), self.pad))
+        return out
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+# Lazy view of one channel: the memory-mapped segments concatenated along the first axis
+# (samples for 'stream', events for 'events'). Indexing only reads the requested part from disk.
+class raw_view():
+    def __init__(self, segments):
+        self._segments = segments
+        self._offsets = np.cumsum([0]+[len(seg) for seg in segments])
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    @property
+    def shape(self):
+        if self._segments:
+            return (len(self),)+self._segments[0].shape[1:]
+        return (0,)
+
+    @property
+    def dtype(self):
+        return self._segments[0].dtype if self._segments else np.dtype(np.uint16)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            return self[key[0]][(slice(None),)+key[1:]] if isinstance(key[0], slice) else self[key[0]][key[1:]]
+        if isinstance(key, slice):
+            return self._get_slice(*key.indices(len(self)))
+        if np.ndim(key) == 0:
+            i = int(key)
+            if i < 0:
+                i += len(self)
+            if not 0 <= i < len(self):
+                raise IndexError('Index %i out of range for length %i'%(key, len(self)))
+            seg = np.searchsorted(self._offsets, i, side='right')-1
+            return np.array(self._segments[seg][i-self._offsets[seg]])
+        index = np.asarray(key)
+        if index.dtype == bool:
+            if len(index) != len(self):
+                raise IndexError('Boolean index of length %i does not match length %i'%(len(index), len(self)))
+            index = np.flatnonzero(index)
+        index = np.where(index < 0, index+len(self), index).astype(np.int64)
+        if np.any((index < 0) | (index >= len(self))):
+            raise IndexError('Index out of range for length %i'%(len(self)))
+        out = np.empty((len(index),)+self.shape[1:], dtype=self.dtype)
+        seg = np.searchsorted(self._offsets, index, side='right')-1
+        for s in np.unique(seg):
+            mask = seg == s
+            out[mask] = self._segments[s][index[mask]-self._offsets[s]]
+        return out
+
+    def _get_slice(self, start, stop, step):
+        if step < 0:
+            n = len(range(start, stop, step))
+            if n == 0:
+                return np.empty((0,)+self.shape[1:], dtype=self.dtype)
+            return self._get_slice(start+(n-1)*step, start+1, -step)[::-1]
+        pieces = []
+        for seg, offset in zip(self._segments, self._offsets):
+            end = offset+len(seg)
+            if end <= start or offset >= stop:
+                continue
+            first = start if start >= offset else start+-(-(offset-start)//step)*step
+            if first < min(stop, end):
+                pieces.append(seg[first-offset:min(stop, end)-offset:step])
+        if not pieces:
+            return np.empty((0,)+self.shape[1:], dtype=self.dtype)
+        return np.concatenate(pieces)
+
+    # Yields consecutive in-memory blocks of block_size entries (the last one may be shorter)
+    def blocks(self, block_size=1000000, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        for i in range(start, stop, block_size):
+            yield i, self._get_slice(i, min(i+block_size, stop), 1)
+
+
+class raw_reader():
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self.meta = json.loads(np.load(self._file).tobytes().decode('utf-8'))
+        if self.meta.get('format') != RAW_FORMAT:
+            raise ValueError('%s is not a %s file'%(path, RAW_FORMAT))
+        self.layout = self.meta['layout']
+        self.channels = self.meta['channels']
+        self.sample_clock = self.meta['sample_clock']
+        self.pad = self.meta.get('pad')  # filler of missing samples, skipped by the statistics below
+        self._segments = self._map_segments()
+
+    # Parses the npy headers only and memory-maps the data of every complete segment
+    def _map_segments(self):
+        segments = []
+        size = self._file.seek(0, 2)
+        self._file.seek(self._skip_record())
+        while self._file.tell() < size:
+            try:
+                np.lib.format.read_magic(self._file)
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self._file)
+            except ValueError:
+                logging.warning('Truncated segment header in %s, ignoring the rest of the file'%(self.path))
+                break
+            offset = self._file.tell()
+            nbytes = int(np.prod(shape))*dtype.itemsize
+            if offset+nbytes > size:
+                logging.warning('Truncated segment in %s, ignoring the rest of the file'%(self.path))
+                break
+            if nbytes:
+                segments.append(np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape, order='F' if fortran_order else 'C'))
+            self._file.seek(offset+nbytes)
+        return segments
+
+    def _skip_record(self):
+        self._file.seek(0)
+        np.lib.format.read_magic(self._file)
+        shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(self._file)
+        return self._file.tell()+int(np.prod(shape))*dtype.itemsize
+
+    def close(self):
+        self._segments = []
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return sum([seg.shape[-1] if self.layout == 'stream' else seg.shape[0] for seg in self._segments])
+
+    def _channel_index(self, channel):
+        if isinstance(channel, str):
+            return self.channels.index(channel)
+        return channel
+
+    # Lazy view of all samples ('stream') or all events of shape (events, samples) ('events') of one channel
+    def channel(self, channel):
+        ch = self._channel_index(channel)
+        if self.layout == 'stream':
+            return raw_view([seg[ch] for seg in self._segments])
+        return raw_view([seg[:, ch] for seg in self._segments])
+
+    def __getitem__(self, channel):
+        return self.channel(channel)
+
+    # Returns event i of an 'events' file, shape (channels, samples)
+    def event(self, i):
+        if self.layout != 'events':
+            raise ValueError('%s has no events (layout %s)'%(self.path, self.layout))
+        return raw_view(self._segments)[i]
+
+    def calibration(self, channel):
+        if isinstance(channel, int):
+            channel = self.channels[channel]
+        calib = self.meta['calibration'].get(channel)
+        if calib is None:
+            raise KeyError('No calibration stored for %s'%(channel))
+        return calib
+
+    def to_volts(self, data, channel, dtype=np.float64):
+        a, a_err, b, b_err = self.calibration(channel)
+        out = np.multiply(data, a, dtype=dtype)
+        np.add(out, b, out=out)
+        return out
+
+    # Block-wise mean and standard deviation of one channel (Chan et al. pairwise update)
+    def mean_std(self, channel, block_size=1000000, calibrated=False):
+        n, mean, m2 = 0, 0., 0.
+        for i, block in self.channel(channel).blocks(block_size):
+            if self.pad is not None:
+                block = block[block != self.pad]
+            if not block.size:
+                continue
+            block = block.astype(np.float64)
+            n_b, mean_b = block.size, block.mean()
+            m2_b = np.square(block-mean_b).sum()
+            delta = mean_b-mean
+            mean += delta*n_b/(n+n_b)
+            m2 += m2_b+delta**2*n*n_b/(n+n_b)
+            n += n_b
+        std = np.sqrt(m2/n) if n else np.nan
+        if not n:
+            mean = np.nan
+        if calibrated:
+            a, a_err, b, b_err = self.calibration(channel)
+            return a*mean+b, abs(a)*std
+        return mean, std
+
+    def mean(self, channel, block_size=1000000, calibrated=False):
+        return self.mean_std(channel, block_size, calibrated)[0]
+
+    def std(self, channel, block_size=1000000, calibrated=False):
+        return self.mean_std(channel, block_size, calibrated)[1]
+
+    # Block-wise histogram of the codes, default is one bin per 14 bit ADC code
+    # With calibrated=True the bin edges are returned in volts
+    def histogram(self, channel, bins=2**14, range=(0, 2**14), block_size=1000000, calibrated=False):
+        counts = None
+        for i, block in self.channel(channel).blocks(block_size):
+            if self.pad is not None:
+                block = block[block != self.pad]
+            hist, edges = np.histogram(block, bins=bins, range=range)
+            counts = hist if counts is None else counts+hist
+        if counts is None:
+            counts, edges = np.histogram([], bins=bins, range=range)
+        if calibrated:
+            edges = self.to_volts(edges, channel)
+        return counts, edges
+
+    # Finds threshold crossings in a 'stream' file. polarity=-1 looks for negative going pulses.
+    # Returns the sample index of every crossing and the pulse height (extremum within window samples)
+    # in codes. After a crossing the next min_distance samples are ignored.
+    def find_pulses(self, channel, threshold, polarity=1, window=100, min_distance=None, block_size=1000000):
+        if self.layout != 'stream':
+            raise ValueError('Pulse finding needs a stream file, use channel() to get the events')
+        view = self.channel(channel)
+        min_distance = window if min_distance is None else min_distance
+        positions, heights = [], []
+        last = -min_distance-1
+        previous = None
+        for start in range(0, len(view), block_size):
+            length = min(block_size, len(view)-start)
+            # read window samples ahead so the pulse height of crossings at the end of a block is complete
+            raw = view[start:min(start+length+window, len(view))]
+            block = raw.astype(np.int32)*polarity
+            if self.pad is not None:
+                # pad samples never cross the threshold and do not count as pulse height
+                block[raw == self.pad] = np.iinfo(np.int32).min
+            above = block[:length] > threshold*polarity
+            edges = np.flatnonzero(above[1:] & ~above[:-1])+1
+            if previous is not None and above[0] and not previous:
+                edges = np.concatenate([[0], edges])
+            previous = above[-1]
+            if len(edges) == 0:
+                continue
+            if len(block) < length+window:
+                block = np.concatenate([block, np.full(length+window-len(block), block[-1])])
+            peaks = np.lib.stride_tricks.sliding_window_view(block, window)[edges].max(axis=1)*polarity
+            for edge, peak in zip(edges+start, peaks):
+                if edge-last > min_distance:
+                    positions.append(edge)
+                    heights.append(peak)
+                    last = edge
+        return np.array(positions, dtype=np.int64), np.array(heights)
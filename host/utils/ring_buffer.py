@@ -0,0 +1,69 @@
+#####
+# Preallocated numpy ring buffer. Data is copied in and out, the backing array
+# is never reallocated, so long running readouts work in constant memory.
+#####
+import numpy as np
+
+class ring_buffer():
+    def __init__(self, size, dtype=np.uint32):
+        self.size = size
+        self._buffer = np.empty(size, dtype=dtype)
+        self._head = 0  # next write position
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def free(self):
+        return self.size-self._count
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    # Copies as much of data as fits into the buffer and returns the number of stored entries
+    def put(self, data):
+        n = min(len(data), self.free)
+        first = min(n, self.size-self._head)
+        self._buffer[self._head:self._head+first] = data[:first]
+        self._buffer[:n-first] = data[first:n]
+        self._head = (self._head+n) % self.size
+        self._count += n
+        return n
+
+    # Removes the n oldest entries and copies them into out (allocated if not given)
+    def get(self, n, out=None):
+        n = min(n, self._count)
+        if out is None:
+            out = np.empty(n, dtype=self._buffer.dtype)
+        tail = (self._head-self._count) % self.size
+        first = min(n, self.size-tail)
+        out[:first] = self._buffer[tail:tail+first]
+        out[first:n] = self._buffer[:n-first]
+        self._count -= n
+        return out[:n]
+
+    # Stores data and overwrites the oldest entries if the buffer is full (history).
+    # Returns the number of overwritten entries.
+    def push(self, data):
+        data = data[len(data)-min(len(data), self.size):]
+        n = len(data)
+        overwritten = max(0, n-self.free)
+        first = min(n, self.size-self._head)
+        self._buffer[self._head:self._head+first] = data[:first]
+        self._buffer[:n-first] = data[first:n]
+        self._head = (self._head+n) % self.size
+        self._count = min(self._count+n, self.size)
+        return overwritten
+
+    # Copies all entries (oldest first) without removing them
+    def peek(self, out=None):
+        n = self._count
+        if out is None:
+            out = np.empty(n, dtype=self._buffer.dtype)
+        tail = (self._head-n) % self.size
+        first = min(n, self.size-tail)
+        out[:first] = self._buffer[tail:tail+first]
+        out[first:n] = self._buffer[:n-first]
+        return out[:n]